@@ -241,6 +241,11 @@ class Commands:
             if editor.content and editor.content.editable:
                 editor.content.text.toggle_comment()
 
+    def goto_matching_bracket(self, *_) -> None:
+        if editor := self.base.editorsmanager.active_editor:
+            if editor.content and editor.content.editable:
+                editor.content.text.goto_matching_bracket()
+
     def find_symbol(self, *_) -> None:
         if editor := self.base.editorsmanager.active_editor:
             if editor.content and editor.content.editable:
@@ -373,6 +378,19 @@ class Commands:
     def show_logs(self, *_) -> None:
         self.base.panel.show_logs()
 
+    def show_latency_report(self, *_) -> None:
+        self.base.latency.log_report()
+
+    def export_latency_profile(self, *_) -> None:
+        if not self.base.latency.enabled:
+            return self.base.latency.log_report()
+
+        if path := filedialog.askdirectory(title="Export Latency Profile To..."):
+            stats, trace = self.base.latency.export(path)
+            self.base.notifications.info(
+                f"Latency profile exported to {stats}, {trace}"
+            )
+
     def show_welcome(self, *_) -> None:
         self.base.editorsmanager.add_welcome()
 
@@ -5,27 +5,48 @@ import subprocess
 import typing
 from threading import Thread
 
+import psutil
+
 if typing.TYPE_CHECKING:
     from biscuit import App
 
 
+# bytes read at a time from a stream that is not framed
+CHUNK_SIZE = 1 << 16
+# initial size of the buffer frames are read into, it grows to the largest frame
+FRAME_BUFFER_SIZE = 1 << 16
+# seconds a process has to exit once terminated, before it is killed
+TERMINATE_TIMEOUT = 2
+
+
 class IO:
-    """Handling input/output of a process in a separate thread"""
+    """Handling input/output of a process in a separate thread
+
+    Output is read in chunks as it comes. With `framed` set, it is read as messages
+    framed with a `Content-Length` header (as language servers do): the headers are
+    parsed and the content is read whole into a buffer, each message is queued as one
+    item. Reading a message no longer costs a queue operation per byte."""
 
-    def __init__(self, master, cmd: str, cwd: str) -> None:
+    def __init__(self, master, cmd: str, cwd: str, framed: bool = False) -> None:
         """Initialize the IO class
 
         Args:
             master: The parent object
             cmd (str): The command to run
-            cwd (str): The working directory"""
+            cwd (str): The working directory
+            framed (bool, optional): Whether the output is framed with a
+                Content-Length header. Defaults to False."""
 
         self.master = master
         self.base: App = master.base
         self.alive = True
         self.cmd = cmd
         self.cwd = cwd
+        self.framed = framed
+        # called from the reader thread when output is queued or has ended
+        self.on_output: typing.Callable[[], typing.Any] | None = None
 
+        self.p: subprocess.Popen | None = None
         self.in_queue = queue.Queue()  # input data
         self.out_queue = queue.Queue()  # output results
 
@@ -38,21 +59,35 @@ class IO:
 
         self.in_queue.put(buf)
 
-    def read(self) -> None:
-        buf = bytearray()
+    def read(self) -> bytes | None:
+        """Returns the output read so far, None if there is none yet
+        and an empty bytes object once the output has ended"""
+
+        # checked first, once the reader is done everything it read is queued
+        alive = self.t_out.is_alive()
+        chunks = []
         while True:
             try:
-                buf += self.out_queue.get(block=False)
+                chunks.append(self.out_queue.get(block=False))
             except queue.Empty:
                 break
 
-        if self.t_out.is_alive() and not buf:
+        if chunks:
+            return b"".join(chunks)
+        if alive:
             return None
-        return bytes(buf)
+        return b""
 
     def start(self, *_) -> None:
         """Start the process and the input/output threads"""
 
+        self.spawn()
+        self.base.logger.info(f"PID: {self.p.pid} CMD: {self.cmd} CWD: {self.cwd}")
+
+    def spawn(self) -> None:
+        """Start the process and the input/output threads, without logging it so it
+        can be called off the UI thread"""
+
         self.p = subprocess.Popen(
             self.cmd,
             cwd=self.cwd,
@@ -61,7 +96,6 @@ class IO:
             stderr=subprocess.PIPE,
             shell=True,
         )
-        self.base.logger.info(f"PID: {self.p.pid} CMD: {self.cmd} CWD: {self.cwd}")
 
         Thread(target=self._process_in, daemon=True).start()
         self.t_out = Thread(target=self._process_out, daemon=True)
@@ -71,12 +105,46 @@ class IO:
         self.t_err = Thread(target=self._process_err, daemon=True)
         self.t_err.start()
 
-    def stop(self, *_) -> None:
-        """Stop the process"""
+    def stop(self, timeout: float = 0) -> None:
+        """Stop the process and the threads reading and writing it. Blocks until the
+        process is gone. The command runs in a shell, the processes it started are
+        terminated along with it
+
+        Args:
+            timeout (float, optional): Seconds the process has to exit by itself
+                before it is terminated. Defaults to 0."""
+
+        if timeout:
+            try:
+                self.p.wait(timeout)
+            except subprocess.TimeoutExpired:
+                pass
 
         self.alive = False
-        self.p.kill()
-        self.p.wait()
+        try:
+            children = psutil.Process(self.p.pid).children(recursive=True)
+        except psutil.Error:
+            children = []
+
+        if self.p.poll() is None:
+            self.p.terminate()
+        for child in children:
+            try:
+                child.terminate()
+            except psutil.Error:
+                pass
+
+        try:
+            self.p.wait(TERMINATE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.p.kill()
+            self.p.wait()
+        _, alive = psutil.wait_procs(children, TERMINATE_TIMEOUT)
+        for child in alive:
+            try:
+                child.kill()
+            except psutil.Error:
+                pass
 
     def _process_in(self) -> None:
         while self.alive:
@@ -94,15 +162,62 @@ class IO:
                 pass
 
     def _process_out(self) -> None:
+        if self.framed:
+            self._process_frames()
+            return self.notify()
+
         while self.alive:
-            data = self.p.stdout.read(1)
+            data = self.p.stdout.read1(CHUNK_SIZE)
             if not data:
                 break
             self.out_queue.put(data)
+            self.notify()
+        self.notify()
+
+    def notify(self) -> None:
+        if self.on_output:
+            self.on_output()
+
+    def _process_frames(self) -> None:
+        stdout = self.p.stdout
+        buffer = bytearray(FRAME_BUFFER_SIZE)
+
+        while self.alive:
+            header = bytearray()
+            length = None
+            while True:
+                line = stdout.readline()
+                if not line:
+                    return
+                header += line
+                if not line.strip():
+                    break
+
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+
+            if length is None:
+                # not a frame, passed on as it is
+                self.out_queue.put(bytes(header))
+                self.notify()
+                continue
+
+            if len(buffer) < length:
+                buffer = bytearray(length)
+            view = memoryview(buffer)[:length]
+            read = 0
+            while read < length:
+                if not (n := stdout.readinto(view[read:])):
+                    return
+                read += n
+
+            self.out_queue.put(bytes(header) + view.tobytes())
+            self.notify()
 
     def _process_err(self) -> None:
         while self.alive:
-            data = self.p.stderr.read(1)
+            data = self.p.stderr.read1(CHUNK_SIZE)
             if not data:
                 break
             print(
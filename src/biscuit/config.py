@@ -12,6 +12,8 @@ from .extensions import ExtensionManager
 from .git import Git
 from .history import HistoryManager
 from .language import LanguageServerManager
+from .latency import LatencyProfiler
+from .saving import SaveManager
 from .session import SessionManager
 from .settings import Settings
 from .workspaces import WorkspaceManager
@@ -74,6 +76,8 @@ class ConfigManager:
         self.game_manager = GameManager(self)
         self.language_server_manager = LanguageServerManager(self)
         self.execution_manager = ExecutionManager(self)
+        self.save_manager = SaveManager(self)
+        self.latency = LatencyProfiler(self)
         self.debugger_manager = DebuggerManager(self)
 
     def setup_path(self, appdir: str) -> None:
@@ -1,9 +1,7 @@
 from __future__ import annotations
 
-import re
 import tkinter as tk
 import typing
-from itertools import chain
 
 if typing.TYPE_CHECKING:
     from biscuit.editor.text import Text
@@ -11,6 +9,7 @@ if typing.TYPE_CHECKING:
 
 from biscuit.common.ui import Toplevel
 
+from ..text.words import WordIndex
 from .item import CompletionItem
 
 
@@ -18,7 +17,8 @@ class AutoComplete(Toplevel):
     """Floating window for autocomplete suggestions.
 
     In lsp mode, it receives completions from the language server.
-    In regular mode, it generates completions from the current tab's words.
+    In regular mode, it generates completions from the current tab's words, or the
+    words of all the open tabs when `shared_word_completions` is enabled.
 
     NOTE: As of now, the window is limited to 10 items, not scrollable."""
 
@@ -34,6 +34,8 @@ class AutoComplete(Toplevel):
         self.active = False
         self.selected = 0
         self.row = 0
+        # words of all the tabs, when they share their words for completions
+        self.words = WordIndex()
 
         # 10 items are created and stored in menu_items, then moved to active_items
         # when needed. This is to avoid creating and destroying items on every update.
@@ -179,7 +181,8 @@ class AutoComplete(Toplevel):
 
     def update_completions(self, tab: Text):
         """Update the completions with words generated from the current tab.
-        The words are filtered and prioritized based on exact match, starts with, and includes.
+        Words starting with the term come first, closest to the cursor and most used
+        first, then words around the cursor that include the term.
 
         Args:
             tab (Text): The current tab."""
@@ -193,19 +196,11 @@ class AutoComplete(Toplevel):
             self.hide()
             return
 
-        exact, starts, includes = [], [], []
-        for word in tab.words:
-            if word == term:
-                exact.append(word)
-            elif word.startswith(term):
-                starts.append(word)
-            elif term in word:
-                includes.append(word)
-        new = list(chain(exact, starts, includes))
+        new = tab.get_word_completions(term)
 
         if new:
             self.lsp_mode = False
-            self.set_active_items(new[:10], term)
+            self.set_active_items(new, term)
             self.show(tab)
         else:
             self.hide()
@@ -3,22 +3,30 @@ from __future__ import annotations
 import re
 import tkinter as tk
 import typing
+from bisect import bisect_left, bisect_right
+from itertools import islice
 
 from biscuit.common.icons import Icons
 from biscuit.common.ui import ButtonsEntry, Frame, IconButton, Toplevel
 
 if typing.TYPE_CHECKING:
     from biscuit.common.ui import Text
+    from biscuit.editor.text.changes import Change
 
 from .results import FindResults
 
 
 class FindReplace(Toplevel):
-    """Floating find and replace window"""
+    """Floating find and replace window
+
+    Matches are kept as sorted lists of start and end offsets, navigated by bisecting.
+    Edits to the text rescan only the lines they touched, see `edited`, and only the
+    matches in view are tagged. Replace all substitutes every match in one edit."""
 
     def __init__(self, base, *args, **kwargs) -> None:
         super().__init__(base, *args, **kwargs)
-        self.offset = 10
+        # gap between the window and the right edge of the text
+        self.margin = 10
         self.active = False
         self.overrideredirect(True)
         self.config(padx=1, pady=1, bg=self.base.theme.border)
@@ -27,7 +35,13 @@ class FindReplace(Toplevel):
         self.text = None
         self.matchstring = None
         self.replacestring = None
-        self.matches = None
+        self.re_ = None
+        # offsets of the matches, and whether there were more than the limit
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self.capped = False
+        self.stale = False
+        self.limit = self.base.settings.config.find_results_limit
         self.term = tk.StringVar()
 
         self.container = Frame(self, padx=5, pady=5, **self.base.theme.findreplace)
@@ -82,7 +96,7 @@ class FindReplace(Toplevel):
                 self.text.winfo_rootx()
                 + self.text.winfo_width()
                 - self.winfo_width()
-                - self.offset
+                - self.margin
             )
             y = self.text.winfo_rooty()
             self.geometry(f"+{x}+{y}")
@@ -93,6 +107,8 @@ class FindReplace(Toplevel):
     def show(self, text: Text):
         self.text = text
         self.active = True
+        # edits made while hidden were not followed
+        self.stale = True
         self.update_idletasks()
 
         if self.text.tag_ranges(tk.SEL):
@@ -101,6 +117,8 @@ class FindReplace(Toplevel):
             self.findbox.insert("0", selection)
             self.text.mark_set("insert", tk.SEL_FIRST)
             self.get_find_input()
+        else:
+            self.highlight_matches()
 
         self._follow_root()
         self.deiconify()
@@ -119,14 +137,36 @@ class FindReplace(Toplevel):
             return 0
         return self.text.count("1.0", self.text.index(tk.INSERT), "chars")[0]
 
-    def highlight_matches(self):
+    def offset(self, index: str) -> int:
+        """Returns the offset of an index from the start of the text"""
+
+        return (self.text.count("1.0", index, "chars") or (0,))[0]
+
+    def highlight_matches(self, text: Text = None):
+        """Tag the matches in view, and the one at the cursor"""
+
+        if not self.active or not self.text or (text and text is not self.text):
+            return
+        if self.stale:
+            return self.get_find_input()
+
         self.text.tag_remove("found", "1.0", "end")
         self.text.tag_remove("foundcurrent", "1.0", "end")
 
-        for pos, match in self.matches.items():
-            start = match.start()
-            end = match.end()
-            self.text.tag_add("found", f"1.0+{start}c", f"1.0+{end}c")
+        first, last = self.text.get_visible_range()
+        top = self.offset(f"{first}.0")
+        bottom = self.offset(f"{last}.end")
+        i, j = bisect_right(self.ends, top), bisect_left(self.starts, bottom)
+        if i < j:
+            # relative to the first line in view, counting from 1.0 walks the lines above
+            self.text.tag_add(
+                "found",
+                *(
+                    f"{first}.0+{offset - top}c"
+                    for k in range(i, j)
+                    for offset in (self.starts[k], self.ends[k])
+                ),
+            )
 
         if self.is_on_match():
             self.highlight_current()
@@ -135,29 +175,93 @@ class FindReplace(Toplevel):
         self.text.tag_remove("foundcurrent", "1.0", "end")
 
         current = self.current
-        match = self.matches[current]
+        k = bisect_left(self.starts, current)
+        if k == len(self.starts) or self.starts[k] != current:
+            return
+
+        self.text.tag_add("foundcurrent", f"1.0+{current}c", f"1.0+{self.ends[k]}c")
+
+    def compile(self, term: str) -> re.Pattern | None:
+        try:
+            return re.compile(term)
+        except re.error:
+            return None
 
-        start = match.start()
-        end = match.end()
-        self.text.tag_add("foundcurrent", f"1.0+{start}c", f"1.0+{end}c")
+    def scan(self, text: str, offset: int = 0) -> typing.Iterator[tuple[int, int]]:
+        """Yields the (start, end) offsets of the matches in a text that starts at `offset`"""
+
+        for match in self.re_.finditer(text):
+            if match.end() > match.start():
+                yield offset + match.start(), offset + match.end()
 
     def get_find_input(self):
+        self.stale = False
         if self.findbox.get() == "":
             self.text.tag_remove("found", "1.0", "end")
             self.text.tag_remove("foundcurrent", "1.0", "end")
+            self.starts, self.ends = [], []
+            self.matchstring = ""
             return
 
         current = self.current
-        self.matches = {}
         self.matchstring = self.findbox.get()
-        self.re_ = re.compile(self.matchstring)
+        self.re_ = self.compile(self.matchstring)
 
-        for match in self.re_.finditer(self.text.get_all_text()):
-            self.matches[match.start()] = match
+        matches = []
+        if self.re_:
+            matches = list(islice(self.scan(self.text.get_all_text()), self.limit + 1))
+        self.capped = len(matches) > self.limit
+        matches = matches[: self.limit]
+        self.starts = [start for start, _ in matches]
+        self.ends = [end for _, end in matches]
 
         self.highlight_matches()
         self.text.mark_set("insert", f"1.0 + {current}c")
-        self.results_count.show(len(self.matches))
+        self.show_count()
+
+    def show_count(self):
+        self.results_count.show(len(self.starts))
+        if self.capped:
+            self.results_count.config(text=f"{self.limit}+ results")
+
+    def edited(self, text: Text, change: Change) -> None:
+        """Rescan the lines touched by an edit and move the matches below it
+
+        Args:
+            text (Text): The text edited
+            change (Change): The edit, already applied"""
+
+        if not self.active or text is not self.text or self.stale or not self.re_:
+            return
+        if self.capped:
+            # matches past the limit were never found, start over
+            self.stale = True
+            return
+
+        line, column = change.start
+        delta = len(change.new_text) - len(change.old_text)
+        window = text.get(f"{line}.0", f"{change.new_end[0]}.end")
+        lo = self.offset(f"{line}.{column}") - column
+        hi = lo + len(window)
+
+        # matches touching the lines edited, before the edit
+        i, j = bisect_right(self.ends, lo), bisect_left(self.starts, hi - delta)
+        if i < j and (self.starts[i] < lo or self.ends[j - 1] > hi - delta):
+            # they run past the lines, rescan all of them
+            lo = min(lo, self.starts[i])
+            hi = max(hi, self.ends[j - 1] + delta)
+            window = text.get(f"1.0+{lo}c", f"1.0+{hi}c")
+
+        found = list(self.scan(window, lo))
+        self.starts[i:j] = [start for start, _ in found]
+        self.ends[i:j] = [end for _, end in found]
+        k = i + len(found)
+        if delta:
+            self.starts[k:] = [start + delta for start in self.starts[k:]]
+            self.ends[k:] = [end + delta for end in self.ends[k:]]
+
+        self.capped = len(self.starts) > self.limit
+        self.show_count()
 
     def find(self, *_):
         """Find all matches and highlight them"""
@@ -169,70 +273,82 @@ class FindReplace(Toplevel):
         self.get_find_input()
         self.lift()
 
+    def goto(self, offset: int):
+        index = f"1.0 + {offset}c"
+        self.text.mark_set("insert", index)
+        self.text.see(index)
+        self.highlight_matches()
+
     def next_match(self, *_):
         """Moves the editor focus to the next match"""
-        if self.findbox.get() != self.matchstring:
+        if self.findbox.get() != self.matchstring or self.stale:
             self.get_find_input()
 
-        matchpos = [i for i in sorted(self.matches.keys()) if i > self.current]
-
-        if len(matchpos) > 0:
-            next_index = f"1.0 + {matchpos[0]}c"
-            self.text.mark_set("insert", next_index)
-            self.text.see(next_index)
-            self.highlight_current()
-        elif len(self.matches) > 0:
-            self.text.mark_set("insert", "1.0")
-
-            if self.is_on_match():
-                self.highlight_current()
-            else:
-                self.next_match()
+        if self.starts:
+            k = bisect_right(self.starts, self.current)
+            self.goto(self.starts[k] if k < len(self.starts) else self.starts[0])
 
         self.lift()
         self.text.focus()
 
     def prev_match(self, *_):
         """Moves the editor focus to the previous match"""
-        if self.findbox.get() != self.matchstring:
+        if self.findbox.get() != self.matchstring or self.stale:
             self.get_find_input()
-        matchpos = [i for i in sorted(self.matches.keys()) if i < self.current]
-        if len(matchpos) > 0:
-            next_index = f"1.0 + {matchpos[-1]}c"
-            self.text.mark_set("insert", next_index)
-            self.text.see(next_index)
-            self.highlight_current()
-        elif len(self.matches) > 0:
-            self.text.mark_set("insert", "end")
-            self.prev_match()
+
+        if self.starts:
+            k = bisect_left(self.starts, self.current)
+            self.goto(self.starts[k - 1])
+
         self.lift()
         self.text.focus()
 
     def replace(self, *_):
         """replaces current (in focus) match, removing the match and writing the replace string"""
         self.replacestring = self.replacebox.get()
-        if self.findbox.get() != self.matchstring:
+        if self.findbox.get() != self.matchstring or self.stale:
             self.get_find_input()
         if self.is_on_match():
-            match = self.matches[self.current]
-            self.text.delete(f"1.0 + {match.start()}c", f"1.0 + {match.end()}c")
-            self.text.insert(f"1.0 + {self.current}c", self.replacestring)
-            self.get_find_input()
+            k = bisect_left(self.starts, self.current)
+            self.text.replace(
+                f"1.0 + {self.starts[k]}c",
+                f"1.0 + {self.ends[k]}c",
+                self.replacestring,
+            )
+            self.highlight_matches()
         self.lift()
         self.text.focus()
 
     def is_on_match(self):
         """tells if the editor is currently pointing to a match"""
-        return self.current in self.matches
+        current = self.current
+        k = bisect_left(self.starts, current)
+        return k < len(self.starts) and self.starts[k] == current
 
     def replace_all(self, *_):
-        """replaces all occurences of the string for the replace string, it will even replace partial words."""
-        self.get_find_input()
-        nmatches = len(self.matches)
+        """replaces all occurences of the string for the replace string, it will even replace partial words.
+        The substitution is made on a copy of the text and applied as a single edit."""
+        self.replacestring = self.replacebox.get()
+        if self.findbox.get() != self.matchstring or self.stale:
+            self.get_find_input()
+        if not self.re_ or not self.starts:
+            return
+
         current = self.current
-        self.text.mark_set("insert", "1.0")
-        self.replace()
-        for i in range(nmatches):
-            self.next_match()
-            self.replace()
-        self.text.mark_set("insert", f"1.0 + {current}c")
+        text = self.text.get_all_text()[:-1]
+        pieces = []
+        first = last = None
+        for start, end in self.scan(text):
+            if first is None:
+                first = last = start
+            pieces += (text[last:start], self.replacestring)
+            last = end
+        if first is None:
+            return
+
+        replaced = "".join(pieces)
+        self.text.replace(f"1.0 + {first}c", f"1.0 + {last}c", replaced)
+        self.text.mark_set("insert", f"1.0 + {min(current, first + len(replaced))}c")
+        self.get_find_input()
+        self.lift()
+        self.text.focus()
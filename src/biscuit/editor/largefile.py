@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import mmap
+import os
+import threading
+import tkinter as tk
+from array import array
+from bisect import bisect_right
+
+from biscuit.common.ui import Entry, Scrollbar, Text
+
+from .editorbase import BaseEditor
+
+# bytes scanned for line breaks at a time
+SCAN_BLOCK = 1 << 24
+# characters of a line that are shown, the rest is cut off
+MAX_LINE_LENGTH = 10000
+
+
+class LineIndex:
+    """Memory mapped file along with the offsets its lines start at.
+
+    The offsets are found on a thread, lines become available as it goes."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.size = len(self.map)
+        self.offsets = array("Q", [0])
+        self.done = False
+        threading.Thread(target=self.scan, daemon=True).start()
+
+    def scan(self) -> None:
+        find, offsets = self.map.find, self.offsets
+        try:
+            for start in range(0, self.size, SCAN_BLOCK):
+                end = min(start + SCAN_BLOCK, self.size)
+                found = []
+                i = find(b"\n", start, end)
+                while i != -1:
+                    found.append(i + 1)
+                    i = find(b"\n", i + 1, end)
+                offsets.extend(found)
+        except ValueError:
+            # closed in the meantime
+            return
+        self.done = True
+
+    @property
+    def lines(self) -> int:
+        return len(self.offsets)
+
+    def get_line(self, line: int) -> str:
+        """Returns the text of a line (0-based), cut at `MAX_LINE_LENGTH`"""
+
+        start = self.offsets[line]
+        if line + 1 < len(self.offsets):
+            end = self.offsets[line + 1]
+        else:
+            end = self.map.find(b"\n", start, start + 4 * MAX_LINE_LENGTH)
+            end = self.size if end == -1 else end
+        end = min(end, start + 4 * MAX_LINE_LENGTH)
+
+        text = self.map[start:end].decode("utf-8", errors="replace")
+        return text.rstrip("\r\n")[:MAX_LINE_LENGTH]
+
+    def get_lines(self, first: int, count: int) -> list[str]:
+        return [self.get_line(i) for i in range(first, min(first + count, self.lines))]
+
+    def line_at(self, offset: int) -> int | None:
+        """Returns the line (0-based) holding the byte at `offset`,
+        None if it is past the lines indexed so far"""
+
+        if not self.done and offset >= self.offsets[-1]:
+            return None
+        return bisect_right(self.offsets, offset) - 1
+
+    def find(self, term: bytes, start: int) -> int:
+        """Returns the offset of the next occurrence of `term` from `start`,
+        wrapping around to the start of the file. -1 if there is none."""
+
+        offset = self.map.find(term, start)
+        if offset == -1 and start:
+            offset = self.map.find(term, 0, start + len(term))
+        return offset
+
+    def close(self) -> None:
+        self.map.close()
+
+
+class LargeFileViewer(BaseEditor):
+    """Read-only viewer for files too large for the text editor.
+
+    The file is memory mapped and only the lines in view are held by the text widget,
+    they are paged in from the map as the view scrolls. Line offsets are indexed on a
+    thread, goto line and find work against the map. There is no highlighting,
+    language server or minimap."""
+
+    def __init__(self, master, path: str, *args, **kwargs) -> None:
+        super().__init__(master, path, editable=False, *args, **kwargs)
+        self.filename = os.path.basename(path)
+        self.font = self.base.settings.font
+
+        self.index = LineIndex(path)
+        # first line in view, line at the cursor and position of the last match
+        self.top = 0
+        self.current: int | None = None
+        self.match: tuple[int, int, int] | None = None
+        self.match_offset = -1
+
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(1, weight=1)
+
+        self.findbar = Entry(self, hint="Find in file (Enter for next match)")
+        self.findbar.bind("<Return>", self.find_next)
+        self.findbar.bind("<Escape>", self.hide_findbar)
+
+        self.linenumbers = Text(
+            self,
+            width=8,
+            font=self.font,
+            relief=tk.FLAT,
+            bd=0,
+            highlightthickness=0,
+            cursor="arrow",
+            **self.base.theme.editors.linenumbers,
+        )
+        self.linenumbers.config(fg=self.base.theme.editors.linenumbers.number.foreground)
+        self.linenumbers.tag_config("number", justify=tk.RIGHT)
+
+        self.view = Text(
+            self,
+            font=self.font,
+            wrap=tk.NONE,
+            relief=tk.FLAT,
+            bd=0,
+            highlightthickness=0,
+            **self.base.theme.editors.text,
+        )
+        self.view.tag_config("currentline", background=self.base.theme.editors.currentline)
+        self.view.tag_config(
+            "found", background=self.base.theme.editors.foundcurrent, foreground="white"
+        )
+        self.scrollbar = Scrollbar(
+            self, orient=tk.VERTICAL, command=self.on_scrollbar, style="EditorScrollbar"
+        )
+
+        self.linenumbers.grid(row=1, column=0, sticky=tk.NS)
+        self.view.grid(row=1, column=1, sticky=tk.NSEW)
+        self.scrollbar.grid(row=1, column=2, sticky=tk.NS)
+
+        for widget in (self.view, self.linenumbers):
+            widget.bind("<MouseWheel>", self.on_mousewheel)
+            widget.bind("<Button-4>", lambda _: self.scroll(-3))
+            widget.bind("<Button-5>", lambda _: self.scroll(3))
+        self.view.bind("<Configure>", lambda _: self.show(self.top))
+        self.view.bind("<Up>", lambda _: self.scroll(-1))
+        self.view.bind("<Down>", lambda _: self.scroll(1))
+        self.view.bind("<Prior>", lambda _: self.scroll(-self.rows))
+        self.view.bind("<Next>", lambda _: self.scroll(self.rows))
+        self.view.bind("<Control-Home>", lambda _: self.show(0) or "break")
+        self.view.bind("<Control-End>", lambda _: self.show(self.index.lines) or "break")
+        self.view.bind("<Control-f>", self.show_findbar)
+        self.view.bind("<Button-1>", lambda _: self.view.focus_set())
+        self.bind("<Destroy>", self.on_destroy)
+
+        self.show(0)
+        self.poll_index()
+
+    @property
+    def rows(self) -> int:
+        """Number of lines that fit in the view"""
+
+        return max(1, self.view.winfo_height() // self.font.metrics("linespace"))
+
+    def show(self, top: int) -> None:
+        """Show the lines from `top` (0-based) on, paging them in from the map"""
+
+        total = self.index.lines
+        rows = self.rows
+        self.top = top = max(0, min(top, total - rows))
+        lines = self.index.get_lines(top, rows + 1)
+
+        self.view.config(state=tk.NORMAL)
+        self.view.delete("1.0", tk.END)
+        self.view.insert("1.0", "\n".join(lines))
+        if self.current is not None and top <= self.current < top + len(lines):
+            row = self.current - top + 1
+            self.view.tag_add("currentline", f"{row}.0", f"{row + 1}.0")
+        if self.match and top <= self.match[0] < top + len(lines):
+            line, column, length = self.match
+            row = line - top + 1
+            self.view.tag_add("found", f"{row}.{column}", f"{row}.{column + length}")
+        self.view.config(state=tk.DISABLED)
+
+        self.linenumbers.config(state=tk.NORMAL)
+        self.linenumbers.delete("1.0", tk.END)
+        self.linenumbers.insert(
+            "1.0",
+            "\n".join(str(i) for i in range(top + 1, top + len(lines) + 1)),
+            "number",
+        )
+        self.linenumbers.config(state=tk.DISABLED)
+
+        self.scrollbar.set(top / total, min(1, (top + rows) / total))
+
+    def scroll(self, delta: int) -> str:
+        self.show(self.top + delta)
+        return "break"
+
+    def on_mousewheel(self, event: tk.Event) -> str:
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def on_scrollbar(self, action: str, amount: str, unit: str = None) -> None:
+        if action == tk.MOVETO:
+            self.show(int(float(amount) * self.index.lines))
+        else:
+            self.scroll(int(amount) * (self.rows if unit == tk.PAGES else 1))
+
+    def poll_index(self) -> None:
+        """Keep the scrollbar in step with the lines indexed so far"""
+
+        if not self.winfo_exists():
+            return
+
+        self.show(self.top)
+        if not self.index.done:
+            self.after(250, self.poll_index)
+
+    def goto_line(self, line: int) -> None:
+        """Scroll to a line (1-based) and mark it"""
+
+        self.current = max(0, min(line - 1, self.index.lines - 1))
+        self.show(self.current - self.rows // 2)
+        self.view.focus_set()
+
+    def show_findbar(self, *_) -> str:
+        self.findbar.grid(row=0, column=0, columnspan=3, sticky=tk.EW)
+        self.findbar.entry.focus_set()
+        return "break"
+
+    def hide_findbar(self, *_) -> None:
+        self.findbar.grid_forget()
+        self.view.focus_set()
+
+    def find_next(self, *_) -> None:
+        """Go to the next occurrence of the term in the find bar, searching the map"""
+
+        if not (term := self.findbar.get().encode()):
+            return
+
+        if self.match_offset != -1:
+            start = self.match_offset + 1
+        else:
+            start = self.index.offsets[self.top]
+
+        offset = self.index.find(term, start)
+        if offset == -1:
+            self.base.notifications.info(f"No results for '{term.decode()}'")
+            return
+
+        line = self.index.line_at(offset)
+        if line is None:
+            self.base.notifications.info("Lines are still being indexed, try again")
+            return
+
+        column = len(
+            self.index.map[self.index.offsets[line] : offset].decode(
+                "utf-8", errors="replace"
+            )
+        )
+        self.match_offset = offset
+        self.match = (line, column, len(term.decode("utf-8", errors="replace")))
+        self.goto_line(line + 1)
+        self.findbar.entry.focus_set()
+
+    def focus(self) -> None:
+        self.view.focus_set()
+
+    def on_destroy(self, event: tk.Event) -> None:
+        if event.widget is self:
+            self.index.close()
@@ -0,0 +1,414 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+
+from ...language.languages import Languages
+
+BRACKET_MAP = {"(": ")", "{": "}", "[": "]"}
+
+# patterns of the quoted strings brackets are ignored in, an unterminated one runs
+# to the end of the line
+DOUBLE_QUOTED = r'"(?:\\.|[^"\\])*"?'
+SINGLE_QUOTED = r"'(?:\\.|[^'\\])*'?"
+# a single quote that also marks lifetimes, type variables or primes only
+# quotes a character literal
+CHARACTER = r"'(?:\\u\{[0-9a-fA-F]+\}|\\.|[^'\\])'"
+
+STRINGS = (DOUBLE_QUOTED, SINGLE_QUOTED)
+string_patterns_map = {
+    Languages.RUST: (DOUBLE_QUOTED, CHARACTER),
+    Languages.HASKELL: (DOUBLE_QUOTED, CHARACTER),
+    Languages.OCAML: (DOUBLE_QUOTED, CHARACTER),
+    Languages.FSHARP: (DOUBLE_QUOTED, CHARACTER),
+    Languages.SML: (DOUBLE_QUOTED, CHARACTER),
+    Languages.ELM: (DOUBLE_QUOTED, CHARACTER),
+    Languages.IDRIS: (DOUBLE_QUOTED, CHARACTER),
+    Languages.LEAN: (DOUBLE_QUOTED, CHARACTER),
+    Languages.VB_NET: (DOUBLE_QUOTED,),
+    Languages.CLOJURE: (DOUBLE_QUOTED,),
+    Languages.COMMON_LISP: (DOUBLE_QUOTED,),
+    Languages.EMACS_LISP: (DOUBLE_QUOTED,),
+    Languages.SCHEME: (DOUBLE_QUOTED,),
+    Languages.RACKET: (DOUBLE_QUOTED,),
+}
+
+
+def get_string_patterns(language: str) -> tuple[str, ...]:
+    """Get the patterns of the quoted strings of a language."""
+
+    return string_patterns_map.get(language, STRINGS)
+
+
+# lines are kept in chunks, a chunk is split when it grows past twice this size
+CHUNK_SIZE = 64
+
+# a line is summarized as (brackets, delta, low): the (column, char) of its brackets,
+# the change in depth over the line and the lowest depth reached, relative to its start
+Line = tuple[tuple[tuple[int, str], ...], int, int]
+Summary = tuple[int, int, int]
+
+
+def combine(a: Summary, b: Summary) -> Summary:
+    """Combine the (lines, delta, low) summaries of two consecutive ranges"""
+
+    return a[0] + b[0], a[1] + b[1], min(a[2], a[1] + b[2])
+
+
+class Chunk:
+    """A run of consecutive lines, along with the depth at the start of each line"""
+
+    def __init__(self, lines: list[Line]) -> None:
+        self.lines = lines
+        self.update()
+
+    def update(self) -> None:
+        depth = low = 0
+        self.starts = []
+        for _, delta, line_low in self.lines:
+            self.starts.append(depth)
+            low = min(low, depth + line_low)
+            depth += delta
+        self.delta, self.low = depth, low
+
+    @property
+    def summary(self) -> Summary:
+        return len(self.lines), self.delta, self.low
+
+
+class ChunkTree:
+    """Segment tree over the summaries of the chunks, answers where a line is,
+    what the depth at a chunk is and where the depth drops, in O(log n)"""
+
+    def __init__(self, summaries: list[Summary]) -> None:
+        self.size = 1
+        while self.size < len(summaries):
+            self.size *= 2
+
+        self.nodes: list[Summary] = [(0, 0, 0)] * (2 * self.size)
+        self.nodes[self.size : self.size + len(summaries)] = summaries
+        for i in range(self.size - 1, 0, -1):
+            self.nodes[i] = combine(self.nodes[2 * i], self.nodes[2 * i + 1])
+
+    @property
+    def lines(self) -> int:
+        return self.nodes[1][0]
+
+    def set(self, chunk: int, summary: Summary) -> None:
+        node = chunk + self.size
+        self.nodes[node] = summary
+        while node > 1:
+            node //= 2
+            self.nodes[node] = combine(self.nodes[2 * node], self.nodes[2 * node + 1])
+
+    def locate(self, index: int) -> tuple[int, int]:
+        """Returns the chunk holding the line at `index` (0-based) and its offset in it"""
+
+        node = 1
+        while node < self.size:
+            node *= 2
+            if self.nodes[node][0] <= index:
+                index -= self.nodes[node][0]
+                node += 1
+        return node - self.size, index
+
+    def depth(self, chunk: int) -> int:
+        """Returns the depth at the start of a chunk"""
+
+        depth, node, lo, hi = 0, 1, 0, self.size
+        while node < self.size:
+            mid = (lo + hi) // 2
+            node *= 2
+            if chunk >= mid:
+                depth += self.nodes[node][1]
+                node += 1
+                lo = mid
+            else:
+                hi = mid
+        return depth
+
+    def first_below(self, chunk: int, depth: int, target: int) -> tuple[int, int] | None:
+        """Returns the first chunk from `chunk` on where the depth drops below `target`,
+        along with the depth at its start
+
+        Args:
+            chunk (int): The chunk to start from
+            depth (int): The depth at the start of `chunk`
+            target (int): The depth to drop below"""
+
+        left, right = [], []
+        lo, hi = chunk + self.size, 2 * self.size
+        while lo < hi:
+            if lo & 1:
+                left.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right.append(hi)
+            lo //= 2
+            hi //= 2
+
+        for node in left + right[::-1]:
+            if depth + self.nodes[node][2] >= target:
+                depth += self.nodes[node][1]
+                continue
+
+            while node < self.size:
+                node *= 2
+                if depth + self.nodes[node][2] >= target:
+                    depth += self.nodes[node][1]
+                    node += 1
+            return node - self.size, depth
+
+    def last_below(self, chunk: int, depth: int, target: int) -> tuple[int, int] | None:
+        """Returns the last chunk before `chunk` where the depth is below `target`,
+        along with the depth at its start
+
+        Args:
+            chunk (int): The chunk to search before
+            depth (int): The depth at the start of `chunk`
+            target (int): The depth to find below"""
+
+        left, right = [], []
+        lo, hi = self.size, chunk + self.size
+        while lo < hi:
+            if lo & 1:
+                left.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right.append(hi)
+            lo //= 2
+            hi //= 2
+
+        for node in right + left[::-1]:
+            start = depth - self.nodes[node][1]
+            if start + self.nodes[node][2] >= target:
+                depth = start
+                continue
+
+            while node < self.size:
+                node = 2 * node + 1
+                start = depth - self.nodes[node][1]
+                if start + self.nodes[node][2] >= target:
+                    depth = start
+                    node -= 1
+            return node - self.size, depth - self.nodes[node][1]
+
+
+class BracketIndex:
+    """Bracket structure of a document
+
+    Keeps the brackets of every line along with depth summaries, chunked and indexed
+    by a segment tree. Edits only rescan the lines they touched, and the depth at a
+    position or the bracket matching another one are found without scanning the text.
+    Brackets in line comments and quoted strings are ignored, both are recognized
+    per line as the highlighter only has tokens for the lines around the view.
+    What quotes a string depends on the language, see `get_string_patterns`."""
+
+    def __init__(
+        self, comment_prefix: str = "", strings: tuple[str, ...] = STRINGS
+    ) -> None:
+        patterns = [r"(?P<bracket>[()\[\]{}])", *strings]
+        if comment_prefix:
+            patterns.append(rf"{re.escape(comment_prefix)}.*")
+        self.pattern = re.compile("|".join(patterns))
+        self.rebuild("")
+
+    def scan(self, text: str) -> Line:
+        brackets = tuple(
+            (m.start(), m.group())
+            for m in self.pattern.finditer(text)
+            if m.lastgroup == "bracket"
+        )
+        depth = low = 0
+        for _, char in brackets:
+            depth += 1 if char in BRACKET_MAP else -1
+            low = min(low, depth)
+        return brackets, depth, low
+
+    def rebuild(self, text: str) -> None:
+        """Index a whole document"""
+
+        lines = [self.scan(line) for line in text.split("\n")]
+        self.chunks = [
+            Chunk(lines[i : i + CHUNK_SIZE]) for i in range(0, len(lines), CHUNK_SIZE)
+        ]
+        self.tree = ChunkTree([chunk.summary for chunk in self.chunks])
+
+    @property
+    def lines(self) -> int:
+        return self.tree.lines
+
+    def edited(self, first: int, old_last: int, lines: list[str]) -> None:
+        """Replace lines `first` to `old_last` (1-based, inclusive) with the new lines
+
+        Args:
+            first (int): First line touched by the edit
+            old_last (int): Last line touched by the edit, before it was made
+            lines (list[str]): Text of the lines touched, after the edit"""
+
+        new = [self.scan(line) for line in lines]
+        k, offset = self.tree.locate(first - 1)
+        count = old_last - first + 1
+        chunk = self.chunks[k]
+
+        if offset + count <= len(chunk.lines) and (
+            0 < len(chunk.lines) - count + len(new) <= 2 * CHUNK_SIZE
+        ):
+            chunk.lines[offset : offset + count] = new
+            chunk.update()
+            self.tree.set(k, chunk.summary)
+            return
+
+        # the edit spans several chunks, or the chunk has to be split
+        last = k
+        covered = len(chunk.lines) - offset
+        while covered < count:
+            last += 1
+            covered += len(self.chunks[last].lines)
+
+        merged = [line for c in self.chunks[k : last + 1] for line in c.lines]
+        merged[offset : offset + count] = new
+        self.chunks[k : last + 1] = [
+            Chunk(merged[i : i + CHUNK_SIZE]) for i in range(0, len(merged), CHUNK_SIZE)
+        ]
+        self.tree = ChunkTree([chunk.summary for chunk in self.chunks])
+
+    def get_line(self, line: int) -> tuple[int, int]:
+        """Returns the chunk and offset of a line (1-based)"""
+
+        return self.tree.locate(line - 1)
+
+    def depth_at(self, line: int, column: int) -> int:
+        """Returns the number of brackets opened and not closed before a position"""
+
+        k, offset = self.get_line(line)
+        chunk = self.chunks[k]
+        brackets = chunk.lines[offset][0]
+        depth = self.tree.depth(k) + chunk.starts[offset]
+        for col, char in brackets:
+            if col >= column:
+                break
+            depth += 1 if char in BRACKET_MAP else -1
+        return depth
+
+    def bracket_at(self, line: int, column: int) -> str | None:
+        """Returns the bracket at a position, None if there is none"""
+
+        k, offset = self.get_line(line)
+        brackets = self.chunks[k].lines[offset][0]
+        i = bisect_left(brackets, (column, ""))
+        if i < len(brackets) and brackets[i][0] == column:
+            return brackets[i][1]
+
+    def match(self, line: int, column: int) -> tuple[int, int] | None:
+        """Returns the position of the bracket matching the one at a position
+
+        Args:
+            line (int): Line of the bracket (1-based)
+            column (int): Column of the bracket"""
+
+        char = self.bracket_at(line, column)
+        if not char:
+            return
+
+        depth = self.depth_at(line, column)
+        if char in BRACKET_MAP:
+            return self.find_closing(line, column, depth + 1)
+        return self.find_opening(line, column, depth)
+
+    def enclosing(self, line: int, column: int) -> tuple[int, int] | None:
+        """Returns the position of the innermost bracket left open before a position"""
+
+        return self.find_opening(line, column, self.depth_at(line, column))
+
+    def find_closing(self, line: int, column: int, depth: int) -> tuple[int, int] | None:
+        """Returns the first bracket after a position that brings the depth below `depth`"""
+
+        k, offset = self.get_line(line)
+        chunk = self.chunks[k]
+        target = depth
+        for col, char in chunk.lines[offset][0]:
+            if col <= column:
+                continue
+            depth += 1 if char in BRACKET_MAP else -1
+            if depth < target:
+                return line, col
+
+        # lines left in the chunk, then the chunks where the depth drops
+        line += 1
+        offset += 1
+        while True:
+            while offset < len(chunk.lines):
+                brackets, delta, low = chunk.lines[offset]
+                if depth + low < target:
+                    for col, char in brackets:
+                        depth += 1 if char in BRACKET_MAP else -1
+                        if depth < target:
+                            return line, col
+                depth += delta
+                line += 1
+                offset += 1
+
+            found = self.tree.first_below(k + 1, depth, target)
+            if not found:
+                return
+
+            k, depth = found
+            chunk = self.chunks[k]
+            line = self.first_line(k)
+            offset = 0
+
+    def find_opening(self, line: int, column: int, depth: int) -> tuple[int, int] | None:
+        """Returns the last bracket before a position that brings the depth up from below `depth`,
+        where `depth` is the depth at the position"""
+
+        k, offset = self.get_line(line)
+        chunk = self.chunks[k]
+        target = depth
+        for col, char in reversed(chunk.lines[offset][0]):
+            if col >= column:
+                continue
+            depth -= 1 if char in BRACKET_MAP else -1
+            if depth < target:
+                return line, col
+
+        # lines before in the chunk, then the chunks where the depth drops
+        while True:
+            while offset > 0:
+                line -= 1
+                offset -= 1
+                brackets, delta, low = chunk.lines[offset]
+                start = depth - delta
+                if start + low < target:
+                    for col, char in reversed(brackets):
+                        depth -= 1 if char in BRACKET_MAP else -1
+                        if depth < target:
+                            return line, col
+                depth = start
+
+            found = self.tree.last_below(k, depth, target)
+            if not found:
+                return
+
+            k, start = found
+            chunk = self.chunks[k]
+            depth = start + chunk.delta
+            offset = len(chunk.lines)
+            line = self.first_line(k) + offset
+
+    def first_line(self, chunk: int) -> int:
+        """Returns the first line (1-based) of a chunk"""
+
+        line, node, lo, hi = 1, 1, 0, self.tree.size
+        while node < self.tree.size:
+            mid = (lo + hi) // 2
+            node *= 2
+            if chunk >= mid:
+                line += self.tree.nodes[node][0]
+                node += 1
+                lo = mid
+            else:
+                hi = mid
+        return line
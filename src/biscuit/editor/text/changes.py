@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
 from typing import List
 
@@ -18,6 +20,118 @@ class Change:
         self.new_text = new_text
 
 
-# @dataclass
-# class Changes:
-#     change_list: List[Change]
+class Changes:
+    """Undo journal of the edits made to a text
+
+    Edits are kept as `Change`s, grouped into the steps that are undone at once.
+    Edits made while a group is open (eg. during the same event) join it, and runs
+    of typing or deleting characters are coalesced into one change. Memory stays
+    proportional to the size of the edits, undoing a step only costs its edits."""
+
+    def __init__(self, limit: int = 1000) -> None:
+        self.limit = limit
+        self.undo_stack: List[List[Change]] = []
+        self.redo_stack: List[List[Change]] = []
+        self.open = False
+        # whether the last group is a run of single character edits
+        self.typing = False
+
+    def record(self, change: Change) -> None:
+        """Record an edit, either joining the last group or starting a new one
+
+        Args:
+            change (Change): The edit that was made"""
+
+        self.redo_stack.clear()
+        single = len(change.old_text + change.new_text) == 1
+        if self.undo_stack and self.open:
+            self.undo_stack[-1].append(change)
+            self.typing = False
+        elif self.typing and single and (merged := self.coalesce(change)):
+            self.undo_stack[-1][-1] = merged
+        else:
+            self.undo_stack.append([change])
+            if len(self.undo_stack) > self.limit:
+                del self.undo_stack[0]
+            self.typing = single
+        self.open = True
+
+    def separate(self) -> None:
+        """Close the current group, edits that follow start a new one
+        unless they continue a run of typing"""
+
+        self.open = False
+
+    def coalesce(self, change: Change) -> Change | None:
+        """Returns the last recorded change merged with the single character edit
+        `change`, if both are part of the same run of typed, backspaced or deleted
+        characters on a line"""
+
+        last = self.undo_stack[-1][-1]
+        if "\n" in last.old_text + last.new_text + change.old_text + change.new_text:
+            return
+
+        if change.new_text:
+            # typing, a new group starts at each word following a whitespace
+            if last.old_text or change.start != last.new_end:
+                return
+            if last.new_text[-1:].isspace() and not change.new_text.isspace():
+                return
+            return Change(
+                last.start,
+                last.old_end,
+                change.new_end,
+                "",
+                last.new_text + change.new_text,
+            )
+
+        if last.new_text:
+            return
+
+        if change.old_end == last.start:
+            # backspace
+            return Change(
+                change.start,
+                last.old_end,
+                change.start,
+                change.old_text + last.old_text,
+                "",
+            )
+        if change.start == last.start:
+            # delete
+            return Change(
+                last.start,
+                [last.old_end[0], last.old_end[1] + 1],
+                last.start,
+                last.old_text + change.old_text,
+                "",
+            )
+
+    def undo(self) -> List[Change] | None:
+        """Returns the group of edits to revert, moving it to the redo stack"""
+
+        self.open = self.typing = False
+        if not self.undo_stack:
+            return
+
+        group = self.undo_stack.pop()
+        self.redo_stack.append(group)
+        return group
+
+    def redo(self) -> List[Change] | None:
+        """Returns the group of edits to make again, moving it back to the undo stack"""
+
+        self.open = self.typing = False
+        if not self.redo_stack:
+            return
+
+        group = self.redo_stack.pop()
+        self.undo_stack.append(group)
+        return group
+
+    def clear(self) -> None:
+        """Forget all the edits"""
+
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.open = self.typing = False
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import typing
+from bisect import bisect_left, bisect_right
+
+if typing.TYPE_CHECKING:
+    from biscuit.language.data import Diagnostic
+
+    from .changes import Change
+
+# a position is kept as a (line, column) tuple, they compare the way the indices do
+Position = tuple[int, int]
+# a diagnostic is kept as (start, end, severity, message)
+Entry = tuple[Position, Position, int, str]
+
+SEVERITY_TAGS = {1: "error", 2: "warning", 3: "information", 4: "hint"}
+# the end of an empty slot of the tree, before any position
+NOWHERE = (0, -1)
+
+
+def parse_index(index: str) -> Position:
+    line, column = str(index).split(".")
+    return int(line), int(column)
+
+
+def format_index(position: Position) -> str:
+    return f"{position[0]}.{position[1]}"
+
+
+def severity_tag(severity: int) -> str:
+    return SEVERITY_TAGS.get(severity, "information")
+
+
+def shift(position: Position, change: Change, after: bool) -> Position:
+    """Returns where a position is after an edit, the way tag ranges move
+
+    Text inserted at a position goes after it if `after` (as it does at the start of
+    a tag range), or before it otherwise (as at the end of one). Positions within the
+    deleted text end up at the edit."""
+
+    start = tuple(change.start)
+    old_end = tuple(change.old_end)
+    new_end = tuple(change.new_end)
+    if position < start or (position == start and not after):
+        return position
+    if position < old_end:
+        return new_end if after else start
+    if position[0] == old_end[0]:
+        return new_end[0], new_end[1] + position[1] - old_end[1]
+    return position[0] + new_end[0] - old_end[0], position[1]
+
+
+class IntervalTree:
+    """Static interval tree over entries whose first two items are (start, end)
+
+    Entries are sorted by start and a segment tree keeps the furthest end in every
+    range of them, so the entries overlapping a range are found in O(log n + k)."""
+
+    def __init__(self, entries: typing.Iterable[Entry]) -> None:
+        self.entries = sorted(entries, key=lambda entry: entry[0])
+        self.starts = [entry[0] for entry in self.entries]
+
+        self.size = 1
+        while self.size < len(self.entries):
+            self.size *= 2
+
+        self.ends: list[Position] = [NOWHERE] * (2 * self.size)
+        self.ends[self.size : self.size + len(self.entries)] = [
+            entry[1] for entry in self.entries
+        ]
+        for i in range(self.size - 1, 0, -1):
+            self.ends[i] = max(self.ends[2 * i], self.ends[2 * i + 1])
+
+    def query(self, start: Position, end: Position) -> list[Entry]:
+        """Returns the entries that start at or before `end` and end after `start`,
+        in the order they start. With `start == end` it is a stabbing query. Empty
+        entries cover their position, they are returned when it is in the range."""
+
+        count = bisect_right(self.starts, end)
+        found = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if lo >= count or self.ends[node] < start:
+                continue
+            if node >= self.size:
+                entry = self.entries[lo]
+                if entry[1] > start or entry[0] == entry[1]:
+                    found.append(entry)
+                continue
+
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+        return found
+
+
+class DiagnosticStore:
+    """Diagnostics of a document, as published by the language server
+
+    A publish is diffed against the previous one so only the diagnostics that
+    changed need their tags updated. Lookups are stabbing queries on an interval tree,
+    only the diagnostics whose range holds the position are returned.
+
+    Edits are only queued as they are made, the diagnostics are moved along with them
+    in one pass on the next lookup or publish rather than on every keystroke."""
+
+    def __init__(self) -> None:
+        self.entries: set[Entry] = set()
+        self.tree = IntervalTree(())
+        # edits not applied to the entries yet
+        self.pending: list[Change] = []
+        # no entry ends after this, with the pending edits applied
+        self.last_end: Position = NOWHERE
+
+    def update(self, diagnostics: list[Diagnostic]) -> tuple[list[Entry], list[Entry]]:
+        """Replace the diagnostics, returns the ones removed and the ones added"""
+
+        entries = {
+            (
+                parse_index(diagnostic.start),
+                parse_index(diagnostic.end),
+                diagnostic.severity,
+                diagnostic.message,
+            )
+            for diagnostic in diagnostics
+        }
+        self.flush()
+        removed = list(self.entries - entries)
+        added = list(entries - self.entries)
+        if removed or added:
+            self.entries = entries
+            self.tree = IntervalTree(entries)
+            self.last_end = self.tree.ends[1]
+        return removed, added
+
+    def edited(self, change: Change) -> None:
+        """Queue an edit the diagnostics are to move along with, as their tags move
+        with the text"""
+
+        if self.last_end < tuple(change.start):
+            # all of them end before the edit
+            return
+
+        self.pending.append(change)
+        self.last_end = shift(self.last_end, change, True)
+
+    def flush(self) -> None:
+        """Move the diagnostics along with the pending edits. Edits keep the order
+        of the positions, the entries stay sorted and the tree is rebuilt in a pass
+
+        Only the entries between the first edit and the last line edited are moved
+        edit by edit, the ones below those lines are moved down or up in one step."""
+
+        if not self.pending:
+            return
+
+        changes, self.pending = self.pending, []
+        first = min(tuple(change.start) for change in changes)
+        # below the line `last` (counted before the edits) lines are only moved
+        last = moved = 0
+        for change in changes:
+            last = max(last, change.old_end[0] - moved)
+            moved += change.new_end[0] - change.old_end[0]
+
+        below = bisect_left(self.tree.starts, (last + 1,))
+        entries = []
+        for entry in self.tree.entries[:below]:
+            start, end, severity, message = entry
+            if end < first:
+                # it ends before the first edit
+                entries.append(entry)
+                continue
+            for change in changes:
+                start = shift(start, change, True)
+                end = max(start, shift(end, change, False))
+            entries.append((start, end, severity, message))
+
+        if moved:
+            entries.extend(
+                ((start[0] + moved, start[1]), (end[0] + moved, end[1]), *rest)
+                for start, end, *rest in self.tree.entries[below:]
+            )
+        else:
+            entries.extend(self.tree.entries[below:])
+
+        self.entries = set(entries)
+        self.tree = IntervalTree(entries)
+        self.last_end = self.tree.ends[1]
+
+    def overlapping(self, start: Position, end: Position) -> list[Entry]:
+        self.flush()
+        return self.tree.query(start, end)
+
+    def at(self, index: str) -> list[Entry]:
+        """Returns the diagnostics whose range holds a position"""
+
+        self.flush()
+        position = parse_index(index)
+        return self.tree.query(position, position)
+
+    def clear(self) -> None:
+        self.entries = set()
+        self.tree = IntervalTree(())
+        self.pending = []
+        self.last_end = NOWHERE
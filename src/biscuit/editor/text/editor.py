@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import tkinter as tk
 import typing
-from hashlib import md5
 
 from biscuit.common.icons import Icons
 from biscuit.common.ui import Scrollbar
@@ -11,6 +10,7 @@ from ..editorbase import BaseEditor
 from .linenumbers import LineNumbers
 from .menu import RunMenu
 from .minimap import Minimap
+from .scheduler import CONTENT, CURSOR, SCROLL, RefreshScheduler
 from .text import Text
 
 if typing.TYPE_CHECKING:
@@ -45,7 +45,11 @@ class TextEditor(BaseEditor):
         self.debugger: DebuggerBase = None
         self.runmenu = None
         self.unsupported = False
-        self.content_hash = ""
+        # version of the text when it was last loaded or saved, and its line hashes
+        self.saved_version: int | None = None
+        self.saved_hashes: list[int] = []
+        self.checked_version: int | None = None
+        self.modified = False
 
         if not self.standalone:
             self.__buttons__ = [
@@ -148,7 +152,12 @@ class TextEditor(BaseEditor):
         self.text.grid(row=0, column=1, sticky=tk.NSEW)
         self.scrollbar.grid(row=0, column=3, sticky=tk.NS)
 
-        self.text.bind("<<Change>>", self.on_change)
+        self.refresher = RefreshScheduler(self)
+        self.setup_refresh_tasks()
+        self.last_version = self.text.version
+        self.text.bind(
+            "<<Change>>", self.base.latency.wrap("on_change", self.on_change)
+        )
         self.text.bind("<<Scroll>>", self.on_scroll)
 
         self.on_change()
@@ -181,19 +190,16 @@ class TextEditor(BaseEditor):
         )
 
     def file_loaded(self) -> None:
-        self.recalculate_content_hash()
+        self.mark_saved()
         self.event_generate("<<FileLoaded>>", when="tail")
         self.text.event_generate("<<FileLoaded>>", when="tail")
 
-    def recalculate_content_hash(self) -> None:
-        """Recalculate the hash of the editor content"""
-        self.content_hash = self.calculate_content_hash()
+    def mark_saved(self) -> None:
+        """Remember the current content as the saved one"""
 
-    def calculate_content_hash(self) -> str | None:
-        """Calculate the hash of the editor content"""
         if self.exists and self.editable:
-            text = self.text.get_all_text()
-            return md5(text.encode()).hexdigest()
+            self.saved_version = self.text.version
+            self.saved_hashes = self.text.get_line_hashes().copy()
 
     @property
     def breakpoints(self):
@@ -203,10 +209,18 @@ class TextEditor(BaseEditor):
     def unsaved_changes(self):
         """Check if the editor content has changed"""
         if self.editable:
-            if not self.content_hash:
+            if self.saved_version is None:
+                return False
+
+            version = self.text.version
+            if version == self.saved_version:
                 return False
 
-            return self.content_hash != self.calculate_content_hash()
+            # edited since, but undoing or retyping may have brought it back
+            if self.checked_version != version:
+                self.checked_version = version
+                self.modified = self.text.get_line_hashes() != self.saved_hashes
+            return self.modified
 
     def run_file(self, dedicated=False, external=False) -> None:
         if not self.run_command_value:
@@ -216,8 +230,10 @@ class TextEditor(BaseEditor):
             self.base.commands.show_run_config_palette(self.run_command_value)
             return
 
-        self.save()
+        # run once the file is written
+        self.save(on_saved=lambda: self.run_saved_file(dedicated, external))
 
+    def run_saved_file(self, dedicated=False, external=False) -> None:
         # add another dedicated terminal if there is an active terminal
         if self.base.terminalmanager.active_terminal and dedicated:
             self.base.terminalmanager.add_default_terminal()
@@ -230,23 +246,79 @@ class TextEditor(BaseEditor):
         self.run_command_value = command
         self.run_file()
 
-    def on_change(self, *_) -> None:
-        self.linenumbers.redraw()
-        try:
-            if not self.standalone:
-                self.base.update_statusbar()
-        except ValueError:
-            pass
-        self.text.refresh()
+    def setup_refresh_tasks(self) -> None:
+        """Register what has to be refreshed on a change, and for which reasons"""
+
+        tasks = self.refresher
+        text = self.text
+        measure = self.base.latency.wrap
+
+        tasks.add(
+            measure("linenumbers", self.linenumbers.redraw), CONTENT, CURSOR, SCROLL
+        )
+        if not self.standalone:
+            tasks.add(self.update_statusbar, CONTENT, CURSOR)
+            tasks.add(
+                lambda: self.base.findreplace.highlight_matches(text), CONTENT, SCROLL
+            )
+        tasks.add(measure("highlight", text.highlighter.highlight), CONTENT, SCROLL)
+        tasks.add(
+            text.highlight_current_word,
+            CONTENT,
+            CURSOR,
+            SCROLL,
+            delay=self.base.settings.config.current_word_highlight_delay_ms,
+        )
+
+        if not self.minimalist and not self.standalone:
+            tasks.add(text.highlight_current_line, CONTENT, CURSOR)
+            tasks.add(text.highlight_current_brackets, CONTENT, CURSOR)
+            tasks.add(
+                measure("indent_guides", text.update_indent_guides),
+                CONTENT,
+                CURSOR,
+                SCROLL,
+            )
+            tasks.add(
+                text.request_outline,
+                CONTENT,
+                delay=self.base.settings.config.outline_refresh_delay_ms,
+            )
+
         if not self.minimalist:
-            self.minimap.redraw_cursor()
-        self.event_generate("<<Change>>")
+            tasks.add(measure("minimap", self.minimap.redraw), CONTENT)
+            tasks.add(self.minimap.scroll, SCROLL)
+            tasks.add(self.minimap.redraw_cursor, CURSOR)
+
+        tasks.add(lambda: self.event_generate("<<Change>>"), CONTENT, CURSOR)
+        tasks.add(lambda: self.event_generate("<<Scroll>>"), SCROLL)
+
+    def on_change(self, event: tk.Event = None) -> None:
+        """Schedule a refresh, for the cursor only if the content is the same.
+        Called without an event to refresh everything."""
+
+        if event and self.text.loading:
+            # refreshed once the file is loaded
+            return
+
+        if event and self.text.version == self.last_version:
+            self.refresher.mark(CURSOR)
+        else:
+            self.refresher.mark(CONTENT)
+        self.last_version = self.text.version
+
+        if not self.minimalist and not self.standalone:
+            # read by autocomplete on key release, which may come before the refresh
+            self.text.update_current_word()
 
     def on_scroll(self, *_) -> None:
-        self.linenumbers.redraw()
-        if not self.minimalist:
-            self.minimap.redraw()
-        self.event_generate("<<Scroll>>")
+        self.refresher.mark(SCROLL)
+
+    def update_statusbar(self) -> None:
+        try:
+            self.base.update_statusbar()
+        except ValueError:
+            pass
 
     def unsupported_file(self) -> None:
         self.unsupported = True
@@ -264,14 +336,26 @@ class TextEditor(BaseEditor):
         self.linenumbers.set_bar_width(size * 3)
         self.on_change()
 
-    def save(self, path=None) -> None:
-        if self.editable:
-            self.recalculate_content_hash()
-            self.text.save_file(path)
+    def save(self, path=None, on_saved=None) -> None:
+        if not self.editable:
+            if on_saved:
+                on_saved()
+            return
+
+        self.text.save_file(path, on_saved=on_saved, on_failed=self.save_failed)
+        self.mark_saved()
+
+    def save_failed(self) -> None:
+        """The content was not written, it is unsaved again"""
+
+        self.saved_version, self.saved_hashes = -1, []
 
     def auto_save(self) -> None:
         if self.standalone:
             return
 
-        self.save()
+        if self.unsaved_changes:
+            self.save()
+        else:
+            self.base.save_manager.skip()
         self.base.after(self.base.settings.config.auto_save_timer_ms, self.auto_save)
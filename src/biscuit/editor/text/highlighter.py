@@ -1,18 +1,90 @@
 from __future__ import annotations
 
 import os
+import queue
+import threading
 import tkinter as tk
 import typing
 
-from pygments import lex
+from pygments.lexer import RegexLexer
 from pygments.lexers import get_lexer_by_name, get_lexer_for_filename
 from pygments.style import Style
+from pygments.token import Error, Whitespace, _TokenType
 
 if typing.TYPE_CHECKING:
     from biscuit import App
 
+    from .changes import Change
     from .text import Text
 
+ROOT = ("root",)
+
+# lexer state stacks are shared between all the checkpoints that are equal
+_interned_states: dict[tuple[str, ...], tuple[str, ...]] = {ROOT: ROOT}
+
+
+def get_tokens_with_states(
+    lexer: RegexLexer, text: str, stack: tuple[str, ...] = ROOT
+) -> typing.Iterator[tuple[int, _TokenType | None, str | tuple[str, ...]]]:
+    """Same as `RegexLexer.get_tokens_unprocessed`, except that every time lexing
+    reaches the start of a line on a token boundary, the state stack is reported
+    as a `(pos, None, stack)` item. The stack can be used to resume lexing from that line.
+
+    Args:
+        lexer (RegexLexer): The lexer to use
+        text (str): The text to lex
+        stack (tuple[str, ...], optional): The initial state stack. Defaults to ROOT."""
+
+    pos = 0
+    tokendefs = lexer._tokens
+    statestack = list(stack)
+    statetokens = tokendefs[statestack[-1]]
+    while True:
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                if action is not None:
+                    if type(action) is _TokenType:
+                        yield pos, action, m.group()
+                    else:
+                        yield from action(lexer, m)
+                pos = m.end()
+                if new_state is not None:
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == "#pop":
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == "#push":
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == "#push":
+                        statestack.append(statestack[-1])
+                    statetokens = tokendefs[statestack[-1]]
+                if pos and text[pos - 1] == "\n":
+                    yield pos, None, tuple(statestack)
+                break
+        else:
+            try:
+                if text[pos] == "\n":
+                    # at EOL, reset state to "root"
+                    statestack = ["root"]
+                    statetokens = tokendefs["root"]
+                    yield pos, Whitespace, "\n"
+                    pos += 1
+                    yield pos, None, ROOT
+                    continue
+                yield pos, Error, text[pos]
+                pos += 1
+            except IndexError:
+                break
+
 
 class BiscuitStyle(Style):
     name = "biscuit"
@@ -75,6 +147,27 @@ class Highlighter:
         self.tag_colors = self.base.theme.syntax
         self.setup_highlight_tags()
 
+        self.viewport_only = self.base.settings.config.viewport_highlighting
+        self.margin = self.base.settings.config.highlight_margin
+
+        # states[i] is the lexer state stack at the start of line i+1 (None if unknown),
+        # spans[i] are the token spans currently tagged on line i+1 (None if untagged)
+        self.states: list[tuple[str, ...] | None] = [ROOT]
+        self.spans: list[list[tuple[str, int, int]] | None] = [None]
+        self.used_tags: set[str] = set()
+
+        # lines from `pending` onwards are not yet verified after an edit,
+        # re-lexing can stop once the states converge below line `damaged`
+        self.pending: int | None = None
+        self.damaged: int | None = None
+
+        # lexing runs on a worker thread against a snapshot of the text, one pass
+        # at a time. Results are dropped if the text changed while it was running
+        self.threaded = self.base.settings.config.background_highlighting
+        self.results = queue.Queue()
+        self.job: tuple | None = None
+        self.generation = 0
+
     def detect_language(self) -> None:
         """Detect the language from the file extension and set the lexer
         Refreshes language attribute of the text instance."""
@@ -88,6 +181,7 @@ class Highlighter:
             )
             self.text.language = self.lexer.name
             self.text.language_alias = self.lexer.aliases[0]
+            self.reset()
             self.highlight()
         except:
             self.lexer = None
@@ -114,6 +208,7 @@ class Highlighter:
         self.text.language = self.lexer.name
         self.text.language_alias = self.lexer.aliases[0]
         self.tag_colors = self.base.theme.syntax
+        self.clear()
         self.text.master.on_change()
         self.base.statusbar.on_open_file(self.text)
 
@@ -131,43 +226,387 @@ class Highlighter:
             else:
                 self.text.tag_configure(str(token), foreground=props)
 
+    @property
+    def stateful(self) -> bool:
+        """Whether lexing can be resumed from the state checkpoints of the current lexer"""
+
+        return (
+            type(self.lexer).get_tokens_unprocessed
+            is RegexLexer.get_tokens_unprocessed
+        )
+
     def clear(self) -> None:
         """Clears the highlighting of the text content"""
 
         for token, _ in self.tag_colors.items():
             self.text.tag_remove(str(token), "1.0", tk.END)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all the checkpoints, every line will be lexed and tagged again"""
+
+        lines = int(self.text.index("end-1c").split(".")[0])
+        self.states = [ROOT] + [None] * (lines - 1)
+        self.spans = [None] * lines
+        self.pending = self.damaged = None
+        self.generation += 1
+
+    def edited(self, change: Change) -> None:
+        """Patch the checkpoints with an edit made to the text
+
+        Lines touched by the edit lose their checkpoints and tags, lines below keep
+        theirs as a target for convergence: re-lexing starts at the edited line and
+        stops as soon as the new states match the old ones again.
+
+        Args:
+            change (Change): The edit, with indices resolved before it was applied"""
+
+        first, old_last, new_last = (
+            change.start[0],
+            change.old_end[0],
+            change.new_end[0],
+        )
+        if not self.lexer or old_last > len(self.states):
+            # out of sync, the next pass starts over anyway
+            return
+        delta = new_last - old_last
+
+        # the state at the start of the first line is not affected by the edit
+        self.states[first:old_last] = [None] * (new_last - first)
+        self.spans[first - 1 : old_last] = [None] * (new_last - first + 1)
+
+        if not self.stateful:
+            # no checkpoints to converge on, every line from the edited one may
+            # change. They are verified as they are lexed, see `update`
+            if self.pending is None:
+                self.pending, self.damaged = first, new_last
+            else:
+                self.pending = min(self.pending, first)
+            return
+
+        # a token running into the edited line can change from where it starts
+        top = first
+        while self.states[top - 1] is None:
+            top -= 1
+        self.spans[top - 1 : first - 1] = [None] * (first - top)
+
+        if self.pending is None:
+            self.pending, self.damaged = top, new_last
+            return
+
+        self.pending = min(self.pending, top)
+        self.damaged = max(
+            self.damaged + delta if self.damaged > old_last else self.damaged,
+            new_last,
+        )
+
+    def get_highlight_window(self) -> tuple[int, int]:
+        """Returns the range of lines that should carry token tags right now:
+        the visible lines plus `margin` lines above and below, or all of them."""
+
+        lines = len(self.states)
+        if not self.viewport_only:
+            return 1, lines
+
+        first, last = self.text.get_visible_range()
+        return max(1, first - self.margin), min(lines, last + self.margin)
 
     def highlight(self) -> None:
         """Highlight the text content
 
         This method highlights the text content based on the lexer provided.
+        Only the lines in view (plus a margin) are lexed and tagged, so the cost
+        of a pass stays flat no matter how big the file is. Lines that scroll into
+        view are picked up by the next pass, see `on_scroll`.
+
+        After an edit, lexing resumes from the nearest checkpoint before the edited
+        line and stops once the states converge with the ones recorded before.
+        Lexers without states to resume from always lex from the first line, down
+        to the end of the window: their cost grows with how far down the view is.
 
-        TODO: As of now, it highlights the entire text content.
-        It needs to be optimized to highlight only the visible area."""
+        With `threaded` set, lexing is done on a worker thread and the tags are
+        applied once it is done, see `process_results`."""
 
-        if not self.lexer or not self.tag_colors:
+        if not self.lexer or not self.tag_colors or self.job:
+            # a running pass picks up the rest once it is done
             return
 
-        for token, _ in self.tag_colors.items():
-            self.text.tag_remove(str(token), "1.0", tk.END)
+        if len(self.states) != int(self.text.index("end-1c").split(".")[0]):
+            # an edit slipped past the proxy, start over
+            self.reset()
+
+        start, end = self.get_highlight_window()
+        line = self.untagged(start, end)
+        if self.pending is not None and self.pending <= end:
+            line = self.pending if line is None else min(line, self.pending)
+
+        if not self.threaded:
+            while line:
+                line = self.relex(line, start, end)
+        elif line:
+            self.submit(line, start, end)
+
+    def submit(self, line: int, start: int, end: int) -> None:
+        """Lex the window on a worker thread, starting from the checkpoint closest to `line`
+
+        Args:
+            line (int): The first line that needs lexing
+            start (int): First line of the window
+            end (int): Last line of the window"""
+
+        checkpoint, stack = self.get_checkpoint(line)
+        text = self.snapshot(checkpoint)
+        self.job = (self.text.version, self.generation, line, start, end, checkpoint)
+        threading.Thread(
+            target=self.lex_snapshot, args=(self.job, text, stack), daemon=True
+        ).start()
+        self.process_results()
+
+    def lex_snapshot(self, job: tuple, text: str, stack: tuple[str, ...]) -> None:
+        """Runs on the worker thread, lexes the snapshot and posts the lines to `results`
+
+        Args:
+            job (tuple): The pass the snapshot was taken for
+            text (str): The text from the checkpoint to the end of the document
+            stack (tuple[str, ...]): Lexer state at the checkpoint"""
+
+        *_, end, checkpoint = job
+        lines = []
+        try:
+            for item in self.lex_lines(text, checkpoint, stack):
+                lines.append(item)
+                if item[0] > end and (item[1] is not None or not self.stateful):
+                    break
+        except Exception:
+            # lexer was changed or removed while lexing
+            lines = None
+        self.results.put((job, lines))
+
+    def process_results(self) -> None:
+        """Apply the result of the running pass once it is posted by the worker thread.
+        Results of a text that has changed since the snapshot are discarded."""
 
-        text = self.text.get_all_text()
-
-        # NOTE:  Highlighting only visible area
-        # total_lines = int(self.text.index('end-1c').split('.')[0])
-        # start_line = int(self.text.yview()[0] * total_lines)
-        # first_visible_index = f"{start_line}.0"
-        # last_visible_index =f"{self.text.winfo_height()}.end"
-        # for token, _ in self.tag_colors.items():
-        #     self.text.tag_remove(str(token), first_visible_index, last_visible_index)
-        # text = self.text.get(first_visible_index, last_visible_index)
-
-        self.text.mark_set("range_start", "1.0")
-        for token, content in lex(text, self.lexer):
-            self.text.mark_set("range_end", f"range_start + {len(content)}c")
-            self.text.tag_add(str(token), "range_start", "range_end")
-            self.text.mark_set("range_start", "range_end")
-
-            # DEBUG
-            # print(f"{content} is recognized as a <{str(token)}>")
-        # print("==================================")
+        try:
+            job, lines = self.results.get_nowait()
+        except queue.Empty:
+            self.text.after(10, self.process_results)
+            return
+
+        self.job = None
+        version, generation, line, start, end, checkpoint = job
+        try:
+            if (
+                lines is not None
+                and version == self.text.version
+                and generation == self.generation
+            ):
+                self.update(line, start, end, checkpoint, lines)
+
+            # lines edited or scrolled into view meanwhile
+            self.highlight()
+        except tk.TclError:
+            # editor was closed
+            pass
+
+    def untagged(self, first: int, last: int) -> int | None:
+        """Returns the first line in the range that is not tagged, None if all are
+
+        Args:
+            first (int): First line of the range
+            last (int): Last line of the range"""
+
+        try:
+            return self.spans.index(None, first - 1, last) + 1
+        except ValueError:
+            return None
+
+    def tag_at(self, line: int, column: int) -> str | None:
+        """Returns the highlight tag at a position, None if there is none
+        or the line is not tagged yet"""
+
+        if line > len(self.spans) or not (spans := self.spans[line - 1]):
+            return None
+
+        for tag, start, end in spans:
+            if start <= column < end:
+                return tag
+
+    def on_scroll(self) -> None:
+        """Highlight the lines scrolled into view"""
+
+        self.highlight()
+
+    def get_checkpoint(self, line: int) -> tuple[int, tuple[str, ...]]:
+        """Returns the closest line at or before `line` to resume lexing from,
+        along with the lexer state at its start
+
+        Args:
+            line (int): The line to be lexed"""
+
+        if not self.stateful:
+            # no states to resume from, the state of a line is only known lexing
+            # from the first one
+            return 1, ROOT
+
+        if self.pending is not None and line > self.pending:
+            # states below `pending` are not verified yet
+            line = self.pending
+        while self.states[line - 1] is None:
+            line -= 1
+        return line, self.states[line - 1]
+
+    def lex_lines(
+        self, text: str, line: int, stack: tuple[str, ...]
+    ) -> typing.Iterator[tuple[int, tuple[str, ...] | None, list[tuple[str, int, int]]]]:
+        """Lex the text starting at `line` and yield every line as it is completed
+
+        Yields `(line, state, spans)`, where state is the lexer state at the start of
+        the line (None if the line starts in the middle of a token) and spans are the
+        `(tag, start column, end column)` ranges of the tokens that have a color.
+
+        Args:
+            text (str): The text to lex, starting at the beginning of `line`
+            line (int): Line number of the first line in the text
+            stack (tuple[str, ...]): Lexer state at the start of the text"""
+
+        if self.stateful:
+            tokens = get_tokens_with_states(self.lexer, text, stack)
+        else:
+            tokens = self.lexer.get_tokens_unprocessed(text)
+
+        state, spans, col = stack, [], 0
+        for _, token, value in tokens:
+            if token is None:
+                state = _interned_states.setdefault(value, value)
+                continue
+
+            tag = str(token) if token in self.tag_colors else None
+            pieces = value.split("\n")
+            for piece in pieces[:-1]:
+                if tag and piece:
+                    spans.append((tag, col, col + len(piece)))
+                yield line, state, spans
+                line, state, spans, col = line + 1, None, [], 0
+
+            if tag and pieces[-1]:
+                spans.append((tag, col, col + len(pieces[-1])))
+            col += len(pieces[-1])
+
+        yield line, state, spans
+
+    def snapshot(self, checkpoint: int) -> str:
+        """Returns the text to lex for a pass from `checkpoint`
+
+        Some tokens are matched whole across lines and the lexer falls back to other
+        rules when their end is cut off, so the text runs to the end of the document.
+        Lexing is lazy and stops past the window anyway, see `lex_lines`."""
+
+        return self.text.get(f"{checkpoint}.0", "end")
+
+    def relex(self, line: int, start: int, end: int) -> int | None:
+        """Lex from the checkpoint closest to `line` up to the end of the window,
+        tagging the lines of the window that are out of date on the way.
+
+        Returns the next line that still needs tagging when the states converged
+        early, or None when the window is up to date.
+
+        Args:
+            line (int): The first line that needs lexing
+            start (int): First line of the window
+            end (int): Last line of the window"""
+
+        checkpoint, stack = self.get_checkpoint(line)
+        text = self.snapshot(checkpoint)
+        return self.update(
+            line, start, end, checkpoint, self.lex_lines(text, checkpoint, stack)
+        )
+
+    def update(
+        self,
+        line: int,
+        start: int,
+        end: int,
+        checkpoint: int,
+        lines: typing.Iterable[tuple[int, tuple[str, ...] | None, list]],
+    ) -> int | None:
+        """Update the checkpoints from the lexed lines and retag the lines of the window
+        whose spans differ from the ones tagged. When the lines are lexed lazily,
+        this stops early and returns the next line that needs lexing, if any.
+
+        Args:
+            line (int): The first line that needs lexing
+            start (int): First line of the window
+            end (int): Last line of the window
+            checkpoint (int): The line lexing started from
+            lines (Iterable): `(line, state, spans)` as yielded by `lex_lines`"""
+
+        lazy = not isinstance(lines, list)
+        runs: list[list[int]] = []
+        ranges: dict[str, list[str]] = {}
+
+        for number, state, spans in lines:
+            index = number - 1
+            if number > len(self.states):
+                # lexed through the end of the document
+                self.pending = self.damaged = None
+                break
+
+            if number > checkpoint and self.stateful:
+                unverified = self.pending is not None and number >= self.pending
+                if state != self.states[index] or (state is None and unverified):
+                    self.states[index] = state
+                    self.spans[index] = None
+                elif unverified and number > self.damaged and state is not None:
+                    # states converged with the ones recorded before the edit
+                    self.pending = self.damaged = None
+
+                if (
+                    lazy
+                    and number >= line
+                    and (self.pending is None or self.pending > end)
+                ):
+                    following = self.untagged(max(number, start), end)
+                    if following is None:
+                        break
+                    if following > number:
+                        self._apply(runs, ranges)
+                        return following
+
+            if number > end:
+                if state is None and self.stateful:
+                    # a token runs on past the window, its lines are not settled yet
+                    continue
+                if self.pending is not None and self.pending <= number:
+                    self.pending = number
+                    self.damaged = max(self.damaged, number)
+                break
+
+            if spans == self.spans[index]:
+                continue
+            if number < start:
+                # out of date above the window, tagged again once in view
+                self.spans[index] = None
+            else:
+                self.spans[index] = spans
+                if runs and runs[-1][1] == number - 1:
+                    runs[-1][1] = number
+                else:
+                    runs.append([number, number])
+                for tag, begin, stop in spans:
+                    ranges.setdefault(tag, []).extend(
+                        (f"{number}.{begin}", f"{number}.{stop}")
+                    )
+
+        self._apply(runs, ranges)
+
+    def _apply(self, runs: list[list[int]], ranges: dict[str, list[str]]) -> None:
+        """Clear the token tags over the runs of lines and add the new ranges"""
+
+        for first, last in runs:
+            for tag in self.used_tags:
+                self.text.tag_remove(tag, f"{first}.0", f"{last}.end")
+        for tag, indices in ranges.items():
+            self.text.tag_add(tag, *indices)
+        self.used_tags.update(ranges)
+        if runs:
+            self.text.event_generate("<<Highlight>>")
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import tkinter as tk
 import typing
+from bisect import bisect_right
 
 if typing.TYPE_CHECKING:
     from .text import Text
@@ -15,7 +16,10 @@ class LineNumbers(Canvas):
 
     This widget is used to display line numbers for the text widget.
     It also provides the functionality to toggle breakpoints on the lines.
-    """
+
+    A pool of canvas items, a breakpoint and a number per row, is kept and moved
+    around instead of recreated. Events are bound once per tag, the line is found
+    from the y of the event."""
 
     def __init__(self, master: TextEditor, text: Text = None, *args, **kwargs) -> None:
         """Line Numbers widget
@@ -41,6 +45,19 @@ class LineNumbers(Canvas):
         )
         self.breakpoints: set[int] = set()
 
+        # (breakpoint, number) items, and the lines and y of the rows in use
+        self.pool: list[tuple[int, int]] = []
+        self.lines: list[int] = []
+        self.ys: list[int] = []
+        self.drawn = None
+        self.current: int | None = None
+        self.hovered: int | None = None
+
+        for tag in ("breakpoint", "number"):
+            self.tag_bind(tag, "<Enter>", self.on_enter)
+            self.tag_bind(tag, "<Leave>", self.on_leave)
+        self.tag_bind("breakpoint", "<Button-1>", self.on_click)
+
     def attach(self, text):
         self.text = text
 
@@ -78,98 +95,108 @@ class LineNumbers(Canvas):
         self.master.update_breakpoints(self.breakpoints)
 
     def redraw(self, *_):
-        self.delete(tk.ALL)
-
         if not self.text:
             return
 
-        current_line = int(self.text.index(tk.INSERT).split('.')[0]) 
-
-        i = self.text.index("@0,0")
-        while True:
-            dline = self.text.dlineinfo(i)
-            if dline is None:
-                break
-
-            y = dline[1]
-            linenum = int(float(i))
-            curline = self.text.dlineinfo(tk.INSERT)
-            cur_y = curline[1] if curline else None
-
-            # TODO: optional: skipping comments
-            #             # check if line is commented
-            # if self.text.highlighter and any((tag[1].startswith("Token.Comment") for tag in self.text.dump(i, i + " lineend", tag=True))):
-            # if self.text.get(f"{i} linestart", f"{i} lineend").strip().startswith("#"):
-            #     self.create_text(40, y, anchor=tk.NE, text="|   ", tag=i, fill=self.base.theme.border)
-            #     i = self.text.index(f"{i}+1line")
-            #     continue
-
-            # Render breakpoint
-            has_breakpoint = linenum in self.breakpoints
-            breakpoint_id = self.create_oval(
-                5,
-                y + 3,
-                15,
-                y + 13,
-                outline="",
-                fill=self.bg if not has_breakpoint else self.bp_enabled_color,
-            )
+        first = self.text.index("@0,0")
+        dline = self.text.dlineinfo(first)
+        current = int(self.text.index(tk.INSERT).split(".")[0])
+        relative = self.text.relative_line_numbers
+        drawn = (
+            first,
+            dline[1] if dline else None,
+            self.text.index(tk.END),
+            self.winfo_height(),
+            self.font.cget("size"),
+            frozenset(self.breakpoints),
+            current if relative else None,
+        )
+        if str(self.text.cget("wrap")) != tk.NONE:
+            # an edit wrapping or unwrapping a line moves the rows below it, without
+            # moving the first one, so they are always drawn again
+            drawn = None
+        elif drawn == self.drawn:
+            # nothing moved, only the current line may have changed
+            self.highlight_current(current)
+            return
+        self.drawn = drawn
+
+        self.lines.clear()
+        self.ys.clear()
+        i = first
+        while dline := self.text.dlineinfo(i):
+            self.lines.append(int(float(i)))
+            self.ys.append(dline[1])
+            i = self.text.index(f"{i}+1line")
 
-            # Bind hover and click events for breakpoint
-            self.tag_bind(
-                breakpoint_id,
-                "<Enter>",
-                lambda _, breakpoint_id=breakpoint_id, flag=has_breakpoint: self.on_breakpoint_enter(
-                    breakpoint_id, flag
-                ),
-            )
-            self.tag_bind(
-                breakpoint_id,
-                "<Leave>",
-                lambda _, breakpoint_id=breakpoint_id, flag=has_breakpoint: self.on_breakpoint_leave(
-                    breakpoint_id, flag
-                ),
-            )
-            self.tag_bind(
-                breakpoint_id,
-                "<Button-1>",
-                lambda _, linenum=linenum: self.toggle_breakpoint(linenum),
+        while len(self.pool) < len(self.lines):
+            self.pool.append(
+                (
+                    self.create_oval(0, 0, 0, 0, outline="", tags="breakpoint"),
+                    self.create_text(
+                        0, 0, anchor=tk.NE, font=self.font, fill=self.fg, tags="number"
+                    ),
+                )
             )
 
-            if self.text.relative_line_numbers:
-                if linenum != current_line:
-                    linenum = abs(linenum - current_line)
-
-            self.create_text(
-                40,
-                y,
-                anchor=tk.NE,
-                text=linenum,
-                font=self.font,
-                tag=i,
-                fill=self.hfg if y == cur_y else self.fg,
+        for (oval, number), linenum, y in zip(self.pool, self.lines, self.ys):
+            self.coords(oval, 5, y + 3, 15, y + 13)
+            self.itemconfig(
+                oval,
+                fill=self.bp_enabled_color if linenum in self.breakpoints else self.bg,
+                state=tk.NORMAL,
             )
 
-            self.tag_bind(
-                i,
-                "<Enter>",
-                lambda _, breakpoint_id=breakpoint_id, flag=has_breakpoint: self.on_breakpoint_enter(
-                    breakpoint_id, flag
-                ),
-            )
+            if relative and linenum != current:
+                linenum = abs(linenum - current)
+            self.coords(number, 40, y)
+            self.itemconfig(number, text=linenum, fill=self.fg, state=tk.NORMAL)
 
-            self.tag_bind(
-                i,
-                "<Leave>",
-                lambda _, breakpoint_id=breakpoint_id, flag=has_breakpoint: self.on_breakpoint_leave(
-                    breakpoint_id, flag
-                ),
-            )
+        for oval, number in self.pool[len(self.lines) :]:
+            self.itemconfig(oval, state=tk.HIDDEN)
+            self.itemconfig(number, state=tk.HIDDEN)
 
-            i = self.text.index(f"{i}+1line")
+        self.current = self.hovered = None
+        self.highlight_current(current)
+
+    def row(self, line: int) -> int | None:
+        """Returns the row showing a line, None if it is not in view"""
+
+        if self.lines and 0 <= (row := line - self.lines[0]) < len(self.lines):
+            return row
+
+    def row_at(self, y: int) -> int | None:
+        """Returns the row at a y coordinate"""
+
+        if (row := bisect_right(self.ys, y) - 1) >= 0:
+            return row
+
+    def highlight_current(self, line: int) -> None:
+        if line == self.current:
+            return
+
+        if self.current is not None and (row := self.row(self.current)) is not None:
+            self.itemconfig(self.pool[row][1], fill=self.fg)
+        if (row := self.row(line)) is not None:
+            self.itemconfig(self.pool[row][1], fill=self.hfg)
+        self.current = line
+
+    def on_enter(self, event: tk.Event) -> None:
+        if (row := self.row_at(event.y)) is None:
+            return
+
+        self.hovered = row
+        if self.lines[row] not in self.breakpoints:
+            self.itemconfig(self.pool[row][0], fill=self.bp_hover_color)
+
+    def on_leave(self, _: tk.Event) -> None:
+        if (row := self.hovered) is None:
+            return
 
-    def on_breakpoint_enter(self, id, flag):
-        self.itemconfig(id, fill=self.bp_enabled_color if flag else self.bp_hover_color)
+        self.hovered = None
+        if row < len(self.lines) and self.lines[row] not in self.breakpoints:
+            self.itemconfig(self.pool[row][0], fill=self.bg)
 
-    def on_breakpoint_leave(self, id, flag):
-        self.itemconfig(id, fill=self.bp_enabled_color if flag else self.bg)
+    def on_click(self, event: tk.Event) -> None:
+        if (row := self.row_at(event.y)) is not None:
+            self.toggle_breakpoint(self.lines[row])
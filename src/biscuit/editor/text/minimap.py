@@ -9,20 +9,60 @@ if typing.TYPE_CHECKING:
     from . import TextEditor
     from .text import Text
 
+# width of the minimap, a pixel per column
+WIDTH = 100
+# lines turned into pixel rows per step, the rest are rendered on the next ones
+RENDER_BATCH = 2000
+# smallest height of the slider
+MIN_SLIDER = 8
+
+
+def common_prefix(a: list, b: list) -> int:
+    """Returns the length of the common prefix of two lists, compared in slices"""
+
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a: list, b: list, limit: int) -> int:
+    """Returns the length of the common suffix of two lists, at most `limit`"""
+
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid :] == b[len(b) - mid :]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
 
-# TODO update minimap when scrollbar is used
-# TODO rewrite the handling with proper yview (percentage change)
 class Minimap(Frame):
+    """Overview of the document, a pixel row per line
+
+    Lines are drawn into a bitmap in the colors of their highlight spans. What is drawn
+    is remembered as the hash and the spans of every line, a redraw only renders the
+    lines whose hash or spans changed since. Rows below an edit that added or removed
+    lines are moved within the bitmap instead of rendered again. Scrolling only moves
+    the bitmap and the slider, which follows the yview of the text."""
+
     def __init__(self, master: TextEditor, text: Text = None, *args, **kwargs) -> None:
         super().__init__(master, *args, **kwargs)
         self.tw = text
-        self.font = ("Arial", 1, "bold")
         self.config(highlightthickness=0, bg=self.base.theme.border)
 
         self.cw = tk.Canvas(
-            self, width=100, highlightthickness=0, **self.base.theme.editors.minimap
+            self, width=WIDTH, highlightthickness=0, **self.base.theme.editors.minimap
         )
         self.cw.pack(fill=tk.BOTH, expand=True, side=tk.LEFT, padx=(1, 0))
+        self.bg = self.base.theme.editors.minimap.background
+        self.fg = self.base.theme.editors.text.foreground
 
         self.slider_image = tk.PhotoImage(
             data="""iVBORw0KGgoAAAANSUhEUgAAAG4AAABFCAYAAACrMNMO
@@ -32,39 +72,191 @@ class Minimap(Frame):
         KMizIuyrgo46KMizIuyrgo46KMizIuyrgo46KMizIuyrgo46KMizIuyrgo46KMizIuyrgo46KMizIu6gNeAwIJ
         26ERewAAAABJRU5ErkJggg=="""
         )
+        # the slider is the image above tiled to the height of the view
+        self.slider = tk.PhotoImage(width=WIDTH, height=MIN_SLIDER)
+        self.slider_height = 0
 
-        self.cw.create_image(0, 0, image=self.slider_image, anchor=tk.NW, tag="slider")
+        self.image = tk.PhotoImage(width=WIDTH, height=1)
+        # rows moved after an edit are copied through this one
+        self.block = tk.PhotoImage()
+        self.cw.create_image(0, 0, image=self.image, anchor=tk.NW, tag="map")
+        self.cw.create_image(0, 0, image=self.slider, anchor=tk.NW, tag="slider")
 
-        self.y_top_lim = 0
-        self._drag_data = {"y": 0, "item": None}
-        self.yvalue = 0
+        # hash and spans of the line drawn at each row, None if it is not drawn yet
+        self.hashes: list[int | None] = []
+        self.spans: list[list | None] = []
+        self.colors: dict[str, str] = {}
+        self.tag_colors = None
+        self.job: str | None = None
+
+        # rows of the bitmap scrolled above the canvas, and the slider position
+        self.offset = 0
+        self.slider_top = 0
+        self.drag_y: int | None = None
 
         self.cw.tag_bind("slider", "<ButtonPress-1>", self.drag_start)
         self.cw.tag_bind("slider", "<ButtonRelease-1>", self.drag_stop)
         self.cw.tag_bind("slider", "<B1-Motion>", self.drag)
+        self.cw.tag_bind("map", "<ButtonPress-1>", self.jump)
+        self.cw.bind("<Configure>", lambda _: self.scroll())
 
     def attach(self, textw):
         self.tw = textw
+        self.tw.bind("<<Highlight>>", lambda _: self.schedule(), add=True)
 
-    def redraw(self):
-        self.cw.delete("redrawn")
+    def redraw(self) -> None:
+        """Bring the bitmap in line with the document and render the changed lines"""
 
         if not self.tw:
             return
 
-        self.text = self.tw.get("1.0", tk.END)
-        self.cw.create_text(
-            5,
-            0,
-            text=self.text,
-            anchor=tk.NW,
-            font=self.font,
-            fill="grey",
-            tag="redrawn",
-        )
+        hashes = self.tw.get_line_hashes()
+        old, new = len(self.hashes), len(hashes)
+        if old != new:
+            # keep the rows below the edit, moving them to where their lines are now
+            start = common_prefix(self.hashes, hashes)
+            end = common_suffix(self.hashes, hashes, min(old, new) - start)
+
+            if end:
+                self.tk.call(
+                    self.block,
+                    "copy",
+                    self.image,
+                    "-shrink",
+                    "-from",
+                    0,
+                    old - end,
+                    WIDTH,
+                    old,
+                )
+            self.image.config(height=max(1, new))
+            if end:
+                self.tk.call(self.image, "copy", self.block, "-to", 0, new - end)
+
+            self.hashes[start : old - end] = [None] * (new - end - start)
+            self.spans[start : old - end] = [None] * (new - end - start)
+
+        self.scroll()
+        self.render()
+
+    def schedule(self) -> None:
+        """Render the changed lines when idle"""
+
+        if not self.job:
+            self.job = self.after_idle(self.render)
+
+    def render(self) -> None:
+        """Render a batch of the lines whose text or spans changed since drawn"""
+
+        if self.job:
+            self.after_cancel(self.job)
+            self.job = None
+
+        highlighter = self.tw.highlighter
+        if highlighter.tag_colors is not self.tag_colors:
+            self.tag_colors = highlighter.tag_colors
+            self.colors = {
+                str(token): props.get("foreground") if isinstance(props, dict) else props
+                for token, props in self.tag_colors.items()
+            }
+            self.hashes = [None] * len(self.hashes)
+
+        hashes = self.tw.get_line_hashes()
+        if len(hashes) != len(self.hashes):
+            return self.redraw()
+
+        spans = highlighter.spans
+        if len(spans) != len(hashes):
+            # highlighter is out of sync, lines are drawn without colors until it is not
+            spans = [None] * len(hashes)
+
+        dirty = [
+            i
+            for i, (drawn, line_hash, drawn_spans, line_spans) in enumerate(
+                zip(self.hashes, hashes, self.spans, spans)
+            )
+            if drawn != line_hash or drawn_spans is not line_spans
+        ]
+        if not dirty:
+            return
+
+        # lines shown in the minimap first
+        dirty.sort(key=lambda i: i < self.offset)
+        batch = sorted(dirty[:RENDER_BATCH])
+
+        first = last = batch[0]
+        for i in batch[1:] + [None]:
+            if i == last + 1:
+                last = i
+                continue
+
+            self.render_lines(first, last, spans)
+            self.hashes[first : last + 1] = hashes[first : last + 1]
+            self.spans[first : last + 1] = spans[first : last + 1]
+            if i is not None:
+                first = last = i
+
+        if len(dirty) > RENDER_BATCH:
+            self.job = self.after(1, self.render)
+
+    def render_lines(self, first: int, last: int, spans: list) -> None:
+        """Draw the pixel rows of lines `first` to `last` (0-based, inclusive)"""
+
+        lines = self.tw.get(f"{first + 1}.0", f"{last + 1}.end").split("\n")
+        rows = [
+            self.get_row(line, line_spans)
+            for line, line_spans in zip(lines, spans[first : last + 1])
+        ]
+
+        self.image.put(self.bg, to=(0, first, WIDTH, last + 1))
+        if width := max(map(len, rows)):
+            data = " ".join(
+                "{" + " ".join(row + [self.bg] * (width - len(row))) + "}" for row in rows
+            )
+            self.image.put(data, to=(0, first))
+
+    def get_row(self, line: str, spans: list | None) -> list[str]:
+        """Returns the colors of the pixels of a line, a pixel per column"""
+
+        line = line[:WIDTH].rstrip()
+        bg, fg = self.bg, self.fg
+        row = [bg if char.isspace() else fg for char in line]
+        for tag, start, end in spans or ():
+            if color := self.colors.get(tag):
+                for x in range(start, min(end, len(row))):
+                    if row[x] is not bg:
+                        row[x] = color
+        return row
+
+    def scroll(self) -> None:
+        """Move the bitmap and the slider to follow the view of the text"""
 
-        self.y_bottom_lim = int(self.tw.index(tk.END).split(".")[0]) * 2 + 10
-        # self.y_bottom_lim = self.tw.yview()[1] * self.cw.winfo_height()
+        if not self.tw:
+            return
+
+        lines = len(self.hashes) or 1
+        height = self.cw.winfo_height()
+        first, last = self.tw.yview()
+        visible = last - first
+
+        # a document taller than the minimap scrolls along, in step with the view
+        self.offset = 0
+        if lines > height and visible < 1:
+            self.offset = round(min(1, first / (1 - visible)) * (lines - height))
+
+        slider_height = max(MIN_SLIDER, round(visible * lines))
+        if slider_height != self.slider_height:
+            self.slider_height = slider_height
+            self.slider.blank()
+            self.slider.config(height=slider_height)
+            self.tk.call(
+                self.slider, "copy", self.slider_image, "-to", 0, 0, WIDTH, slider_height
+            )
+
+        self.slider_top = round(first * lines) - self.offset
+        self.cw.coords("map", 0, -self.offset)
+        self.cw.coords("slider", 0, self.slider_top)
+        self.redraw_cursor()
 
     def redraw_cursor(self):
         self.cw.delete("cursor")
@@ -72,31 +264,34 @@ class Minimap(Frame):
         if not self.tw:
             return
 
-        y = int(self.tw.index(tk.INSERT).split(".")[0]) * 2
-        self.cw.create_line(0, y, 100, y, fill="#dc8c34", width=2, tag="cursor")
+        y = int(self.tw.index(tk.INSERT).split(".")[0]) - 1 - self.offset
+        self.cw.create_line(0, y, WIDTH, y, fill="#dc8c34", width=2, tag="cursor")
+
+    def jump(self, event: tk.Event) -> None:
+        """Center the view on the line clicked"""
+
+        lines = len(self.hashes) or 1
+        first, last = self.tw.yview()
+        self.tw.yview_moveto((event.y + self.offset) / lines - (last - first) / 2)
+        self.tw.master.on_scroll()
 
     def drag_start(self, event: tk.Event):
-        self._drag_data["item"] = self.cw.find_closest(event.x, event.y)[0]
-        self._drag_data["y"] = event.y
+        self.drag_y = event.y - self.slider_top
 
-    def drag_stop(self, event: tk.Event):
-        self._drag_data["item"] = None
-        self._drag_data["y"] = 0
+    def drag_stop(self, _: tk.Event):
+        self.drag_y = None
 
     def drag(self, event: tk.Event):
-        item = self._drag_data["item"]
-        if item != 1:
+        if self.drag_y is None:
             return
 
-        delta_y = event.y - self._drag_data["y"]
-        self.cw.move(item, 0, delta_y)
-        self._drag_data["y"] = event.y
-
-        self.yvalue = y = self.cw.coords(item)[1]
-        if y <= self.y_top_lim:
-            self.cw.move("slider", 0, -(y - self.y_top_lim))
-        elif y >= self.y_bottom_lim:
-            self.cw.move("slider", 0, -(y - self.y_bottom_lim))
+        first, last = self.tw.yview()
+        visible = last - first
+        track = min(len(self.hashes), self.cw.winfo_height()) - self.slider_height
+        if track <= 0 or visible >= 1:
+            return
 
-        self.tw.yview(int(y / self.cw.winfo_height() * 350))
+        top = max(0, min(event.y - self.drag_y, track))
+        self.tw.yview_moveto((1 - visible) * top / track)
+        self.scroll()
         self.tw.master.on_scroll()
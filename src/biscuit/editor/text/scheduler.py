@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import tkinter as tk
+import typing
+
+# reasons a refresh is requested for
+CONTENT = "content"
+CURSOR = "cursor"
+SCROLL = "scroll"
+
+
+class RefreshTask:
+    """A refresh step, run when one of its reasons is marked"""
+
+    def __init__(
+        self, callback: typing.Callable[[], typing.Any], reasons: set[str], delay: int
+    ) -> None:
+        self.callback = callback
+        self.reasons = reasons
+        self.delay = delay
+
+        self.dirty = False
+        self.timer: str | None = None
+
+
+class RefreshScheduler:
+    """Coalesces the refreshes of an editor
+
+    Changes are marked with the reason they happened for (content, cursor or scroll).
+    Every task subscribed to that reason is marked dirty and runs at most once per frame:
+    tasks without a delay run together when the app goes idle, the others are debounced
+    and run once no change was marked for `delay` milliseconds. Holding down a key or
+    pasting no longer queues a full refresh per event."""
+
+    def __init__(self, widget: tk.Misc) -> None:
+        self.widget = widget
+        self.tasks: list[RefreshTask] = []
+        self.frame: str | None = None
+
+    def add(
+        self, callback: typing.Callable[[], typing.Any], *reasons: str, delay: int = 0
+    ) -> None:
+        """Add a refresh task, tasks without a delay run in the order they are added
+
+        Args:
+            callback (Callable): The refresh step
+            reasons (str): Reasons the task has to run for
+            delay (int, optional): Debounce window in milliseconds. Defaults to 0,
+                the task runs at the next idle."""
+
+        self.tasks.append(RefreshTask(callback, set(reasons), delay))
+
+    def mark(self, *reasons: str) -> None:
+        """Mark the tasks subscribed to any of the reasons as dirty
+
+        Args:
+            reasons (str): Reasons for the refresh"""
+
+        for task in self.tasks:
+            if task.reasons.isdisjoint(reasons):
+                continue
+
+            if not task.delay:
+                task.dirty = True
+                continue
+
+            if task.timer:
+                self.widget.after_cancel(task.timer)
+            task.timer = self.widget.after(task.delay, lambda t=task: self.run(t))
+
+        if not self.frame and any(task.dirty for task in self.tasks):
+            self.frame = self.widget.after_idle(self.run_frame)
+
+    def run_frame(self) -> None:
+        """Run all the dirty tasks"""
+
+        self.frame = None
+        for task in self.tasks:
+            if task.dirty:
+                task.dirty = False
+                self.run(task)
+
+    def run(self, task: RefreshTask) -> None:
+        task.timer = None
+        if not self.widget.winfo_exists():
+            # editor was closed in the meantime
+            return
+
+        task.callback()
@@ -4,9 +4,11 @@ import os
 import queue
 import re
 import threading
+import time
 import tkinter as tk
 import typing
 from collections import deque
+from contextlib import contextmanager
 from tkinter.messagebox import askokcancel
 
 import chardet
@@ -14,8 +16,6 @@ import tarts as lsp
 from editorconfig import EditorConfigError
 from editorconfig import get_properties as get_editorconfig
 
-from biscuit.common.minclosestdict import MinClosestKeyDict
-from biscuit.common.textindex import TextIndex
 from biscuit.language.data import Diagnostic
 
 if typing.TYPE_CHECKING:
@@ -32,12 +32,14 @@ from biscuit.common import textutils
 from biscuit.common.ui import Text as BaseText
 
 from ..comment_prefix import get_comment_prefix
+from .brackets import BRACKET_MAP, BracketIndex, get_string_patterns
+from .changes import Change, Changes
+from .diagnostics import DiagnosticStore, format_index, severity_tag
 from .highlighter import Highlighter
+from .words import WordIndex
 
-BRACKET_MAP = {"(": ")", "{": "}", "[": "]"}
-BRACKET_MAP_REV = {v: k for k, v in BRACKET_MAP.items()}
-OPENING_BRACKETS = ("(", "{", "[")
-CLOSING_BRACKETS = (")", "}", "]")
+# words in these tokens are not highlighted as occurrences of the current word
+SKIPPED_TOKENS = ("Token.Keyword", "Token.Literal.String", "Token.Comment")
 
 
 class Text(BaseText):
@@ -59,7 +61,7 @@ class Text(BaseText):
         self.path = path
         self.filename = os.path.basename(path) if path else None
         self.encoding = "utf-8"
-        self.eol = "CRLF"
+        self.eol = textutils.get_default_newline()
         self.exists = exists
         self.minimalist = minimalist
         self.standalone = standalone
@@ -70,14 +72,19 @@ class Text(BaseText):
 
         self.ctrl_down = False
         self.buffer_size = 4096
+        # whether the file is being read into the widget
+        self.loading = False
+        self.load_started = self.first_frame_shown = 0.0
         self.bom = True
         self.current_word = None
-        self.words: list[str] = []
         self.lsp: bool = False
         self.current_indent_level = 0
+        # indent level of every line, -1 for empty lines
+        self.indents: list[int] = []
         self.insert_final_newline = False
 
         self.hover_after = None
+        self.completion_after = None
         self.last_hovered = None
         self.tab_spaces = self.base.tab_spaces
 
@@ -87,21 +94,35 @@ class Text(BaseText):
             self.insert_final_newline = self.editorconfig.get(
                 "insert_final_newline", False
             )
-            self.eol = self.editorconfig.get("end_of_line", "CRLF")
+            self.eol = self.editorconfig.get(
+                "end_of_line", textutils.get_default_newline()
+            )
             self.encoding = self.editorconfig.get("charset", "utf-8")
             self.tab_spaces = int(self.editorconfig.get("indent_size", 4))
         except EditorConfigError:
             self.editorconfig = {}
 
-        # self.last_change = Change(None, None, None, None, None)
+        self.last_change: Change | None = None
+        # bumped on every edit to the content
+        self.version = 0
         self.highlighter = Highlighter(self, language)
+        shared_words = None
         if not self.standalone and not self.minimalist:
             self.base.statusbar.on_open_file(self)
             self.autocomplete = self.base.autocomplete
             self.definitions = self.base.peek
             self.hover = self.base.hover
+            if self.base.settings.config.shared_word_completions:
+                shared_words = self.autocomplete.words
+
+        # words for completions without a language server, built when first used or
+        # once the file is loaded when the index is shared with the other tabs
+        self.words = WordIndex(shared_words)
+        self.words_stale = True
+        # hash of every line, to tell whether the content is back to a saved state
+        self.line_hashes: list[int] | None = None
 
-        self.diagnostics = MinClosestKeyDict()
+        self.diagnostics = DiagnosticStore()
 
         self.focus_set()
         self.config_tags()
@@ -109,6 +130,16 @@ class Text(BaseText):
         self.config_bindings()
         self.update_idletasks()
         self.comment_prefix = get_comment_prefix(self.language.lower())
+        self.brackets = BracketIndex(
+            self.comment_prefix,
+            strings=(
+                get_string_patterns(self.language_alias)
+                if self.highlighter.lexer
+                else ()
+            ),
+        )
+        # whether the bracket index has to be rebuilt before it is used
+        self.brackets_stale = True
         tab_width = self.base.settings.font.measure(" " * self.tab_spaces)
         self.configure(
             tabs=(tab_width,),
@@ -123,8 +154,10 @@ class Text(BaseText):
         # modified event
         self.clear_modified_flag()
         self._user_edit = True
-        self._edit_stack = []
-        self._edit_stack_index = -1
+        self.history = Changes()
+        # edits made in a transaction, notified about once it is over
+        self.transaction_depth = 0
+        self.transaction_changes: list[Change] = []
 
     def config_tags(self):
         self.indentguide_stipple = self.base.resources.indent_guide
@@ -175,6 +208,8 @@ class Text(BaseText):
 
     def config_bindings(self):
         self.bind("<KeyRelease>", self.key_release_events)
+        if self.base.latency.enabled:
+            self.bind("<KeyPress>", self.base.latency.key_pressed, add=True)
 
         self.bind("<Control-f>", self.open_find_replace)
         self.bind("<Control-g>", lambda _: self.base.palette.show(":"))
@@ -194,9 +229,6 @@ class Text(BaseText):
         self.bind("<Tab>", self.tab_key_events)
         self.bind("<Shift-Tab>", self.dedent_selection)
 
-        # undo-redo
-        self.bind_all("<<Modified>>", self._been_modified)
-
         # pair completion
         self.bind("<parenleft>", self.open_bracket)
         self.bind("<braceleft>", self.open_bracket)
@@ -205,6 +237,7 @@ class Text(BaseText):
         self.bind("<parenright>", self.close_bracket)
         self.bind("<braceright>", self.close_bracket)
         self.bind("<bracketright>", self.close_bracket)
+        self.bind("<Control-bar>", self.goto_matching_bracket)
 
         self.bind("<apostrophe>", self.complete_pair)
         self.bind("<quotedbl>", self.complete_pair)
@@ -294,46 +327,168 @@ class Text(BaseText):
                 else:
                     self.show_autocomplete(event)
 
-        self.update_words_list()
-
     def diagnostic_hover(self, severity: int) -> str:
-        if pos := self.get_mouse_pos():
-            message, start = self.diagnostics[pos]
-            self.base.diagnostic.show(self, start, message, severity)
+        if not (pos := self.get_mouse_pos()):
+            return
+
+        tag = severity_tag(severity)
+        found = [
+            entry
+            for entry in self.diagnostics.at(pos)
+            if severity_tag(entry[2]) == tag
+        ]
+        if found:
+            self.base.diagnostic.show(
+                self,
+                format_index(found[0][0]),
+                "\n".join(entry[3] for entry in found),
+                severity,
+            )
 
     def update_indent_guides(self) -> None:
+        """Tag the indent guides of the lines in view, the guides of the block
+        around the cursor are tagged as current"""
+
         if self.minimalist:
             return
 
+        lines = int(self.index("end-1c").split(".")[0])
+        if len(self.indents) != lines:
+            self.indents = [
+                self.line_indent_level(line)
+                for line in self.get("1.0", "end-1c").split("\n")
+            ]
+
         self.tag_remove("indent_guide", "1.0", "end")
         self.tag_remove("current_indent_guide", "1.0", "end")
-        lines = self.get("1.0", "end-1c").split("\n")
 
         self.current_indent_level = self.get_current_indent_level() - 1
+        first, last = self.get_visible_range()
+        last = min(last, lines)
+
+        # the block around the cursor, empty lines do not end it
+        cursor = self.line
+        top = bottom = cursor
+        while top > first and (
+            self.indents[top - 2] == -1
+            or self.indents[top - 2] > self.current_indent_level
+        ):
+            top -= 1
+        while bottom < last and (
+            self.indents[bottom] == -1
+            or self.indents[bottom] > self.current_indent_level
+        ):
+            bottom += 1
+
+        guides, current = [], []
+        for line_number in range(first, last + 1):
+            for level in range(self.indents[line_number - 1]):
+                indices = (
+                    f"{line_number}.{level * self.tab_spaces - 1}",
+                    f"{line_number}.{level * self.tab_spaces + 1}",
+                )
+                if level == self.current_indent_level and top <= line_number <= bottom:
+                    current.extend(indices)
+                else:
+                    guides.extend(indices)
 
-        for line_number, line in enumerate(lines, start=1):
-            indent_level = self.calculate_indent_level(line)
-            if indent_level > 0:
-                self.add_indent_guide(line_number, indent_level)
+        if guides:
+            self.tag_add("indent_guide", *guides)
+        if current:
+            self.tag_add("current_indent_guide", *current)
+
+    def patch_indents(self, change: Change, lines: list[str]) -> None:
+        """Recompute the cached indent levels of the lines touched by an edit
+
+        Args:
+            change (Change): The edit made
+            lines (list[str]): The lines touched, after the edit"""
+
+        first, old_last = change.start[0], change.old_end[0]
+        if len(self.indents) < old_last:
+            # out of sync, rebuilt by the next update
+            return
+
+        self.indents[first - 1 : old_last] = [
+            self.line_indent_level(line) for line in lines
+        ]
+
+    def patch_brackets(self, change: Change, lines: list[str]) -> None:
+        """Rescan the brackets of the lines touched by an edit
+
+        Args:
+            change (Change): The edit made
+            lines (list[str]): The lines touched, after the edit"""
+
+        if self.brackets_stale:
+            return
+
+        first, old_last, new_last = change.start[0], change.old_end[0], change.new_end[0]
+        if self.brackets.lines != int(self.index("end-1c").split(".")[0]) - (
+            new_last - old_last
+        ):
+            # out of sync, rebuilt when next used
+            self.brackets_stale = True
+            return
+
+        self.brackets.edited(first, old_last, lines)
+
+    def patch_words(self, change: Change, lines: list[str]) -> None:
+        """Rescan the words of the lines touched by an edit
+
+        Args:
+            change (Change): The edit made
+            lines (list[str]): The lines touched, after the edit"""
+
+        if self.words_stale:
+            return
+
+        first, old_last, new_last = change.start[0], change.old_end[0], change.new_end[0]
+        if len(self.words.lines) != int(self.index("end-1c").split(".")[0]) - (
+            new_last - old_last
+        ):
+            # out of sync, rebuilt when next used
+            self.words_stale = True
+            return
+
+        self.words.edited(first, old_last, lines)
+
+    def patch_line_hashes(self, change: Change, lines: list[str]) -> None:
+        if self.line_hashes is None:
+            return
+
+        first, old_last = change.start[0], change.old_end[0]
+        if len(self.line_hashes) < old_last:
+            self.line_hashes = None
+            return
+
+        self.line_hashes[first - 1 : old_last] = map(hash, lines)
+
+    def get_line_hashes(self) -> list[int]:
+        """Returns the hash of every line, rebuilding them if they are out of date"""
+
+        if self.line_hashes is None or len(self.line_hashes) != int(
+            self.index("end-1c").split(".")[0]
+        ):
+            text = self.get("1.0", "end-1c")
+            self.line_hashes = [hash(line) for line in text.split("\n")]
+        return self.line_hashes
+
+    def get_brackets(self) -> BracketIndex:
+        """Returns the bracket index, rebuilding it if it is out of date"""
+
+        if self.brackets_stale:
+            self.brackets.rebuild(self.get("1.0", "end-1c"))
+            self.brackets_stale = False
+        return self.brackets
+
+    def line_indent_level(self, line: str) -> int:
+        return self.calculate_indent_level(line) if line else -1
 
     def calculate_indent_level(self, line: str) -> int:
         indent = len(line) - len(line.lstrip())
         return indent // self.tab_spaces
 
-    def add_indent_guide(self, line_number: int, indent_level: int) -> None:
-        for level in range(indent_level):
-            start_index = f"{line_number}.{level * self.tab_spaces - 1}"
-            end_index = f"{line_number}.{level * self.tab_spaces + 1}"
-            self.tag_add(
-                (
-                    "current_indent_guide"
-                    if level == self.current_indent_level
-                    else "indent_guide"
-                ),
-                start_index,
-                end_index,
-            )
-
     def get_current_indent_level(self) -> int:
         prev = self.get("insert-1l linestart", "insert-1l lineend")
         line = self.get("insert linestart", "insert lineend")
@@ -345,61 +500,56 @@ class Text(BaseText):
             self.calculate_indent_level(next_line),
         )
 
-    # TODO this wont work properly
-    # write a custom ast, parser for bracket matching
+    def get_bracket_pair(self) -> tuple[str, str] | None:
+        """Returns the positions of the bracket next to the cursor and the one matching it.
+        Falls back to the innermost pair of brackets around the cursor."""
+
+        line, column = map(int, self.index(tk.INSERT).split("."))
+        brackets = self.get_brackets()
+
+        for col in (column - 1, column):
+            if col >= 0 and (match := brackets.match(line, col)):
+                return f"{line}.{col}", "{}.{}".format(*match)
+
+        if opening := brackets.enclosing(line, column):
+            if closing := brackets.match(*opening):
+                return "{}.{}".format(*opening), "{}.{}".format(*closing)
+
     def highlight_current_brackets(self):
         self.tag_remove("activebracket", "1.0", tk.END)
-        i = self.index(tk.INSERT)
-        start, end = None, None
+        if not (pair := self.get_bracket_pair()):
+            return
 
-        try:
-            if start := self.search(
-                r"[\{\[\(\)\]\}]", i, i + " linestart", backwards=True, regexp=True
-            ):
-                if counter := BRACKET_MAP.get(self.get(start, start + "+1c")):
-                    end = self.search(counter, i, stopindex=i + " lineend")
-        except tk.TclError:
-            pass
+        for position in pair:
+            self.tag_add("activebracket", position, position + "+1c")
 
-        if not end:
-            return
+    def goto_matching_bracket(self, *_):
+        """Move the cursor to the bracket matching the one next to it,
+        or to the end of the brackets around it"""
 
-        self.tag_add("activebracket", start, start + "+1c")
-        self.tag_add("activebracket", end, end + "+1c")
+        if not (pair := self.get_bracket_pair()):
+            return "break"
+
+        self.mark_set(tk.INSERT, pair[1])
+        self.see(tk.INSERT)
+        return "break"
 
     def refresh_wrap(self):
         self.config(wrap=tk.WORD if self.base.wrap_words else tk.NONE)
 
     def open_bracket(self, e: tk.Event):
-        text = self.get("1.0", "insert")
-        i = 0
-        for ch in text:
-            if ch in OPENING_BRACKETS:
-                i += 1
-            elif ch in CLOSING_BRACKETS:
-                if i > 0:
-                    i -= 1
-        self.complete_pair(e, self.base.theme.editors.bracket_colors[(i % 3)])
+        line, column = map(int, self.index(tk.INSERT).split("."))
+        depth = max(self.get_brackets().depth_at(line, column), 0)
+        self.complete_pair(e, self.base.theme.editors.bracket_colors[(depth % 3)])
 
         return "break"
 
     def close_bracket(self, e: tk.Event):
-        text = self.get("1.0", "insert")
-        i = -1
-        stack = []
-        for ch in text:
-            if ch in OPENING_BRACKETS:
-                i += 1
-                stack.append(BRACKET_MAP[ch])
-            elif ch in CLOSING_BRACKETS:
-                if i > -1:
-                    i -= 1
-                    if stack[-1] == ch:
-                        stack.pop()
-        if stack and stack[-1] == e.char:
+        line, column = map(int, self.index(tk.INSERT).split("."))
+        if opening := self.get_brackets().enclosing(line, column):
             # skip if next character is what we are closing
-            if c := self.get("insert", "insert+1c"):
-                if c == e.char:
+            if BRACKET_MAP[self.get("{}.{}".format(*opening))] == e.char:
+                if self.get("insert", "insert+1c") == e.char:
                     self.mark_set(tk.INSERT, "insert+1c")
                     return "break"
 
@@ -460,19 +610,19 @@ class Text(BaseText):
         self.autocomplete.show(self)
         self.update_completions()
 
-    def update_words_list(self, *_):
-        if self.minimalist or self.lsp:
-            return
+    def build_words(self) -> None:
+        """Index the words of the document, unless they are indexed already"""
 
-        try:
-            content = (
-                self.get(1.0, "insert-1c wordstart-1c")
-                + " "
-                + self.get("insert+1c", tk.END)
-            )
-            self.words = list(set(re.findall(r"\w+", content)))
-        except:
-            pass
+        if self.words_stale:
+            self.words.rebuild(self.get("1.0", "end-1c"))
+            self.words_stale = False
+
+    def get_word_completions(self, term: str) -> list[str]:
+        """Returns the words of the document to complete `term` with,
+        closest and most used first"""
+
+        self.build_words()
+        return self.words.complete(term, int(self.index(tk.INSERT).split(".")[0]))
 
     def update_completions(self):
         """Helper function for `AutoComplete` popup.
@@ -559,12 +709,13 @@ class Text(BaseText):
         start_line = int(float(sel_first))
         end_line = int(float(sel_last))
 
-        for line in range(start_line, end_line + 1):
-            # skip empty lines, they won't be commented
-            if not self.get(f"{line}.0", f"{line}.0 lineend").strip():
-                continue
+        with self.transaction():
+            for line in range(start_line, end_line + 1):
+                # skip empty lines, they won't be commented
+                if not self.get(f"{line}.0", f"{line}.0 lineend").strip():
+                    continue
 
-            self.insert(f"{line}.0", f"{self.comment_prefix} ")
+                self.insert(f"{line}.0", f"{self.comment_prefix} ")
 
         self.tag_remove(tk.SEL, "1.0", tk.END)
         self.tag_add(tk.SEL, sel_first, sel_last)
@@ -579,19 +730,20 @@ class Text(BaseText):
         start_line = int(float(sel_first))
         end_line = int(float(sel_last))
 
-        for line in range(start_line, end_line + 1):
-            # delete comment prefix with the trailing space
-            if (
-                self.get(f"{line}.0", f"{line}.{len(self.comment_prefix)+1}")
-                == f"{self.comment_prefix} "
-            ):
-                self.delete(f"{line}.0", f"{line}.{len(self.comment_prefix)+1}")
-            # trailing space not detected, delete the comment prefix
-            elif (
-                self.get(f"{line}.0", f"{line}.{len(self.comment_prefix)}")
-                == f"{self.comment_prefix}"
-            ):
-                self.delete(f"{line}.0", f"{line}.{len(self.comment_prefix)}")
+        with self.transaction():
+            for line in range(start_line, end_line + 1):
+                # delete comment prefix with the trailing space
+                if (
+                    self.get(f"{line}.0", f"{line}.{len(self.comment_prefix)+1}")
+                    == f"{self.comment_prefix} "
+                ):
+                    self.delete(f"{line}.0", f"{line}.{len(self.comment_prefix)+1}")
+                # trailing space not detected, delete the comment prefix
+                elif (
+                    self.get(f"{line}.0", f"{line}.{len(self.comment_prefix)}")
+                    == f"{self.comment_prefix}"
+                ):
+                    self.delete(f"{line}.0", f"{line}.{len(self.comment_prefix)}")
 
         self.tag_remove(tk.SEL, "1.0", tk.END)
         self.tag_add(tk.SEL, sel_first, sel_last)
@@ -627,13 +779,14 @@ class Text(BaseText):
         start_line = int(float(sel_first))
         end_line = int(float(sel_last))
 
-        for line in range(start_line, end_line + 1):
-            if (
-                self.get(f"{line}.0", f"{line}.1") == "\t"
-                or self.get(f"{line}.0", f"{line}.{self.tab_spaces}")
-                == " " * self.tab_spaces
-            ):
-                self.delete(f"{line}.0", f"{line}.1")
+        with self.transaction():
+            for line in range(start_line, end_line + 1):
+                if (
+                    self.get(f"{line}.0", f"{line}.1") == "\t"
+                    or self.get(f"{line}.0", f"{line}.{self.tab_spaces}")
+                    == " " * self.tab_spaces
+                ):
+                    self.delete(f"{line}.0", f"{line}.1")
 
         self.tag_remove(tk.SEL, "1.0", tk.END)
         self.tag_add(tk.SEL, sel_first, sel_last)
@@ -647,8 +800,9 @@ class Text(BaseText):
         start_line = int(float(sel_first))
         end_line = int(float(sel_last))
 
-        for line in range(start_line, end_line + 1):
-            self.insert(f"{line}.0", "\t")
+        with self.transaction():
+            for line in range(start_line, end_line + 1):
+                self.insert(f"{line}.0", "\t")
 
         self.tag_remove(tk.SEL, "1.0", tk.END)
         self.tag_add(tk.SEL, sel_first, sel_last)
@@ -661,69 +815,16 @@ class Text(BaseText):
         if self.minimalist or self.standalone:
             return
 
-        self.current_word = self.get("insert-1c wordstart", "insert")
-        self.base.language_server_manager.request_outline(self)
+        self.update_current_word()
         self.highlight_current_line()
         self.highlight_current_brackets()
         self.update_indent_guides()
 
-        # TODO send only portions of text on change to the LSPServer
-        # current solution is not scalable, and will cause lag on large files
-
-        # commenting this out for now, as the way of handling changes is not properly done
-        # the changes shall be recorded before they are actually made, but we can't do that from here
-        # this requires writing a custom change handler for text widget
-        # eg. in the 'delete' command below, i can get indices like ('sel.start', 'sel.end') but not actual indices
-        # these are useless as if we try to index() these indices we will get indices from the modified content,
-        # not the old one. and since the modified content no longer have sel, this will throw an error
-
-        # if args[0] == tk.INSERT:
-        #     start_index = self.get_cursor_pos()
-
-        #     end_index = self.index(tk.INSERT + f"+{len(args[2])}c")
-        #     self.last_change.update(
-        #         start=[int(i) for i in start_index.split('.')],
-        #         old_end=[int(i) for i in start_index.split('.')],
-        #         new_end=[int(i) for i in end_index.split('.')],
-        #         old_text='',
-        #         new_text=args[2]
-        #     )
-
-        # elif args[0] == 'delete':
-        #     start_index = self.get_cursor_pos()
-        #     if len(args) == 2:
-        #         # is one char deleted
-        #         # ('delete', 'insert-1c')
-        #         start_index = self.index(tk.INSERT + f"-1c")
-        #         end_index = self.get_cursor_pos()
-        #         print(start_index, self.get(start_index, end_index), "------------------------------")
-        #     else:
-        #         # there must be selection then
-        #         # ('delete', 'sel.first', 'sel.last')
-        #         start_index = self.index(tk.SEL_FIRST)
-        #         end_index = self.index(tk.SEL_LAST)
-        #         print(start_index, self.get(start_index, end_index), "------------------------------")
-
-        #     self.last_change.update(
-        #         start=[int(i) for i in start_index.split('.')],
-        #         old_end=[int(i) for i in start_index.split('.')],
-        #         new_end=[int(i) for i in end_index.split('.')],
-        #         old_text='',
-        #         new_text=''
-        #     )
-        # elif args[0] == 'replace':
-        #     start_index = self.get_cursor_pos()
-        #     end_index = self.index(tk.INSERT + f"+{len(args[3])}c")
-        #     self.last_change.update(
-        #         start=[int(i) for i in start_index.split('.')],
-        #         old_end=[int(i) for i in start_index.split('.')],
-        #         new_end=[int(i) for i in end_index.split('.')],
-        #         old_text=args[3],
-        #         new_text=args[2]
-        #     )
-        # else:
-        #     return
-        # self.base.languageservermanager.content_changed(self)
+    def update_current_word(self) -> None:
+        self.current_word = self.get("insert-1c wordstart", "insert")
+
+    def request_outline(self) -> None:
+        self.base.language_server_manager.request_outline(self)
 
     def is_identifier(self, text: str) -> str:
         return bool(re.match("^[a-zA-Z_][a-zA-Z0-9_]*$", text))
@@ -768,6 +869,7 @@ class Text(BaseText):
                 self.tag_add("hyperlink", start, end)
         else:
             # TODO hide with a delay, cancel hiding if mouse is on top of hover popup
+            self.cancel_hover()
             self.hover.hide()
             self.tag_remove("hover", 1.0, tk.END)
             self.last_hovered = None
@@ -780,23 +882,40 @@ class Text(BaseText):
         self.tag_remove("hover", 1.0, tk.END)
         self.tag_add("hover", start, end)
 
-        # TODO delayed hovers
-        # if self.hover_after:
-        #     self.after_cancel(self.hover_after)
-
-        # self.after(500, ...)
+        # requested once the mouse rests on the word
+        self.cancel_hover()
+        self.hover_after = self.after(self.base.config.hover_delay_ms, self.send_hover)
 
+    def send_hover(self) -> None:
+        self.hover_after = None
         self.base.language_server_manager.request_hover(self)
 
+    def cancel_hover(self) -> None:
+        if self.hover_after:
+            self.after_cancel(self.hover_after)
+            self.hover_after = None
+
     def request_autocomplete(self, _):
         if self.minimalist or not self.lsp:
             return
 
+        if self.completion_after:
+            self.after_cancel(self.completion_after)
+            self.completion_after = None
+
         if self.is_identifier(self.current_word) or self.current_word.strip() == ".":
-            return self.base.language_server_manager.request_completions(self)
+            # requested once typing pauses
+            self.completion_after = self.after(
+                self.base.config.completion_delay_ms, self.send_completions
+            )
+            return
 
         self.hide_autocomplete()
 
+    def send_completions(self) -> None:
+        self.completion_after = None
+        self.base.language_server_manager.request_completions(self)
+
     def request_rename(self, *_):
         self.base.rename.show(self)
 
@@ -804,25 +923,40 @@ class Text(BaseText):
         self.autocomplete.lsp_update_completions(self, response.completions)
 
     def lsp_diagnostics(self, response: list[Diagnostic]) -> None:
-        self.tag_remove("error", 1.0, tk.END)
-        self.tag_remove("warning", 1.0, tk.END)
-        self.tag_remove("information", 1.0, tk.END)
-        self.tag_remove("hint", 1.0, tk.END)
-
-        self.diagnostics.clear()
-
-        for i in response:
-            self.diagnostics[i.start] = i.message
-
-            match i.severity:
-                case 1:
-                    self.tag_add("error", i.start, i.end)
-                case 2:
-                    self.tag_add("warning", i.start, i.end)
-                case 4:
-                    self.tag_add("hint", i.start, i.end)
-                case _:
-                    self.tag_add("information", i.start, i.end)
+        """Tag the diagnostics that changed since the last publish
+
+        Tags are removed over the ranges of the diagnostics gone and added over the
+        ones new, the ones kept are only tagged again where a removed range took
+        their tag with it. Ranges are batched into a call per tag."""
+
+        removed, added = self.diagnostics.update(response)
+        if not removed and not added:
+            return
+
+        removals: dict[str, list[str]] = {}
+        for start, end, severity, _ in removed:
+            removals.setdefault(severity_tag(severity), []).extend(
+                (format_index(start), format_index(end))
+            )
+        for tag, indices in removals.items():
+            self.tk.call(self._w, "tag", "remove", tag, *indices)
+
+        retag = set(added)
+        for start, end, severity, _ in removed:
+            tag = severity_tag(severity)
+            retag.update(
+                entry
+                for entry in self.diagnostics.overlapping(start, end)
+                if severity_tag(entry[2]) == tag
+            )
+
+        additions: dict[str, list[str]] = {}
+        for start, end, severity, _ in retag:
+            additions.setdefault(severity_tag(severity), []).extend(
+                (format_index(start), format_index(end))
+            )
+        for tag, indices in additions.items():
+            self.tag_add(tag, *indices)
 
     def lsp_goto_definition(self, response: Jump) -> None:
         if not response.locations:
@@ -982,9 +1116,7 @@ class Text(BaseText):
             file = open(
                 self.path, "r", encoding=self.encoding, buffering=self.buffer_size
             )
-            self.queue = queue.Queue()
-            threading.Thread(target=self.read_file, args=(file,)).start()
-            self.process_queue(eol=eol)
+            self.start_loading(file)
         else:
             self.load_text(text, eol=eol)
         self.eol = eol
@@ -1008,9 +1140,7 @@ class Text(BaseText):
                 newline=self.eol,
             )
 
-            self.queue = queue.Queue()
-            threading.Thread(target=self.read_file, args=(file,)).start()
-            self.process_queue()
+            self.start_loading(file)
         except Exception as e:
             print(e)
             if self.exists:
@@ -1042,10 +1172,7 @@ class Text(BaseText):
                 self.path, "r", encoding=self.encoding, buffering=self.buffer_size
             )
             self.eol = textutils.get_default_newline()
-
-            self.queue = queue.Queue()
-            threading.Thread(target=self.read_file, args=(file,), daemon=True).start()
-            self.process_queue()
+            self.start_loading(file)
         except Exception as e:
             print(e)
             if self.exists:
@@ -1086,48 +1213,103 @@ class Text(BaseText):
 
         threading.Thread(target=write_with_buffer, daemon=True).start()
 
-    def read_file(self, file: typing.TextIO):
-        while True:
-            try:
-                chunk = file.read(self.buffer_size)
-            except UnicodeDecodeError as e:
-                print(e)
-                self.master.unsupported_file()
-                return
-            if not chunk:
-                file.close()
-                self.queue.put(None)  # Signal the end of reading
-                break
-            self.queue.put(chunk)
+    def start_loading(self, file: typing.TextIO) -> None:
+        """Read a file into the widget. It is read and decoded on a thread,
+        then inserted in a few large slices by `process_queue`.
+
+        Args:
+            file (TextIO): The opened file, closed once read"""
+
+        self.loading = True
+        self.load_started = time.perf_counter()
+        self.queue = queue.Queue()
+        threading.Thread(
+            target=self.read_file,
+            args=(file, self.base.settings.config.load_slice_size),
+            daemon=True,
+        ).start()
+        # not right away, the editor may still be setting up
+        self.after(1, self.process_queue)
+
+    def read_file(self, file: typing.TextIO, size: int) -> None:
+        """Decode the whole file and queue it in slices of `size` characters.
+        Runs on a thread, line endings are normalized while decoding."""
 
-    def process_queue(self, eol: str = None):
         try:
-            while True:
-                chunk = self.queue.get_nowait()
-                if chunk is None:
-                    # Finished loading file -- reached EOF 🚧
-                    try:
-                        self.master.on_change()
-                        self.master.on_scroll()
-                        self.update_idletasks()
-                        self.master.file_loaded()
-                        self.focus_set()
-                    except Exception:
-                        pass
-                    break
-                if eol:
-                    chunk.replace(self.eol or textutils.get_default_newline(), eol)
-
-                try:
-                    self.write(chunk)
-                    self.update()
-                    self.master.on_scroll()
-                except Exception:
-                    # editor was closed during file load
-                    return
+            with file:
+                text = file.read()
+        except UnicodeDecodeError as e:
+            self.queue.put(e)
+            return
+
+        for i in range(0, len(text), size):
+            self.queue.put(text[i : i + size])
+        # hashed here, off the UI thread
+        self.queue.put([hash(line) for line in text.split("\n")])
+        self.queue.put(None)  # Signal the end of reading
+
+    def process_queue(self) -> None:
+        """Insert the next slice read, the first frame is drawn after the first slice.
+        Refreshes are held off while loading and run once the content is in."""
+
+        try:
+            chunk = self.queue.get_nowait()
         except queue.Empty:
             # If the queue is empty, schedule the next check after a short delay
-            self.master.after(100, self.process_queue)
+            self.after(10, self.process_queue)
+            return
+
+        if isinstance(chunk, Exception):
+            self.base.logger.error(f"Failed to decode '{self.path}': {chunk}")
+            self.loading = False
+            self.master.unsupported_file()
+            return
+
+        if isinstance(chunk, list):
+            self.line_hashes = chunk
+            self.after(1, self.process_queue)
+            return
+
+        if chunk is None:
+            # Finished loading file -- reached EOF 🚧
+            self.loading = False
+            try:
+                if self.words.shared:
+                    # the other tabs complete with the words of this one too
+                    self.build_words()
+                self.history.clear()
+                self.master.on_change()
+                self.master.on_scroll()
+                self.update_idletasks()
+                self.master.file_loaded()
+                self.focus_set()
+            except Exception:
+                return
+
+            self.base.logger.info(
+                f"Opened '{self.filename}' in "
+                f"{(time.perf_counter() - self.load_started) * 1000:.0f} ms, "
+                f"first frame after {self.first_frame_shown * 1000:.0f} ms"
+            )
+            return
+
+        first = self.compare("end-1c", "==", "1.0")
+        self._user_edit = False
+        try:
+            self.write(chunk)
+            if first:
+                # show the top of the file while the rest is inserted
+                self.update_idletasks()
+                self.first_frame_shown = time.perf_counter() - self.load_started
+                self.master.on_change()
+                self.master.on_scroll()
+        except Exception:
+            # editor was closed during file load
+            return
+        finally:
+            self._user_edit = True
+
+        self.after(1, self.process_queue)
 
     def custom_get(self, start: str, end: str) -> str:
         """Ignore the text that is tagged with 'ignore_tag' and return the rest of the text."""
@@ -1140,27 +1322,34 @@ class Text(BaseText):
 
         return content
 
-    def save_file(self, path=None):
+    def save_file(self, path=None, on_saved=None, on_failed=None):
+        """Save the content in the background, to `path` if given
+
+        Args:
+            path (str, optional): Path to save to, becomes the path of the file.
+            on_saved (Callable, optional): Called once the file is written.
+            on_failed (Callable, optional): Called if writing failed."""
+
         if self.insert_final_newline:
             if not self.get("end-2c", "end-1c").endswith("\n"):
                 self.add_newline()
 
         if path:
-            try:
-                with open(path, "w") as fp:
-                    fp.write(self.get_all_text())
-            except Exception:
-                return
-
             self.path = path
             # TODO update tab name
 
-        try:
-            with open(self.path, "w") as fp:
-                fp.write(self.get_all_text())
-        except Exception:
+        if not self.path:
             return
 
+        self.base.save_manager.save(
+            self.path,
+            self.get_all_text(),
+            self.encoding,
+            self.eol,
+            on_saved=on_saved,
+            on_failed=on_failed,
+        )
+
     def event_focus_out(self, _: tk.Event):
         self.hide_autocomplete()
         self.hover.hide()
@@ -1170,6 +1359,7 @@ class Text(BaseText):
         self.hover.hide()
 
     def event_leave(self, _: tk.Event):
+        self.cancel_hover()
         self.hover.hide()
 
     def event_mapped(self, _):
@@ -1189,6 +1379,8 @@ class Text(BaseText):
         except:
             # most likely because app was closed
             pass
+        # take the words out of the index shared with the other tabs
+        self.words.clear()
         self.base.language_server_manager.request_removal(self)
 
     def event_unmapped(self, _):
@@ -1281,6 +1473,13 @@ class Text(BaseText):
     def get_all_text(self):
         return self.get(1.0, tk.END)
 
+    def get_visible_range(self) -> tuple[int, int]:
+        """Returns the first and last line numbers visible in the viewport"""
+
+        first = int(self.index("@0,0").split(".")[0])
+        last = int(self.index(f"@0,{self.winfo_height()}").split(".")[0])
+        return first, last
+
     @property
     def selection(self) -> str:
         try:
@@ -1372,14 +1571,42 @@ class Text(BaseText):
         self.move_cursor(end)
 
     def highlight_current_word(self):
+        """Highlight the occurrences of the word at the cursor in the lines in view,
+        unless it is a keyword or part of a string or comment"""
+
         self.tag_remove("currentword", 1.0, tk.END)
         if self.tag_ranges(tk.SEL):
             return
 
-        if word := re.findall(r"\w+", self.get("insert wordstart", "insert wordend")):
-            # TODO: do not highlight keywords, parts of strings, etc.
-            self.highlight_pattern(f"\\y{word[0]}\\y", "currentword", regexp=True)
-            # self.highlight_pattern(f"\\y{word[0]}\\y", "currentword", start="insert wordend", regexp=True)
+        start = self.index("insert wordstart")
+        if not (word := re.match(r"\w+", self.get(start, "insert wordend"))):
+            return
+        if self.is_skipped_token(*map(int, start.split("."))):
+            return
+
+        pattern = re.compile(rf"\b{re.escape(word.group())}\b")
+        limit = self.base.settings.config.current_word_highlight_limit
+        first, last = self.get_visible_range()
+        ranges = []
+        for number, text in enumerate(
+            self.get(f"{first}.0", f"{last}.end").split("\n"), first
+        ):
+            for match in pattern.finditer(text):
+                if self.is_skipped_token(number, match.start()):
+                    continue
+                ranges += [f"{number}.{match.start()}", f"{number}.{match.end()}"]
+            if len(ranges) >= 2 * limit:
+                del ranges[2 * limit :]
+                break
+
+        if ranges:
+            self.tag_add("currentword", *ranges)
+
+    def is_skipped_token(self, line: int, column: int) -> bool:
+        """Whether a position is in a keyword, string or comment token"""
+
+        tag = self.highlighter.tag_at(line, column)
+        return bool(tag and tag.startswith(SKIPPED_TOKENS))
 
     def highlight_pattern(self, pattern, tag, start="1.0", end=tk.END, regexp=False):
         start = self.index(start)
@@ -1404,47 +1631,47 @@ class Text(BaseText):
 
             self.tag_add(tag, "matchStart", "matchEnd")
 
-    def stack_undo(self):
-        if self._edit_stack_index > 0:
-            self._edit_stack_index = self._edit_stack_index - 1
-            self._user_edit = False
-            self.clear()
-            self.write(self._edit_stack[self._edit_stack_index][0][:-1])
-            self.mark_set("insert", self._edit_stack[self._edit_stack_index][1])
+    def edit_undo(self) -> None:
+        """Revert the last group of edits, applying their inverse in place"""
 
-    def stack_redo(self):
-        if self._edit_stack_index + 1 < len(self._edit_stack):
-            self._edit_stack_index = self._edit_stack_index + 1
-            self._user_edit = False
-            self.clear()
-            self.write(self._edit_stack[self._edit_stack_index][0][:-1])
-            self.mark_set("insert", self._edit_stack[self._edit_stack_index][1])
+        if not (group := self.history.undo()):
+            return
 
-    def _been_modified(self, event=None):
+        self._user_edit = False
         try:
-            if self._user_edit:
-                text = self.get_all_text()
-                if (not self._edit_stack) or (
-                    text != self._edit_stack[self._edit_stack_index][0]
-                ):
-                    # real modified
-                    cursor_index = self.index(tk.INSERT)
-                    if (self._edit_stack_index + 1) != len(self._edit_stack):
-                        self._edit_stack = self._edit_stack[
-                            : self._edit_stack_index + 1
-                        ]
-                    self._edit_stack.append([text, cursor_index])
-                    self._edit_stack_index = self._edit_stack_index + 1
-                    if self._edit_stack_index > 200:
-                        self._edit_stack = self._edit_stack[
-                            self._edit_stack_index - 50 : self._edit_stack_index + 1
-                        ]
-                        self._edit_stack_index = len(self._edit_stack) - 1
-            if self._resetting_modified_flag:
-                return
-            self.clear_modified_flag()
-        except:
-            self.base.notifications.error("Edit stack error: please restart biscuit")
+            with self.transaction():
+                for change in reversed(group):
+                    self.replace(
+                        "{}.{}".format(*change.start),
+                        "{}.{}".format(*change.new_end),
+                        change.old_text,
+                    )
+        finally:
+            self._user_edit = True
+
+        self.mark_set(tk.INSERT, "{}.{}".format(*group[0].old_end))
+        self.see(tk.INSERT)
+
+    def edit_redo(self) -> None:
+        """Make the last reverted group of edits again, in place"""
+
+        if not (group := self.history.redo()):
+            return
+
+        self._user_edit = False
+        try:
+            with self.transaction():
+                for change in group:
+                    self.replace(
+                        "{}.{}".format(*change.start),
+                        "{}.{}".format(*change.old_end),
+                        change.new_text,
+                    )
+        finally:
+            self._user_edit = True
+
+        self.mark_set(tk.INSERT, "{}.{}".format(*group[-1].new_end))
+        self.see(tk.INSERT)
 
     def clear_modified_flag(self):
         self._resetting_modified_flag = True
@@ -1453,10 +1680,136 @@ class Text(BaseText):
         finally:
             self._resetting_modified_flag = False
 
+    def resolve_change(self, args: tuple) -> Change | None:
+        """Resolve an insert/delete/replace command into the edit it is about to make.
+        Must be called before the command is applied, indices like `sel.first`
+        or `insert-1c` mean something else once the content has changed.
+
+        Returns None when the command does not change the content.
+
+        Args:
+            args (tuple): The widget command and its arguments"""
+
+        if self.tk.call(self._orig, "cget", "-state") == tk.DISABLED:
+            return
+
+        def index(i: str) -> str:
+            return str(self.tk.call(self._orig, "index", i))
+
+        def position(i: str) -> list[int]:
+            return [int(n) for n in i.split(".")]
+
+        def get(start: list[int], end: list[int]) -> str:
+            return str(
+                self.tk.call(
+                    self._orig, "get", "{}.{}".format(*start), "{}.{}".format(*end)
+                )
+            )
+
+        # tk never touches the final newline, indices past it are clamped
+        last = position(index("end-1c"))
+        if args[0] == "insert":
+            start = min(position(index(args[1])), last)
+            old_end, old_text, new_text = start, "", "".join(args[2::2])
+        elif args[0] == "replace":
+            start = min(position(index(args[1])), last)
+            old_end = max(min(position(index(args[2])), last), start)
+            old_text, new_text = get(start, old_end), "".join(args[3::2])
+        else:
+            # a single index deletes one char, several ranges are deleted at once
+            ranges = []
+            for i in range(1, len(args), 2):
+                first = min(position(index(args[i])), last)
+                if i + 1 < len(args):
+                    end = min(position(index(args[i + 1])), last)
+                else:
+                    end = min(position(index(f"{args[i]}+1c")), last)
+                if first < end:
+                    ranges.append((first, end))
+            if not ranges:
+                return
+
+            ranges.sort()
+            start = reach = ranges[0][0]
+            kept = []
+            for first, end in ranges:
+                if first > reach:
+                    kept.append(get(reach, first))
+                reach = max(reach, end)
+            old_end, old_text, new_text = reach, get(start, reach), "".join(kept)
+
+        if not old_text and not new_text:
+            return
+
+        lines = new_text.split("\n")
+        if len(lines) == 1:
+            new_end = [start[0], start[1] + len(new_text)]
+        else:
+            new_end = [start[0] + len(lines) - 1, len(lines[-1])]
+
+        return Change(start, old_end, new_end, old_text, new_text)
+
+    def record_change(self, change: Change | None) -> None:
+        """Pass an edit made to the content on to the ones tracking it
+
+        Args:
+            change (Change): The edit made, None if nothing changed"""
+
+        if not change:
+            return
+
+        self.last_change = change
+        self.version += 1
+        self.highlighter.edited(change)
+
+        lines = self.get(f"{change.start[0]}.0", f"{change.new_end[0]}.end").split("\n")
+        self.patch_indents(change, lines)
+        self.patch_brackets(change, lines)
+        self.patch_words(change, lines)
+        self.patch_line_hashes(change, lines)
+        self.diagnostics.edited(change)
+        self.base.findreplace.edited(self, change)
+
+        if self._user_edit:
+            if not self.history.open and not self.transaction_depth:
+                # edits made before going idle are undone together
+                self.after_idle(self.history.separate)
+            self.history.record(change)
+
+    @contextmanager
+    def transaction(self) -> typing.Iterator[None]:
+        """Make the edits within as one: they are undone together, and the change
+        event and the language server update are sent once, when it is over.
+        The indices kept by the text are still patched with every edit.
+
+        Transactions can be nested, the outermost one sends the notifications."""
+
+        if not self.transaction_depth:
+            self.history.separate()
+        self.transaction_depth += 1
+        try:
+            yield
+        finally:
+            self.transaction_depth -= 1
+            if not self.transaction_depth:
+                changes, self.transaction_changes = self.transaction_changes, []
+                if self.history.open:
+                    self.after_idle(self.history.separate)
+                if changes:
+                    self.notify_changes(changes)
+
+    def notify_changes(self, changes: list[Change]) -> None:
+        """Let the editor and the language server know about edits made"""
+
+        self.event_generate("<<Change>>", when="tail")
+        if self.lsp:
+            for change in changes:
+                self.base.language_server_manager.content_changed(self, change)
+
     def create_proxy(self):
         self._orig = self._w + "_orig"
         self.tk.call("rename", self._w, self._orig)
-        self.tk.createcommand(self._w, self._proxy)
+        self.tk.createcommand(self._w, self.base.latency.wrap("proxy", self._proxy))
 
     def _proxy(self, *args):
         if (
@@ -1474,14 +1827,20 @@ class Text(BaseText):
 
         cmd = (self._orig,) + args
         try:
+            change = None
+            if args[0] in ("insert", "replace", "delete"):
+                change = self.resolve_change(args)
             result = self.tk.call(cmd)
         except Exception:
             return
 
         if args[0] in ("insert", "replace", "delete"):
-            self.event_generate("<<Change>>", when="tail")
-            if self.lsp:
-                self.base.language_server_manager.content_changed(self)
+            self.record_change(change)
+            if self.transaction_depth:
+                if change:
+                    self.transaction_changes.append(change)
+            else:
+                self.notify_changes([change] if change else [])
 
         # if "insert" in args[0:3] and "get" in args[0:3]:
         #     print(temp)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import re
+import typing
+from collections import Counter
+from itertools import chain, islice
+
+from sortedcontainers import SortedList
+
+WORD = re.compile(r"\w+")
+
+# lines around the cursor searched for nearby words, on each side
+PROXIMITY_WINDOW = 100
+# words starting with the term that are ranked, in sorted order
+PREFIX_CANDIDATES = 200
+
+
+class WordIndex:
+    """Word frequencies of a document, for completions without a language server
+
+    The words of every line are kept so an edit only rescans the lines it touched,
+    the counts are patched with the difference. Distinct words are kept sorted, words
+    starting with a term are found by bisecting. An index can pass its changes on to a
+    `shared` index, which then holds the words of all the documents using it."""
+
+    def __init__(self, shared: WordIndex | None = None) -> None:
+        self.shared = shared
+        self.counts: dict[str, int] = {}
+        self.sorted = SortedList()
+        self.lines: list[list[str]] = [[]]
+
+    def update(self, delta: dict[str, int]) -> None:
+        """Apply a change in word counts
+
+        Args:
+            delta (dict[str, int]): Change in count of each word"""
+
+        for word, change in delta.items():
+            if not change:
+                continue
+
+            count = self.counts.get(word, 0)
+            if not count:
+                self.sorted.add(word)
+            if count + change > 0:
+                self.counts[word] = count + change
+            else:
+                self.counts.pop(word, None)
+                self.sorted.discard(word)
+
+        if self.shared:
+            self.shared.update(delta)
+
+    def rebuild(self, text: str) -> None:
+        """Index a whole document"""
+
+        self.clear()
+        self.lines = [WORD.findall(line) for line in text.split("\n")]
+        self.update(Counter(chain.from_iterable(self.lines)))
+
+    def clear(self) -> None:
+        """Forget all the words, taking them out of the shared index too"""
+
+        if self.shared:
+            self.shared.update({word: -count for word, count in self.counts.items()})
+
+        self.counts.clear()
+        self.sorted.clear()
+        self.lines = [[]]
+
+    def edited(self, first: int, old_last: int, lines: list[str]) -> None:
+        """Replace lines `first` to `old_last` (1-based, inclusive) with the new lines
+
+        Args:
+            first (int): First line touched by the edit
+            old_last (int): Last line touched by the edit, before it was made
+            lines (list[str]): Text of the lines touched, after the edit"""
+
+        new = [WORD.findall(line) for line in lines]
+        delta = Counter(chain.from_iterable(new))
+        delta.subtract(chain.from_iterable(self.lines[first - 1 : old_last]))
+        self.lines[first - 1 : old_last] = new
+        self.update(delta)
+
+    def prefixed(self, term: str) -> typing.Iterator[str]:
+        """Returns the words starting with `term`, in sorted order"""
+
+        return self.sorted.irange(term, term + "\U0010ffff", inclusive=(True, False))
+
+    def nearby(self, line: int) -> dict[str, int]:
+        """Returns the words around a line along with their distance from it"""
+
+        distances = {}
+        for distance in range(PROXIMITY_WINDOW + 1):
+            for i in {line - 1 - distance, line - 1 + distance}:
+                if 0 <= i < len(self.lines):
+                    for word in self.lines[i]:
+                        distances.setdefault(word, distance)
+        return distances
+
+    def complete(self, term: str, line: int, limit: int = 10) -> list[str]:
+        """Returns the best completions for a term typed at a line
+
+        Words starting with the term come first, ranked by how close they are to the
+        line and then by how often they are used. Words from the lines around that
+        contain the term follow.
+
+        Args:
+            term (str): The word being typed
+            line (int): The line it is typed at
+            limit (int, optional): Number of completions. Defaults to 10."""
+
+        index = self.shared or self
+        nearby = self.nearby(line)
+        # the word being typed is counted, only suggest it when used elsewhere too
+        typed = {term} if index.counts.get(term, 0) <= 1 else set()
+
+        candidates = set(islice(index.prefixed(term), PREFIX_CANDIDATES))
+        candidates.update(word for word in nearby if word.startswith(term))
+        candidates -= typed
+
+        starts = sorted(
+            candidates,
+            key=lambda word: (
+                word != term,
+                nearby.get(word, PROXIMITY_WINDOW + 1),
+                -index.counts.get(word, 0),
+                word,
+            ),
+        )
+        if len(starts) >= limit:
+            return starts[:limit]
+
+        includes = sorted(
+            (
+                word
+                for word in nearby
+                if term in word and word not in candidates and word not in typed
+            ),
+            key=lambda word: (nearby[word], word),
+        )
+        return (starts + includes)[:limit]
@@ -8,6 +8,7 @@ from biscuit.common import is_image
 from ..git.diff import DiffEditor
 from .html import HTMLEditor
 from .image import ImageViewer
+from .largefile import LargeFileViewer
 from .markdown import MDEditor
 from .text import TextEditor
 
@@ -45,7 +46,7 @@ class EditorTypes:
         language="",
         load_file=True,
         standalone=False,
-    ) -> TextEditor | DiffEditor | MDEditor | ImageViewer:
+    ) -> TextEditor | DiffEditor | MDEditor | ImageViewer | LargeFileViewer:
         """Get the suitable editor based on the path, exists, diff values passed.
 
         Args:
@@ -57,7 +58,7 @@ class EditorTypes:
             language (str): The language of the file
 
         Returns:
-            TextEditor | DiffEditor | MDEditor | ImageViewer:
+            TextEditor | DiffEditor | MDEditor | ImageViewer | LargeFileViewer:
                 The suitable editor based on the path, exists, diff values passed"""
 
         if diff:
@@ -66,6 +67,8 @@ class EditorTypes:
         if path and os.path.isfile(path):
             if is_image(path):
                 return ImageViewer(master, path)
+            if os.path.getsize(path) >= self.base.settings.config.large_file_threshold:
+                return LargeFileViewer(master, path)
             if any(
                 path.endswith(i) for i in (".md", ".markdown", ".mdown", ".rst", ".mkd")
             ):
@@ -171,18 +171,24 @@ class EventManager(GUIManager, ConfigManager):
         editor = self.open_editor(path, exists=True, load_file=False)
         editor.content.bind(
             "<<FileLoaded>>",
-            lambda _, editor=editor.content.text, edits=edits: threading.Thread(
-                target=self.do_workspace_edits, args=(editor, edits), daemon=True
-            ).start(),
+            lambda _, editor=editor.content.text, edits=edits: self.do_workspace_edits(
+                editor, edits
+            ),
             add=True,
         )
         editor.content.load_file()
 
     def do_workspace_edits(self, tab: Text, edits: list[TextEdit]):
-        for i in edits:
-            tab.replace(i.start, i.end, i.new_text)
-            tab.update()
-            tab.update_idletasks()
+        """Apply the edits as one, from the last to the first so the positions
+        of the ones before are not moved by them"""
+
+        def position(edit: TextEdit) -> tuple[int, int]:
+            line, column = str(edit.start).split(".")
+            return int(line), int(column)
+
+        with tab.transaction():
+            for i in sorted(edits, key=position, reverse=True):
+                tab.replace(i.start, i.end, i.new_text)
 
     def open_editor(
         self, path: str, exists=True, load_file=True
@@ -6,9 +6,13 @@ Porcupine's LSP plugin https://github.com/Akuli/porcupine/
 from __future__ import annotations
 
 import itertools
+import os
+import time
 import typing
 from pathlib import Path
+from threading import Thread
 
+import psutil
 import tarts as lsp
 
 from biscuit.common import IO
@@ -19,9 +23,13 @@ from .utils import *
 
 if typing.TYPE_CHECKING:
     from biscuit.editor import Text
+    from biscuit.editor.text.changes import Change
 
     from . import LanguageServerManager
 
+# seconds a server has to exit once asked to shut down, before it is terminated
+SHUTDOWN_TIMEOUT = 5
+
 
 class LangServerClient:
     """Language Server Client
@@ -29,77 +37,181 @@ class LangServerClient:
     This class is used to manage the language server client. It is responsible for sending and receiving messages
     to and from the language server. It also manages the requests made by the user. It also manages the deletion of
     the language server client instance when all the tabs using the language server are closed.
-    """
 
-    completion_requests: dict[int, tuple[Text, CompletionRequest]] = {}
-    gotodef_requests: dict[int, tuple[Text, str]] = {}
-    hover_requests: dict[int, tuple[Text, str]] = {}
-    outline_requests: dict[int, Text] = {}
-    ref_requests: list[tuple[Text, str]] = []
-    rename_requests: dict[int, Text] = {}
+    A tab has at most one request of every method in flight, a new one cancels the
+    request it supersedes. Responses are only handled if their request is still the
+    latest and the document has not changed since it was sent.
+    """
 
-    def __init__(self, master: LanguageServerManager, tab: Text, root_dir: str) -> None:
+    def __init__(
+        self, master: LanguageServerManager, language: str, command: str, root_dir: str
+    ) -> None:
         """Initialize the language server client
 
         Args:
             master (LanguageServerManager): The master language server manager
-            tab (Text): The tab using the language server
+            language (str): The language served, as sent in the did_open messages
+            command (str): The command to start the language server
             root_dir (str): The root directory of the language server"""
 
         self.master = master
         self.base = master.base
-        self.tab = tab
-        self.language = tab.language_alias or tab.language
-        self.command = master.langservers.get(
-            self.language,
-            master.langservers.get(
-                self.language.lower(),
-                master.langservers.get(
-                    tab.language,
-                    master.langservers.get(
-                        tab.language.lower(),
-                        master.langservers.get(tab.language_alias, None),
-                    ),
-                ),
-            ),
-        )
+        self.language = language
+        self.command = command
 
         self.root_dir = root_dir
         self._counter = itertools.count()
 
-        # TODO: Make this configurable from settings
-        # when all tabs using this lsp are closed, delete the lsp client after deletion_delay milliseconds
-        self.deletion_delay = 10000
+        self.completion_requests: dict[int, tuple[Text, CompletionRequest]] = {}
+        self.gotodef_requests: dict[int, tuple[Text, str]] = {}
+        self.hover_requests: dict[int, tuple[Text, str]] = {}
+        self.outline_requests: dict[int, Text] = {}
+        self.ref_requests: dict[int, tuple[Text, str]] = {}
+        self.rename_requests: dict[int, Text] = {}
+        # (tab, method) -> (id, document version) of the request in flight
+        self.slots: dict[tuple[Text, str], tuple[int, int]] = {}
+        # uri -> (document version, symbols) of the last outline received
+        self.outlines: dict[str, tuple[int, list[lsp.DocumentSymbol]]] = {}
+
+        # set from the server capabilities once initialized
+        self.sync_kind = lsp.TextDocumentSyncKind.FULL
+        # edits made since the last did_change, sent as a batch when idle
+        self.pending_changes: dict[Text, list[Change]] = {}
+        # tabs that may hold characters taking two UTF-16 code units, the ranges of
+        # their edits would be off so the full text is sent instead
+        self.astral_tabs: set[Text] = set()
+        self.flush_scheduled = False
+
         self.tabs_opened: set[Text] = set()
-        self._count = 0
+        # when a tab was last opened or closed, idle servers used least recently are
+        # stopped first
+        self.last_used = time.monotonic()
+        # requests made before the server is initialized, made once it is
+        self.deferred: dict[tuple[Text, str], typing.Callable[[], typing.Any]] = {}
+        self.stopped = False
 
         self.root_uri = Path(self.root_dir).as_uri()
-        self.io = IO(self, self.command, self.root_dir)
-        self.io.start()
+        # set from the reader thread when messages arrive, until they are handled
+        self.wake_scheduled = False
+        self.io = IO(self, self.command, self.root_dir, framed=True)
+        self.io.on_output = self.wake
         self.client = lsp.Client(
-            process_id=self.io.p.pid,
+            process_id=os.getpid(),
             root_uri=self.root_uri,
             workspace_folders=[lsp.WorkspaceFolder(uri=self.root_uri, name="Root")],
             trace="verbose",
         )
         self.handler = EventHandler(self)
 
-    def run_loop(self) -> None:
-        """Run the language server client loop"""
+    def start(self) -> None:
+        """Start the server in the background, the initialize request is queued to be
+        written once it runs and messages are exchanged as they come from then on"""
 
-        if self.run():
-            self.base.after(50, self.run_loop)
+        self.flush()
+        Thread(target=self.spawn, daemon=True).start()
 
-    def run(self):
-        """Run the language server client"""
+    def spawn(self) -> None:
+        try:
+            self.io.spawn()
+        except Exception as e:
+            self.base.after(0, lambda e=e: self.master.failed(self, str(e)))
+            return
 
-        self.io.write(self.client.send())
-        r = self.io.read()
+        if self.stopped:
+            # killed while it was starting
+            self.io.stop()
+            return
+        self.base.after(
+            0,
+            lambda: self.base.logger.info(
+                f"PID: {self.io.p.pid} CMD: {self.command} CWD: {self.root_dir}"
+            ),
+        )
 
-        if not r:
+    def shutdown(self) -> None:
+        """Ask the server to shut down, it exits once the reply comes (see the handler).
+        It is terminated if it has not exited in time, or right away if it is not
+        initialized, and reaped off the UI thread."""
+
+        self.stopped = True
+        timeout = 0
+        if self.client.state == lsp.ClientState.NORMAL:
+            self.client.shutdown()
+            self.flush()
+            timeout = SHUTDOWN_TIMEOUT
+
+        if self.io.p:
+            Thread(target=self.io.stop, args=(timeout,), daemon=True).start()
+        # otherwise it is still starting, and stopped once it has started
+
+    def memory(self) -> int:
+        """Returns the bytes of memory used by the server and the processes it started"""
+
+        try:
+            process = psutil.Process(self.io.p.pid)
+            return sum(
+                p.memory_info().rss
+                for p in [process, *process.children(recursive=True)]
+            )
+        except (AttributeError, psutil.Error):
+            # not started yet or gone
+            return 0
+
+    def ready(
+        self, tab: Text, method: str, request: typing.Callable[[], typing.Any]
+    ) -> bool:
+        """Returns whether the server is initialized. If it is still starting, the
+        request is made once it is, replacing the one of the tab and method queued."""
+
+        if self.client.state == lsp.ClientState.NORMAL:
             return True
-        elif r == b"":
-            return False
+
+        if self.client.state == lsp.ClientState.WAITING_FOR_INITIALIZED:
+            self.deferred[(tab, method)] = request
+        return False
+
+    def initialized(self) -> None:
+        """Open the tabs and make the requests queued while the server was starting"""
+
+        for tab in self.tabs_opened:
+            self.open_tab(tab)
+
+        deferred, self.deferred = self.deferred, {}
+        for (tab, _), request in deferred.items():
+            if tab in self.tabs_opened:
+                request()
+
+    def wake(self) -> None:
+        """Called from the reader thread as messages arrive, handles them on the UI
+        thread. Messages arriving before they are handled are handled together."""
+
+        if self.wake_scheduled:
+            return
+
+        self.wake_scheduled = True
+        try:
+            self.base.after(0, self.run)
+        except RuntimeError:
+            # main loop is gone
+            pass
+
+    def flush(self) -> None:
+        """Write the messages queued by the client to the server"""
+
+        if data := self.client.send():
+            self.io.write(data)
+
+    def run(self) -> None:
+        """Handle the messages received so far and send the ones they lead to"""
+
+        self.wake_scheduled = False
+        r = self.io.read()
+        if r == b"":
+            # the server exited
+            self.master.failed(self, "the server exited")
+            return
+        if not r:
+            return
 
         try:
             for lsp_event in self.client.recv(r):
@@ -107,7 +219,7 @@ class LangServerClient:
         except Exception as e:
             print(e)
 
-        return True
+        self.flush()
 
     def open_tab(self, tab: Text) -> None:
         """Send the did_open message to the language server client
@@ -116,16 +228,31 @@ class LangServerClient:
             tab (Text): The tab that is opened"""
 
         self.tabs_opened.add(tab)
+        self.last_used = time.monotonic()
+        # the full text is sent along, edits made before are part of it
+        self.pending_changes.pop(tab, None)
 
         if self.client.state == lsp.ClientState.NORMAL:
+            text = tab.get_all_text()
+            self.mark_astral(tab, text)
             self.client.did_open(
                 lsp.TextDocumentItem(
                     uri=Path(tab.path).as_uri(),
                     languageId=self.language,
-                    text=tab.get_all_text(),
+                    text=text,
                     version=next(self._counter),
                 )
             )
+            self.flush()
+
+    def mark_astral(self, tab: Text, text: str) -> None:
+        """Track whether the text sent for a tab has characters outside the basic
+        plane, see `send_change_events`"""
+
+        if has_astral(text):
+            self.astral_tabs.add(tab)
+        else:
+            self.astral_tabs.discard(tab)
 
     def close_tab(self, tab: Text) -> None:
         """Send the did_close message to the language server client
@@ -137,21 +264,22 @@ class LangServerClient:
             return
 
         self.tabs_opened.remove(tab)
+        self.astral_tabs.discard(tab)
+        self.outlines.pop(Path(tab.path).as_uri(), None)
+        for key in [key for key in self.deferred if key[0] is tab]:
+            del self.deferred[key]
         if self.client.state == lsp.ClientState.NORMAL:
+            for tab_, method in list(self.slots):
+                if tab_ is tab:
+                    self.cancel(self.slots.pop((tab_, method))[0])
             self.client.did_close(
                 lsp.TextDocumentIdentifier(uri=Path(tab.path).as_uri())
             )
+            self.flush()
 
+        self.last_used = time.monotonic()
         if not self.tabs_opened:
-
-            def delayed_removal(self=self):
-                if self.tabs_opened:
-                    return
-                self.master.kill(self)
-
-            if self.master.kill_thread:
-                self.base.after_cancel(self.master.kill_thread)
-            self.master.kill_thread = self.base.after(50000, delayed_removal)
+            self.master.trim()
 
     def request_completions(self, tab: Text) -> None:
         """Request completions from the language server
@@ -159,8 +287,11 @@ class LangServerClient:
         Args:
             tab (Text): The tab requesting completions"""
 
-        if tab.path is None or self.client.state != lsp.ClientState.NORMAL:
+        if tab.path is None or not self.ready(
+            tab, COMPLETION, lambda: self.request_completions(tab)
+        ):
             return
+        self.send_change_events()
 
         request = CompletionRequest(next(self._counter), tab.get_cursor_pos())
         req_id = self.client.completion(
@@ -173,7 +304,9 @@ class LangServerClient:
             ),
         )
 
+        self.supersede(tab, COMPLETION, req_id)
         self.completion_requests[req_id] = (tab, request)
+        self.flush()
 
     def request_hover(self, tab: Text) -> None:
         """Request hover information from the language server
@@ -181,16 +314,22 @@ class LangServerClient:
         Args:
             tab (Text): The tab requesting hover information"""
 
-        if tab.path is None or self.client.state != lsp.ClientState.NORMAL:
+        if tab.path is None or not self.ready(
+            tab, HOVER, lambda: self.request_hover(tab)
+        ):
             return
+        self.send_change_events()
 
+        pos = tab.get_mouse_pos()
         request_id = self.client.hover(
             lsp.TextDocumentPosition(
                 textDocument=lsp.TextDocumentIdentifier(uri=Path(tab.path).as_uri()),
-                position=encode_position(tab.get_mouse_pos()),
+                position=encode_position(pos),
             )
         )
-        self.hover_requests[request_id] = (tab, tab.get_mouse_pos())
+        self.supersede(tab, HOVER, request_id)
+        self.hover_requests[request_id] = (tab, pos)
+        self.flush()
 
     def request_go_to_definition(self, tab: Text) -> None:
         """Request go to definition from the language server
@@ -198,8 +337,11 @@ class LangServerClient:
         Args:
             tab (Text): The tab requesting go to definition"""
 
-        if tab.path is None or self.client.state != lsp.ClientState.NORMAL:
+        if tab.path is None or not self.ready(
+            tab, DEFINITION, lambda: self.request_go_to_definition(tab)
+        ):
             return
+        self.send_change_events()
 
         # very bad hack to ignore mouse and use cursor position
         tab.focus_set()
@@ -213,7 +355,9 @@ class LangServerClient:
                 position=encode_position(pos),
             )
         )
+        self.supersede(tab, DEFINITION, request_id)
         self.gotodef_requests[request_id] = (tab, pos)
+        self.flush()
 
     def request_references(self, tab: Text) -> None:
         """Request references from the language server
@@ -221,8 +365,11 @@ class LangServerClient:
         Args:
             tab (Text): The tab requesting references"""
 
-        if tab.path is None or self.client.state != lsp.ClientState.NORMAL:
+        if tab.path is None or not self.ready(
+            tab, REFERENCES, lambda: self.request_references(tab)
+        ):
             return
+        self.send_change_events()
 
         tab.focus_set()
         pos = tab.get_mouse_pos()
@@ -235,7 +382,9 @@ class LangServerClient:
                 position=encode_position(pos),
             )
         )
-        self.ref_requests.append((tab, pos))
+        self.supersede(tab, REFERENCES, request_id)
+        self.ref_requests[request_id] = (tab, pos)
+        self.flush()
 
     def request_rename(self, tab: Text, new_name: str) -> None:
         """Request rename from the language server
@@ -244,8 +393,11 @@ class LangServerClient:
             tab (Text): The tab requesting rename
             new_name (str): The new name to be used"""
 
-        if tab.path is None or self.client.state != lsp.ClientState.NORMAL:
+        if tab.path is None or not self.ready(
+            tab, RENAME, lambda: self.request_rename(tab, new_name)
+        ):
             return
+        self.send_change_events()
 
         tab.focus_set()
         pos = tab.get_cursor_pos()
@@ -257,42 +409,144 @@ class LangServerClient:
             ),
             new_name=new_name,
         )
+        self.supersede(tab, RENAME, request_id)
         self.rename_requests[request_id] = tab
+        self.flush()
 
     def request_outline(self, tab: Text) -> None:
         """Request outline from the language server
 
+        The outline of a version of the document is only requested once, it is shown
+        from the cache as long as the document is not edited.
+
         Args:
             tab (Text): The tab requesting outline"""
 
-        if tab.path is None or self.client.state != lsp.ClientState.NORMAL:
+        if tab.path is None or not self.ready(
+            tab, OUTLINE, lambda: self.request_outline(tab)
+        ):
             return
 
-        request_id = self.client.documentSymbol(
-            lsp.TextDocumentIdentifier(uri=Path(tab.path).as_uri()),
-        )
+        uri = Path(tab.path).as_uri()
+        if (cached := self.outlines.get(uri)) and cached[0] == tab.version:
+            self.master.show_outline(tab, cached[1])
+            return
+        if (slot := self.slots.get((tab, OUTLINE))) and slot[1] == tab.version:
+            # already asked for this version
+            return
+        self.send_change_events()
+
+        request_id = self.client.documentSymbol(lsp.TextDocumentIdentifier(uri=uri))
+        self.supersede(tab, OUTLINE, request_id)
         self.outline_requests[request_id] = tab
+        self.flush()
+
+    def supersede(self, tab: Text, method: str, request_id: int) -> None:
+        """Make a request the one in flight for a tab and method, the request it
+        replaces is cancelled if it is still unanswered"""
+
+        if previous := self.slots.get((tab, method)):
+            self.cancel(previous[0])
+        self.slots[(tab, method)] = (request_id, tab.version)
+
+    def cancel(self, request_id: int) -> None:
+        """Ask the server to stop working on a request, its response is dropped"""
+
+        self.forget(request_id)
+        self.client._send_notification("$/cancelRequest", {"id": request_id})
+
+    def forget(self, request_id: int) -> None:
+        for requests in (
+            self.completion_requests,
+            self.gotodef_requests,
+            self.hover_requests,
+            self.outline_requests,
+            self.ref_requests,
+            self.rename_requests,
+        ):
+            requests.pop(request_id, None)
+        for key, (slot_id, _) in list(self.slots.items()):
+            if slot_id == request_id:
+                del self.slots[key]
+
+    def settle(self, tab: Text, method: str, request_id: int) -> bool:
+        """Free the slot of an answered request, returns whether its response is still
+        wanted: the request is the latest of its tab and method and the document has
+        not changed since it was sent"""
+
+        slot = self.slots.get((tab, method))
+        if not slot or slot[0] != request_id:
+            return False
+
+        del self.slots[(tab, method)]
+        return tab in self.tabs_opened and slot[1] == tab.version
 
-    def send_change_events(self, tab: Text) -> None:
-        """Send the did_change message to the language server client
+    def queue_change(self, tab: Text, change: Change) -> None:
+        """Queue an edit to be sent to the language server, edits made before
+        going idle are sent in one did_change message
 
         Args:
-            tab (Text): The tab that has changed"""
+            tab (Text): The tab that has changed
+            change (Change): The edit made to the tab"""
 
         if self.client.state != lsp.ClientState.NORMAL:
             return
 
-        self.client.did_change(
-            text_document=lsp.VersionedTextDocumentIdentifier(
-                uri=Path(tab.path).as_uri(), version=next(self._counter)
-            ),
-            content_changes=[
-                lsp.TextDocumentContentChangeEvent(
-                    # range=lsp.Range(
-                    #     start=encode_position(tab.get_begin()),
-                    #     end=encode_position(tab.get_end()),
-                    # ),
-                    text=tab.get_all_text(),
-                )
-            ],
-        )
+        self.pending_changes.setdefault(tab, []).append(change)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.base.after_idle(
+                self.base.latency.wrap("lsp_send", self.send_change_events)
+            )
+
+    def send_change_events(self) -> None:
+        """Send the did_change messages for the queued edits
+
+        The edits are sent as ranges when the server supports incremental sync,
+        otherwise the full text of the tab is sent once. Columns are counted in code
+        points while servers count UTF-16 code units, the two only differ past
+        characters outside the basic plane: while a tab may hold one, its full text
+        is sent too."""
+
+        self.flush_scheduled = False
+        pending, self.pending_changes = self.pending_changes, {}
+        if (
+            self.client.state != lsp.ClientState.NORMAL
+            or self.sync_kind == lsp.TextDocumentSyncKind.NONE
+        ):
+            return
+
+        for tab, changes in pending.items():
+            if tab not in self.tabs_opened:
+                continue
+
+            if any(has_astral(change.new_text) for change in changes):
+                self.astral_tabs.add(tab)
+
+            if (
+                self.sync_kind == lsp.TextDocumentSyncKind.INCREMENTAL
+                and tab not in self.astral_tabs
+            ):
+                content_changes = [
+                    lsp.TextDocumentContentChangeEvent(
+                        range=lsp.Range(
+                            start=encode_position(change.start),
+                            end=encode_position(change.old_end),
+                        ),
+                        text=change.new_text,
+                    )
+                    for change in changes
+                ]
+            else:
+                text = tab.get_all_text()
+                self.mark_astral(tab, text)
+                content_changes = [lsp.TextDocumentContentChangeEvent(text=text)]
+
+            self.client.did_change(
+                text_document=lsp.VersionedTextDocumentIdentifier(
+                    uri=Path(tab.path).as_uri(), version=next(self._counter)
+                ),
+                content_changes=content_changes,
+            )
+
+        self.flush()
@@ -7,6 +7,17 @@ from typing import List, Optional
 
 # Requests
 
+# methods a tab has at most one request of in flight
+COMPLETION = "textDocument/completion"
+HOVER = "textDocument/hover"
+DEFINITION = "textDocument/definition"
+REFERENCES = "textDocument/references"
+RENAME = "textDocument/rename"
+OUTLINE = "textDocument/documentSymbol"
+
+# error code of the response to a cancelled request
+REQUEST_CANCELLED = -32800
+
 
 @dataclasses.dataclass
 class CompletionRequest:
@@ -53,18 +53,27 @@ class EventHandler:
 
         if isinstance(e, lsp.Initialized):
             self.base.logger.info("Capabilities " + pprint.pformat(e.capabilities))
-            for tab in self.master.tabs_opened:
-                self.master.open_tab(tab)
-                # self.master.request_outline(tab)
+            sync = e.capabilities.get(
+                "textDocumentSync", lsp.TextDocumentSyncKind.FULL
+            )
+            if isinstance(sync, dict):
+                sync = sync.get("change", lsp.TextDocumentSyncKind.NONE)
+            self.master.sync_kind = lsp.TextDocumentSyncKind(sync)
 
+            self.master.initialized()
             self.client.did_change_configuration([])
 
             self.base.statusbar.process_indicator.hide()
             return
 
         if isinstance(e, lsp.Completion):
-            tab, req = self.master.completion_requests.pop(e.message_id)
-            if tab not in self.master.tabs_opened:
+            if not (entry := self.master.completion_requests.pop(e.message_id, None)):
+                return
+            tab, req = entry
+            if (
+                not self.master.settle(tab, COMPLETION, e.message_id)
+                or tab.get_cursor_pos() != req.cursor
+            ):
                 return
 
             before_cursor = tab.get(f"{req.cursor} linestart", req.cursor)
@@ -118,7 +127,11 @@ class EventHandler:
             return
 
         if isinstance(e, lsp.Definition):
-            tab, pos = self.master.gotodef_requests.pop(e.message_id)
+            if not (entry := self.master.gotodef_requests.pop(e.message_id, None)):
+                return
+            tab, pos = entry
+            if not self.master.settle(tab, DEFINITION, e.message_id):
+                return
 
             tab.lsp_goto_definition(
                 Jump(
@@ -136,13 +149,11 @@ class EventHandler:
             return
 
         if isinstance(e, lsp.References):
-            if not self.master.ref_requests:
+            if not (entry := self.master.ref_requests.pop(e.message_id, None)):
+                return
+            tab, pos = entry
+            if not self.master.settle(tab, REFERENCES, e.message_id):
                 return
-
-            try:
-                tab, pos = self.master.ref_requests.pop(0)
-            except Exception as e:
-                print(e)
 
             tab.lsp_goto_definition(
                 Jump(
@@ -160,7 +171,9 @@ class EventHandler:
             return
 
         if isinstance(e, lsp.WorkspaceEdit):
-            tab = self.master.rename_requests.pop(e.message_id)
+            tab = self.master.rename_requests.pop(e.message_id, None)
+            if not tab or not self.master.settle(tab, RENAME, e.message_id):
+                return
             if not e.documentChanges:
                 return
 
@@ -184,29 +197,38 @@ class EventHandler:
             )
 
         if isinstance(e, lsp.Hover):
-            requesting_tab, location = self.master.hover_requests.pop(e.message_id)
+            if not (entry := self.master.hover_requests.pop(e.message_id, None)):
+                return
+            requesting_tab, location = entry
+            # dropped if the mouse left the word it was asked for
+            if (
+                not self.master.settle(requesting_tab, HOVER, e.message_id)
+                or not requesting_tab.last_hovered
+            ):
+                return
             requesting_tab.lsp_hover(HoverResponse(location, *hover_filter(e.contents)))
             return
 
         if isinstance(e, lsp.MDocumentSymbols):
-            tab = self.master.outline_requests.pop(e.message_id)
-            if tab not in self.master.tabs_opened:
+            tab = self.master.outline_requests.pop(e.message_id, None)
+            if not tab or not self.master.settle(tab, OUTLINE, e.message_id):
                 return
 
-            self.base.language_server_manager._update_symbols(tab, e.result)
-            self.base.outline.update_symbols(
-                tab,
-                (
-                    e.result
-                    if e.result and isinstance(e.result[0], lsp.DocumentSymbol)
-                    else to_document_symbol(e.result)
-                ),
+            symbols = (
+                e.result
+                if e.result and isinstance(e.result[0], lsp.DocumentSymbol)
+                else to_document_symbol(e.result)
             )
+            self.master.outlines[Path(tab.path).as_uri()] = (tab.version, symbols)
+            self.base.language_server_manager.show_outline(tab, symbols)
             return
 
         # TODO hooks
         if isinstance(e, lsp.ResponseError):
-            self.base.logger.error(str(e))
+            if e.message_id is not None:
+                self.master.forget(e.message_id)
+            if e.code != REQUEST_CANCELLED:
+                self.base.logger.error(str(e))
             return
 
         # DEBUG ones that are not implemented yet
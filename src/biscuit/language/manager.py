@@ -2,16 +2,27 @@ from __future__ import annotations
 
 import os
 import typing
+from collections import Counter
+from threading import Thread
 
 import tarts as lsp
+from pygments.lexers import get_lexer_for_filename
+from pygments.util import ClassNotFound
 
 from .client import LangServerClient
 from .languages import Languages
-from .utils import decode_position
+from .utils import decode_position, flatten_symbols
 
 if typing.TYPE_CHECKING:
     from biscuit import App
     from biscuit.editor.text import Text
+    from biscuit.editor.text.changes import Change
+
+# files looked at for the languages of a folder, when warming servers up for it
+SCAN_LIMIT = 5000
+SCAN_IGNORE = {".git", "__pycache__", ".pytest_cache", "node_modules", "venv", ".venv"}
+# ms between checks of the memory used by idle servers
+IDLE_CHECK_INTERVAL = 30000
 
 
 class LanguageServerManager:
@@ -29,30 +40,26 @@ class LanguageServerManager:
         # built-in support for python-lsp-server
         self.langservers[Languages.PYTHON] = "pylsp"
 
-        self.existing: dict[str, LangServerClient] = {}
+        self.existing: dict[tuple[str, str], LangServerClient] = {}
         self.latest: LangServerClient = None
-
-        self.kill_thread = None
-
-    def _update_symbols(
-        self, tab: Text, resp: typing.List[lsp.SymbolInformation]
-    ) -> None:
-        try:
-            self.base.settings.symbols_actionset.update(
-                [
-                    (
-                        i.name,
-                        lambda _, i=i: self.base.goto_location_in_active_editor(
-                            decode_position(i.location.range.start)
-                        ),
-                    )
-                    for i in resp
-                ]
+        self.trim_job: str | None = None
+
+        self.base.bind("<<DirectoryChanged>>", lambda _: self.warm_up(), add=True)
+
+    def show_outline(self, tab: Text, symbols: list[lsp.DocumentSymbol]) -> None:
+        """Show the symbols of a tab in the outline view and the `@` palette"""
+
+        self.base.outline.update_symbols(tab, symbols)
+        actions = []
+        for _, symbol in flatten_symbols(symbols):
+            pos = decode_position(symbol.range.start)
+            actions.append(
+                (
+                    symbol.name,
+                    lambda _, pos=pos: self.base.goto_location_in_active_editor(pos),
+                )
             )
-            self.base.palette.update()
-        except:
-            # TODO: currently only supports lsp.SymbolInformation; implement this for lsp.DocumentSymbol
-            pass
+        self.base.settings.symbols_actionset.update(actions)
 
     def register_langserver(self, language: str, command: str) -> None:
         """Register a language server for a specific language
@@ -127,49 +134,164 @@ class LanguageServerManager:
             if tab in instance.tabs_opened:
                 instance.request_outline(tab)
 
-    def content_changed(self, tab: Text) -> None:
+    def content_changed(self, tab: Text, change: Change) -> None:
         """Content of a tab has changed, notify the language server about it"""
 
         for instance in list(self.existing.values()):
             if tab in instance.tabs_opened:
-                instance.send_change_events(tab)
+                instance.queue_change(tab, change)
+
+    def get_command(self, *languages: str) -> str | None:
+        """Returns the command of the server registered for the first of the languages
+        that has one, None if there is none"""
+
+        for language in languages:
+            if not language:
+                continue
+            if command := self.langservers.get(
+                language, self.langservers.get(language.lower())
+            ):
+                return command
 
     def request_client_instance(self, tab: Text) -> LangServerClient | None:
         """Request a language server client instance for a specific language and workspace root directory.
 
         If a client instance already exists for the language and the root directory of the tab, it is returned.
-        Otherwise, a new client instance is created and returned.
+        Otherwise, a new client instance is started in the background and returned.
 
         Args:
             tab (Text): The tab for which the language server client instance is being requested
         """
 
-        if tab.path is None or (
-            tab.language not in self.langservers.keys()
-            and tab.language.lower() not in self.langservers.keys()
-            and tab.language_alias not in self.langservers.keys()
-        ):
+        if tab.path is None:
             return
 
-        root_dir = self.base.active_directory or os.path.dirname(tab.path)
+        language = tab.language_alias or tab.language
+        command = self.get_command(language, tab.language, tab.language_alias)
+        if not command:
+            return
 
-        try:
-            return self.existing[(root_dir, tab.language_alias)]
-        except KeyError:
-            pass
+        root_dir = self.base.active_directory or os.path.dirname(tab.path)
+        if instance := self.existing.get((root_dir, language)):
+            return instance
 
         self.base.statusbar.process_indicator.show()
+        return self.start_client(language, command, root_dir)
+
+    def start_client(
+        self, language: str, command: str, root_dir: str
+    ) -> LangServerClient:
+        """Start a language server in the background, requests made to it are queued
+        until it is initialized"""
+
         self.base.logger.trace(
-            f"<<-- Requesting <LSPC>({tab.language_alias}) instance for --[{root_dir}] -->>"
+            f"<<-- Requesting <LSPC>({language}) instance for --[{root_dir}] -->>"
         )
 
-        # TODO multithread this process
-        langserver = LangServerClient(self, tab, root_dir)
-        langserver.run_loop()
-        self.existing[(root_dir, tab.language_alias)] = langserver
-
+        langserver = LangServerClient(self, language, command, root_dir)
+        self.existing[(root_dir, language)] = langserver
+        langserver.start()
         return langserver
 
+    def failed(self, instance: LangServerClient, reason: str) -> None:
+        """A language server could not start or exited on its own"""
+
+        if self.existing.get((instance.root_dir, instance.language)) is not instance:
+            # stopped by us
+            return
+
+        self.existing.pop((instance.root_dir, instance.language))
+        self.base.statusbar.process_indicator.hide()
+        self.base.logger.error(f"{instance.language} language server failed: {reason}")
+        if instance.tabs_opened:
+            self.base.notifications.warning(
+                f"{instance.language} language server failed, check logs."
+            )
+
+    def warm_up(self) -> None:
+        """Start the servers of the languages most used in the opened folder, before
+        any of its files is opened. The folder is scanned in the background."""
+
+        directory = self.base.active_directory
+        if not directory or self.base.settings.config.lsp_warm_pool <= 0:
+            return
+
+        Thread(target=self.scan_languages, args=(directory,), daemon=True).start()
+
+    def scan_languages(self, directory: str) -> None:
+        """Count the files of every language with a server in a folder, the servers
+        of the most common ones are started on the UI thread"""
+
+        counts = Counter()
+        # language (alias, name) of every file extension seen
+        languages: dict[str, tuple[str, str] | None] = {}
+        scanned = 0
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in SCAN_IGNORE]
+            for name in files:
+                extension = os.path.splitext(name)[1] or name
+                if extension not in languages:
+                    try:
+                        lexer = get_lexer_for_filename(name)
+                        languages[extension] = (lexer.aliases[0], lexer.name)
+                    except (ClassNotFound, IndexError):
+                        languages[extension] = None
+                if languages[extension]:
+                    counts[languages[extension]] += 1
+
+                scanned += 1
+                if scanned >= SCAN_LIMIT:
+                    break
+            if scanned >= SCAN_LIMIT:
+                break
+
+        found = [
+            (alias, command)
+            for (alias, name), _ in counts.most_common()
+            if (command := self.get_command(alias, name))
+        ][: self.base.settings.config.lsp_warm_pool]
+        try:
+            self.base.after(0, lambda: self.warm(directory, found))
+        except RuntimeError:
+            # main loop is gone
+            pass
+
+    def warm(self, directory: str, languages: list[tuple[str, str]]) -> None:
+        if self.base.active_directory != directory:
+            return
+
+        for language, command in languages:
+            if (directory, language) not in self.existing:
+                self.start_client(language, command, directory)
+        self.trim()
+
+    def trim(self) -> None:
+        """Stop the servers no tab uses, least recently used first, while there are
+        more than `lsp_max_idle` of them or they take more memory than
+        `lsp_idle_memory_mb`. Checked again while there are idle servers."""
+
+        if self.trim_job:
+            self.base.after_cancel(self.trim_job)
+            self.trim_job = None
+
+        config = self.base.settings.config
+        idle = sorted(
+            (i for i in self.existing.values() if not i.tabs_opened),
+            key=lambda instance: instance.last_used,
+        )
+        memory = {instance: instance.memory() for instance in idle}
+        used = sum(memory.values())
+        while idle and (
+            len(idle) > config.lsp_max_idle
+            or used > config.lsp_idle_memory_mb * 1024 * 1024
+        ):
+            instance = idle.pop(0)
+            used -= memory[instance]
+            self.kill(instance)
+
+        if idle:
+            self.trim_job = self.base.after(IDLE_CHECK_INTERVAL, self.trim)
+
     def kill(self, instance: LangServerClient) -> None:
         """Kill a language server client instance
 
@@ -180,14 +302,8 @@ class LanguageServerManager:
         if not self.existing.get((instance.root_dir, instance.language), None):
             return
 
-        self.base.logger.trace(
-            f"-- Killing LSPC({instance.language}) PID: {instance.io.p.pid} --"
-        )
+        pid = instance.io.p.pid if instance.io.p else None
+        self.base.logger.trace(f"-- Killing LSPC({instance.language}) PID: {pid} --")
 
         self.existing.pop((instance.root_dir, instance.language))
-        if instance.client.state == lsp.ClientState.NORMAL:
-            instance.client.shutdown()
-        else:
-            instance.io.p.kill()
-
-        del instance
+        instance.shutdown()
@@ -24,6 +24,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import re
 import sys
 from pathlib import Path
 from typing import Iterator, Optional
@@ -73,6 +74,19 @@ def to_document_symbol(infos: list[lsp.SymbolInformation]) -> list[lsp.DocumentS
     return res
 
 
+def flatten_symbols(
+    symbols: list[lsp.DocumentSymbol], level: int = 0
+) -> Iterator[tuple[int, lsp.DocumentSymbol]]:
+    """Yields the symbols of a document symbol tree with their depth, in document
+    order. Modules are left out along with their children."""
+
+    for symbol in symbols or ():
+        if symbol.kind == lsp.SymbolKind.MODULE:
+            continue
+        yield level, symbol
+        yield from flatten_symbols(symbol.children, level + 1)
+
+
 def get_completion_item_doc(item: lsp.CompletionItem) -> str:
     if not item.documentation:
         return item.label
@@ -132,6 +146,18 @@ def decode_position(pos: lsp.Position) -> str:
     return f"{pos.line + 1}.{pos.character}"
 
 
+# characters outside the basic plane take two UTF-16 code units, the unit positions
+# are counted in by default
+_astral = re.compile("[\U00010000-\U0010ffff]")
+
+
+def has_astral(text: str) -> bool:
+    """Whether columns of the text counted in code points differ from the UTF-16
+    code units of the positions sent to language servers"""
+
+    return not text.isascii() and _astral.search(text) is not None
+
+
 def contains_range(range: lsp.Range, pos: lsp.Range) -> bool:
     if pos.start.line < range.start.line or pos.end.line > range.end.line:
         return False
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+import time
+import typing
+from collections import deque
+
+if typing.TYPE_CHECKING:
+    from . import App
+
+# durations kept per stage, the percentiles are taken over these
+SAMPLES = 2000
+# spans kept for the trace export
+TRACE_EVENTS = 20000
+# stage covering a key press up to the screen being updated
+KEYSTROKE = "keystroke"
+PERCENTILES = ("p50", "p95", "p99", "max")
+
+
+class LatencyProfiler:
+    """Times the stages the editor goes through between a key press and the paint
+
+    Opt-in with the `latency_profiling` config. When off, `wrap` hands back the
+    functions as they are and nothing is timed. When on, every key press in an editor
+    starts a keystroke that lasts until Tk has gone idle twice: once to run the
+    refresh the key press scheduled, once more to draw what it changed. The stages
+    run in between (or at any time, for stages like language server sends) are timed
+    and kept per stage for percentiles, and as spans for a Chrome trace."""
+
+    def __init__(self, base: App) -> None:
+        self.base = base
+        self.enabled = base.config.latency_profiling
+        self.lock = threading.Lock()
+
+        self.samples: dict[str, deque[float]] = {}
+        self.trace: deque[dict] = deque(maxlen=TRACE_EVENTS)
+        self.keystrokes = 0
+        # start of the keystroke being measured, if any
+        self.pressed: float | None = None
+        self.origin = time.perf_counter()
+
+    def wrap(self, stage: str, callback: typing.Callable) -> typing.Callable:
+        """Returns the callback timed as `stage`, or as it is if profiling is off"""
+
+        if not self.enabled:
+            return callback
+
+        @functools.wraps(callback)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter())
+
+        return timed
+
+    def key_pressed(self, *_) -> None:
+        """Start timing a keystroke, unless one is still being timed"""
+
+        if not self.enabled or self.pressed is not None:
+            return
+
+        self.pressed = time.perf_counter()
+        self.keystrokes += 1
+        # refreshes scheduled by the key press run in the first idle pass and the
+        # widgets they changed are redrawn in the next one
+        self.base.after_idle(lambda: self.base.after_idle(self.key_painted))
+
+    def key_painted(self) -> None:
+        if self.pressed is not None:
+            self.record(KEYSTROKE, self.pressed, time.perf_counter())
+            self.pressed = None
+
+    def record(self, stage: str, start: float, end: float) -> None:
+        keystroke = self.keystrokes if self.pressed is not None else None
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=SAMPLES)
+            self.samples[stage].append((end - start) * 1000)
+            self.trace.append(
+                {
+                    "name": stage,
+                    "ph": "X",
+                    "ts": round((start - self.origin) * 1e6),
+                    "dur": round((end - start) * 1e6),
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"keystroke": keystroke},
+                }
+            )
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Returns the count, percentiles and max of the durations of every stage in ms"""
+
+        with self.lock:
+            samples = {
+                stage: sorted(durations) for stage, durations in self.samples.items()
+            }
+
+        def percentile(durations: list[float], p: int) -> float:
+            return durations[min(len(durations) - 1, len(durations) * p // 100)]
+
+        return {
+            stage: {
+                "count": len(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "p99": percentile(durations, 99),
+                "max": durations[-1],
+            }
+            for stage, durations in samples.items()
+            if durations
+        }
+
+    def report(self) -> str:
+        lines = [
+            f"{'stage':<24}{'count':>8}"
+            + "".join(f"{key:>10}" for key in PERCENTILES)
+        ]
+        for stage, stats in sorted(self.stats().items()):
+            lines.append(
+                f"{stage:<24}{stats['count']:>8}"
+                + "".join(f"{stats[key]:>10.2f}" for key in PERCENTILES)
+            )
+        return "\n".join(lines)
+
+    def log_report(self) -> None:
+        """Write the percentiles of every stage (in ms) to the logs"""
+
+        if not self.enabled:
+            self.base.notifications.info(
+                "Latency profiling is off, enable latency_profiling in the config"
+            )
+            return
+
+        self.base.logger.info("Keystroke latency (ms)\n" + self.report())
+        self.base.commands.show_logs()
+
+    def export(self, directory: str) -> tuple[str, str]:
+        """Write the stats as JSON and the spans as a Chrome trace (chrome://tracing,
+        Perfetto) into a directory, returns the paths of both"""
+
+        stats_path = os.path.join(directory, "latency.json")
+        trace_path = os.path.join(directory, "latency-trace.json")
+        with self.lock:
+            events = list(self.trace)
+
+        with open(stats_path, "w") as file:
+            json.dump(self.stats(), file, indent=2)
+        with open(trace_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        return stats_path, trace_path
@@ -182,6 +182,7 @@ class Menubar(Frame):
         self.edit_menu.add_command("Replace", events.replace_symbol)
         self.edit_menu.add_command("Find in Files", events.search_files)
         self.edit_menu.add_command("Go to Line/Column...", events.goto_line_column)
+        self.edit_menu.add_command("Go to Matching Bracket", events.goto_matching_bracket)
         self.edit_menu.add_separator()
         self.edit_menu.add_command("Change Language Mode", events.change_language_mode)
         self.edit_menu.add_checkable("Word Wrap", events.toggle_wordwrap)
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import typing
+
+from .common.textutils import eol_map_rev, get_eol
+
+if typing.TYPE_CHECKING:
+    from . import App
+
+# ms between checks for finished writes, while there are any in flight
+POLL_INTERVAL = 50
+
+
+class SaveManager:
+    """Writes files off the UI thread.
+
+    The text to save is snapshotted by the caller, then encoded and written to a
+    temporary file on a thread and moved over the original with `os.replace`, so a
+    crash mid-write never leaves a truncated file. Symlinks are followed to the file
+    they point to. Files with other hard links, or whose owner can not be kept, are
+    written in place instead. While a path is being written, newer saves to it are
+    coalesced: only the latest one is written next.
+
+    The outcome of the writes is queued by the thread and handled on the UI thread,
+    which polls for it while writes are in flight.
+    """
+
+    def __init__(self, base: App) -> None:
+        self.base = base
+        self.lock = threading.Lock()
+
+        # paths being written, and the latest save waiting for each of them
+        self.writing: set[str] = set()
+        self.pending: dict[str, tuple] = {}
+        # (callbacks, error) of the writes done, for the UI thread to handle
+        self.done = queue.Queue()
+        self.polling = False
+
+        self.saves = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.failed = 0
+        self.total_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+
+    def save(
+        self,
+        path: str,
+        text: str,
+        encoding: str = "utf-8",
+        eol: str = "\n",
+        on_saved: typing.Callable[[], typing.Any] = None,
+        on_failed: typing.Callable[[], typing.Any] = None,
+    ) -> None:
+        """Save text to a file in the background
+
+        Args:
+            path (str): The file to write
+            text (str): The content, with \\n line endings
+            encoding (str, optional): Encoding to write with. Defaults to utf-8.
+            eol (str, optional): Line ending, either the characters or their
+                label (LF, CRLF, CR). Defaults to \\n.
+            on_saved (Callable, optional): Called on the UI thread once written.
+            on_failed (Callable, optional): Called on the UI thread if writing failed.
+        """
+
+        path = os.path.realpath(path)
+        if eol not in eol_map_rev:
+            eol = get_eol(str(eol).upper())
+        saved = [on_saved] if on_saved else []
+        failed = [on_failed] if on_failed else []
+
+        with self.lock:
+            if previous := self.pending.get(path):
+                # superseded, its callbacks run when this one is written
+                self.coalesced += 1
+                saved, failed = previous[3] + saved, previous[4] + failed
+            job = (text, encoding, eol, saved, failed, time.perf_counter())
+
+            if path in self.writing:
+                self.pending[path] = job
+                return
+            self.writing.add(path)
+
+        # not a daemon, pending writes finish even if the app is closed
+        threading.Thread(target=self.write, args=(path, job)).start()
+        if not self.polling:
+            self.polling = True
+            self.base.after(POLL_INTERVAL, self.poll)
+
+    def write(self, path: str, job: tuple) -> None:
+        while job:
+            text, encoding, eol, saved, failed, queued = job
+            try:
+                if eol != "\n":
+                    text = text.replace("\n", eol)
+                data = text.encode(encoding or "utf-8")
+                self.write_file(path, data)
+            except Exception as e:
+                self.failed += 1
+                self.notify(failed, f"Saving '{path}' failed: {e}")
+            else:
+                self.saves += 1
+                self.last_latency_ms = (time.perf_counter() - queued) * 1000
+                self.total_latency_ms += self.last_latency_ms
+                self.notify(saved)
+
+            with self.lock:
+                job = self.pending.pop(path, None)
+                if not job:
+                    self.writing.discard(path)
+
+    def write_file(self, path: str, data: bytes) -> None:
+        """Replace the content of a file, atomically unless that would lose its other
+        hard links or its owner"""
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if stat and stat.st_nlink > 1:
+            return self.write_in_place(path, data)
+
+        try:
+            fd, temp = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix=".", suffix=".tmp"
+            )
+        except PermissionError:
+            if not stat:
+                raise
+            # no new files in the directory, the file itself may still be writable
+            return self.write_in_place(path, data)
+
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            if stat:
+                shutil.copymode(path, temp)
+                owner = os.stat(temp)
+                if (owner.st_uid, owner.st_gid) != (stat.st_uid, stat.st_gid):
+                    os.chown(temp, stat.st_uid, stat.st_gid)
+            os.replace(temp, path)
+        except Exception as e:
+            os.unlink(temp)
+            if not (stat and isinstance(e, PermissionError)):
+                raise
+            # the owner can not be kept, the file is written over instead
+            self.write_in_place(path, data)
+
+    def write_in_place(self, path: str, data: bytes) -> None:
+        """Write over the content of a file, keeping the file itself"""
+
+        with open(path, "wb") as file:
+            file.write(data)
+
+    def notify(self, callbacks: list[typing.Callable], error: str = "") -> None:
+        """Queue the callbacks and the error to be handled on the UI thread"""
+
+        self.done.put((callbacks, error))
+
+    def poll(self) -> None:
+        """Run the callbacks and log the errors of the writes done so far, then keep
+        polling while there are writes in flight"""
+
+        while True:
+            try:
+                callbacks, error = self.done.get_nowait()
+            except queue.Empty:
+                break
+
+            if error:
+                self.base.logger.error(error)
+                self.base.notifications.error(error)
+            for callback in callbacks:
+                callback()
+
+        with self.lock:
+            busy = bool(self.writing)
+        if busy or not self.done.empty():
+            self.base.after(POLL_INTERVAL, self.poll)
+        else:
+            self.polling = False
+
+    def skip(self) -> None:
+        """Count a save skipped because there was nothing to save"""
+
+        self.skipped += 1
+
+    @property
+    def metrics(self) -> dict[str, float]:
+        return {
+            "saves": self.saves,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "last_latency_ms": self.last_latency_ms,
+            "average_latency_ms": self.total_latency_ms / self.saves if self.saves else 0,
+        }
@@ -21,6 +21,39 @@ class Config:
         self.auto_save_enabled = False
         self.auto_save_timer_ms = 10000
 
+        # only lex and tag the lines in view, plus a margin of lines around them
+        self.viewport_highlighting = True
+        self.highlight_margin = 50
+        # lex on a worker thread, tags are applied when it is done
+        self.background_highlighting = True
+        # wait for a pause in editing before asking the language server for an outline
+        self.outline_refresh_delay_ms = 500
+        # complete words from all the open tabs instead of the current one (without lsp)
+        self.shared_word_completions = False
+        # occurrences of the word at the cursor are highlighted in view once the cursor
+        # rests for this long, up to this many of them
+        self.current_word_highlight_delay_ms = 100
+        self.current_word_highlight_limit = 500
+        # files are inserted into the editor in slices of this many characters
+        self.load_slice_size = 1 << 20
+        # files from this size on are opened in the read-only large file viewer
+        self.large_file_threshold = 64 * 1024 * 1024
+        # find stops counting matches after this many
+        self.find_results_limit = 10000
+        # time the stages between a key press and the paint, see the latency commands
+        self.latency_profiling = False
+        # the mouse rests on a word this long before its hover is requested
+        self.hover_delay_ms = 300
+        # typing pauses this long before completions are requested
+        self.completion_delay_ms = 50
+        # language servers started in the background for the languages most used in
+        # an opened folder, 0 to only start them when a file needs one
+        self.lsp_warm_pool = 1
+        # language servers kept running with no file open, least recently used go first
+        self.lsp_max_idle = 2
+        # idle language servers are stopped while they take more memory than this (MB)
+        self.lsp_idle_memory_mb = 1024
+
     def get_config_path(self, relative_path: str) -> str:
         """Get the absolute path to the resource
 
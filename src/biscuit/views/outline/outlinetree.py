@@ -52,7 +52,7 @@ class OutlineTree(Frame):
 
     def clear(self) -> None:
         # self.tree.delete(*self.tree.get_children())
-        self.tree.delete("1.0", tk.END)
+        self.tree.clear()
 
     def update_symbols(
         self, tab: Text = None, response: list[lsp.DocumentSymbol] = None
@@ -68,8 +68,7 @@ class OutlineTree(Frame):
         self.scrollbar.grid()
 
         self.tree.config(state=tk.NORMAL)
-        self.clear()
-        self.tree.add_items(response)
+        self.tree.update_items(response)
         self.tree.config(state=tk.DISABLED)
 
     def add_items(self, parent: str, items: list[lsp.DocumentSymbol]) -> None:
@@ -3,13 +3,17 @@ import tkinter as tk
 import tarts as lsp
 
 from biscuit.common.ui import Text
-from biscuit.language.utils import decode_position
+from biscuit.language.utils import decode_position, flatten_symbols
 
 from .kinds import kinds
 
 
 class Tree(Text):
-    """Tree view that displays the outline of the active document."""
+    """Tree view that displays the outline of the active document.
+
+    A line per symbol. An update is diffed against the symbols shown, only the lines
+    between the first and the last one that changed are replaced, so the view stays
+    where it is. Clicks are bound once, the symbol is found from the line clicked."""
 
     def __init__(self, master):
         super().__init__(master, wrap="none", borderwidth=0, highlightthickness=0)
@@ -34,7 +38,11 @@ class Tree(Text):
             "branch", foreground=self.base.theme.border, font=("Segoi UI", 15)
         )
 
-        # self.bind("<Button-1>", self.onclick)
+        # (level, kind, name) shown on every line and the position it goes to
+        self.rows: list[tuple[int, int, str]] = []
+        self.positions: list[str] = []
+
+        self.bind("<Button-1>", self.onclick)
         # self.bind("<Enter>", self.hoverin)
         # self.bind("<Leave>", self.hoverout)
 
@@ -44,29 +52,43 @@ class Tree(Text):
     # def hoverout(self, _: tk.Event) -> None:
     #     self.tag_config("branch", foreground=self.base.theme.views.sidebar.item.content.background)
 
-    def add_items(self, items: list[lsp.DocumentSymbol], level=0) -> None:
-        if not items:
+    def update_items(self, items: list[lsp.DocumentSymbol]) -> None:
+        """Show the symbols, replacing only the lines that changed"""
+
+        rows, positions = [], []
+        for level, item in flatten_symbols(items):
+            rows.append((level, item.kind, item.name))
+            positions.append(decode_position(item.range.start))
+        self.positions = positions
+
+        old, new = len(self.rows), len(rows)
+        start = 0
+        while start < min(old, new) and self.rows[start] == rows[start]:
+            start += 1
+        end = 0
+        while (
+            end < min(old, new) - start
+            and self.rows[old - end - 1] == rows[new - end - 1]
+        ):
+            end += 1
+        if start == old == new:
             return
 
-        for item in items:
-            if item.kind == lsp.SymbolKind.MODULE:
-                continue
-
-            tag = f"{item.name}{item.kind}"
-            self.insert(tk.END, "┊" * level, "branch")
-            self.insert(tk.END, kinds[item.kind - 1][0], kinds[item.kind - 1][0])
-            self.insert(tk.END, f" {item.name}\n", tag)
-            self.add_items(item.children, level + 1)
-            self.tag_bind(
-                tag,
-                "<Button-1>",
-                lambda e, i=item: self.base.goto_location_in_active_editor(
-                    decode_position(i.range.start)
-                ),
-            )
-
-    # def onclick(self, event: tk.Event) -> None:
-    #     self.config(state=tk.NORMAL)
-    #     index = self.index(f"@{event.x},{event.y}")
-    #     self.tag_add(tk.SEL, f'{index} linestart', f'{index} lineend+1c')
-    #     self.config(state=tk.DISABLED)
+        self.delete(f"{start + 1}.0", f"{old - end + 1}.0")
+        args = []
+        for level, kind, name in rows[start : new - end]:
+            icon = kinds[kind - 1][0]
+            args += ["┊" * level, "branch", icon, icon, f" {name}\n", ()]
+        if args:
+            self.insert(f"{start + 1}.0", *args)
+        self.rows = rows
+
+    def clear(self) -> None:
+        self.delete("1.0", tk.END)
+        self.rows = []
+        self.positions = []
+
+    def onclick(self, event: tk.Event) -> None:
+        row = int(self.index(f"@{event.x},{event.y}").split(".")[0]) - 1
+        if row < len(self.positions):
+            self.base.goto_location_in_active_editor(self.positions[row])
@@ -0,0 +1,60 @@
+from biscuit.editor.text.brackets import CHUNK_SIZE, BracketIndex, get_string_patterns
+
+
+def index(text, comment_prefix="#", language=""):
+    brackets = BracketIndex(comment_prefix, get_string_patterns(language))
+    brackets.rebuild(text)
+    return brackets
+
+
+class TestBracketIndex:
+    # Tests that a bracket is matched both ways, across lines
+    def test_match(self):
+        brackets = index("f(a, [b,\n  c], {d: (e)})\nx")
+        assert brackets.match(1, 1) == (2, 14)
+        assert brackets.match(2, 14) == (1, 1)
+        assert brackets.match(1, 5) == (2, 3)
+        assert brackets.match(2, 10) == (2, 12)
+        assert brackets.match(1, 0) is None
+        assert brackets.match(3, 0) is None
+
+    # Tests that the innermost bracket left open before a position is found
+    def test_enclosing(self):
+        brackets = index("f(a, [b,\n  c], {d: (e)})\nx")
+        assert brackets.enclosing(2, 2) == (1, 5)
+        assert brackets.enclosing(2, 8) == (2, 6)
+        assert brackets.enclosing(2, 11) == (2, 10)
+        assert brackets.enclosing(3, 0) is None
+
+    # Tests that brackets in strings and comments are skipped
+    def test_ignored(self):
+        brackets = index("(')' \")\" # )\n)")
+        assert brackets.match(1, 0) == (2, 0)
+
+    # Tests that a single quote only starts a string where the language has them
+    def test_string_patterns(self):
+        text = "fn f<'a>(x: &'a str) -> char { '{' }"
+        rust = index(text, "//", "rust")
+        assert rust.match(1, 8) == (1, 19)
+        assert rust.match(1, 29) == (1, 35)
+
+        other = index(text, "//", "python")
+        assert other.match(1, 8) is None
+
+    # Tests that matches stay right as lines are edited across chunks
+    def test_edited(self):
+        lines = ["("] + ["x"] * (3 * CHUNK_SIZE) + [")"]
+        brackets = index("\n".join(lines))
+        assert brackets.match(1, 0) == (len(lines), 0)
+
+        brackets.edited(2, 2, ["[", "]", "{"])
+        assert brackets.lines == len(lines) + 2
+        assert brackets.match(2, 0) == (3, 0)
+        assert brackets.match(1, 0) is None
+        assert brackets.enclosing(len(lines) + 2, 0) == (4, 0)
+
+        brackets.edited(4, 4, ["{}"])
+        assert brackets.match(1, 0) == (len(lines) + 2, 0)
+        brackets.edited(2, 2 * CHUNK_SIZE, [])
+        assert brackets.lines == len(lines) + 3 - 2 * CHUNK_SIZE
+        assert brackets.match(brackets.lines, 0) == (1, 0)
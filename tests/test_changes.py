@@ -0,0 +1,82 @@
+from biscuit.editor.text.changes import Change, Changes
+
+
+def typed(history, line, column, text):
+    for column, char in enumerate(text, column):
+        start = [line, column]
+        history.record(Change(start, start, [line, column + 1], "", char))
+        history.separate()
+
+
+class TestChanges:
+    # Tests that typed characters are coalesced into one change per word
+    def test_typing(self):
+        history = Changes()
+        typed(history, 1, 0, "ab cd")
+
+        assert history.undo_stack == [
+            [Change([1, 0], [1, 0], [1, 3], "", "ab ")],
+            [Change([1, 3], [1, 3], [1, 5], "", "cd")],
+        ]
+
+    # Tests that runs of backspaces and deletes are coalesced
+    def test_deleting(self):
+        history = Changes()
+        for column, char in ((3, "d"), (2, "c"), (1, "b")):
+            history.record(Change([1, column], [1, column + 1], [1, column], char, ""))
+            history.separate()
+        assert history.undo_stack == [[Change([1, 1], [1, 4], [1, 1], "bcd", "")]]
+
+        history.clear()
+        for char in "xyz":
+            history.record(Change([2, 0], [2, 1], [2, 0], char, ""))
+            history.separate()
+        assert history.undo_stack == [[Change([2, 0], [2, 3], [2, 0], "xyz", "")]]
+
+    # Tests that runs are broken by newlines, jumps and edits of other kinds
+    def test_not_coalesced(self):
+        history = Changes()
+        typed(history, 1, 0, "a")
+        typed(history, 1, 1, "\n")
+        typed(history, 2, 0, "b")
+        typed(history, 5, 0, "c")
+        history.record(Change([5, 0], [5, 1], [5, 0], "c", ""))
+        history.separate()
+        assert len(history.undo_stack) == 5
+
+    # Tests that edits made while a group is open are undone together
+    def test_group(self):
+        history = Changes()
+        history.record(Change([1, 0], [1, 0], [1, 3], "", "foo"))
+        history.record(Change([3, 0], [3, 3], [3, 0], "bar", ""))
+        history.separate()
+        typed(history, 1, 3, "x")
+
+        assert len(history.undo_stack) == 2
+        assert len(history.undo_stack[0]) == 2
+
+    # Tests that undone groups are redone, and forgotten once a new edit is made
+    def test_undo_redo(self):
+        history = Changes()
+        typed(history, 1, 0, "a b")
+        first, second = history.undo_stack
+
+        assert history.undo() == second
+        assert history.undo() == first
+        assert history.undo() is None
+        assert history.redo() == first
+        assert history.undo_stack == [first]
+        assert history.redo_stack == [second]
+
+        typed(history, 1, 2, "c")
+        assert history.redo_stack == []
+        assert history.redo() is None
+        assert len(history.undo_stack) == 2
+
+    # Tests that only the most recent groups are kept
+    def test_limit(self):
+        history = Changes(limit=3)
+        for line in range(1, 6):
+            typed(history, line * 2, 0, "x")
+        starts = [group[0].start for group in history.undo_stack]
+        assert starts == [[6, 0], [8, 0], [10, 0]]
@@ -0,0 +1,155 @@
+import random
+
+from biscuit.editor.text.changes import Change
+from biscuit.editor.text.diagnostics import DiagnosticStore, IntervalTree, shift
+from biscuit.language.data import Diagnostic
+
+
+def diagnostic(start, end, message="", severity=1):
+    return Diagnostic(start=start, end=end, message=message, severity=severity)
+
+
+class TestDiagnosticStore:
+    # Tests that a publish is diffed against the previous one
+    def test_update_diff(self):
+        store = DiagnosticStore()
+        removed, added = store.update(
+            [diagnostic("1.0", "1.4", "a"), diagnostic("3.2", "3.5", "b")]
+        )
+        assert removed == []
+        assert sorted(added) == [((1, 0), (1, 4), 1, "a"), ((3, 2), (3, 5), 1, "b")]
+
+        removed, added = store.update(
+            [diagnostic("3.2", "3.5", "b"), diagnostic("5.0", "5.1", "c", 2)]
+        )
+        assert removed == [((1, 0), (1, 4), 1, "a")]
+        assert added == [((5, 0), (5, 1), 2, "c")]
+
+        unchanged = [diagnostic("3.2", "3.5", "b"), diagnostic("5.0", "5.1", "c", 2)]
+        assert store.update(unchanged) == ([], [])
+
+    # Tests that only the diagnostics holding a position are found
+    def test_at(self):
+        store = DiagnosticStore()
+        store.update(
+            [
+                diagnostic("1.0", "4.0", "outer"),
+                diagnostic("2.3", "2.8", "inner"),
+                diagnostic("6.0", "6.2", "later"),
+            ]
+        )
+        assert [entry[3] for entry in store.at("2.5")] == ["outer", "inner"]
+        assert [entry[3] for entry in store.at("2.8")] == ["outer"]
+        assert [entry[3] for entry in store.at("5.0")] == []
+        assert [entry[3] for entry in store.at("6.1")] == ["later"]
+
+    # Tests that the diagnostics move along with the edits made above them
+    def test_edited(self):
+        store = DiagnosticStore()
+        store.update([diagnostic("3.4", "3.9", "a"), diagnostic("1.0", "1.2", "b")])
+
+        # two lines inserted above
+        store.edited(Change([2, 0], [2, 0], [4, 0], "", "x\ny\n"))
+        store.flush()
+        assert store.entries == {((5, 4), (5, 9), 1, "a"), ((1, 0), (1, 2), 1, "b")}
+
+        # text inserted at the start of a range is left out of it, at the end too
+        store.edited(Change([5, 4], [5, 4], [5, 6], "", "zz"))
+        store.edited(Change([5, 11], [5, 11], [5, 12], "", "z"))
+        store.flush()
+        assert ((5, 6), (5, 11), 1, "a") in store.entries
+
+        # a line joined to the one above
+        store.edited(Change([4, 1], [5, 0], [4, 1], "\n", ""))
+        assert [entry[3] for entry in store.at("4.8")] == ["a"]
+        assert ((4, 7), (4, 12), 1, "a") in store.entries
+
+        # the diagnostic gone after the edit is found where it is now
+        removed, _ = store.update([diagnostic("1.0", "1.2", "b")])
+        assert removed == [((4, 7), (4, 12), 1, "a")]
+
+    # Tests that edits are only applied on the next lookup, edits below are dropped
+    def test_edited_lazily(self):
+        store = DiagnosticStore()
+        store.update([diagnostic("2.0", "2.3", "a"), diagnostic("5.1", "5.2", "b")])
+        tree = store.tree
+
+        store.edited(Change([9, 0], [9, 0], [9, 1], "", "x"))
+        assert store.pending == []
+        for column in range(3):
+            store.edited(Change([1, column], [1, column], [2, 0], "", "\n"))
+        assert store.tree is tree and len(store.pending) == 3
+
+        assert [entry[3] for entry in store.at("5.0")] == ["a"]
+        assert store.pending == []
+        assert store.overlapping((8, 0), (8, 9)) == [((8, 1), (8, 2), 1, "b")]
+
+    # Tests that edits applied together move the diagnostics as one by one would
+    def test_edited_random(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            entries = set()
+            for _ in range(30):
+                start = (rng.randint(1, 30), rng.randint(0, 9))
+                end = max(start, (rng.randint(1, 30), rng.randint(0, 9)))
+                entries.add((start, end, 1, str(len(entries))))
+            store = DiagnosticStore()
+            store.update(
+                [
+                    diagnostic(f"{s[0]}.{s[1]}", f"{e[0]}.{e[1]}", m)
+                    for s, e, _, m in entries
+                ]
+            )
+
+            for _ in range(rng.randint(1, 10)):
+                start = [rng.randint(1, 30), rng.randint(0, 9)]
+                old_end = [start[0] + rng.randint(0, 2), rng.randint(0, 9)]
+                if old_end < start:
+                    old_end = list(start)
+                new_end = [start[0] + rng.randint(0, 2), rng.randint(0, 9)]
+                if new_end < start:
+                    new_end = list(start)
+                change = Change(start, old_end, new_end, "", "")
+
+                store.edited(change)
+                moved = set()
+                for start, end, severity, message in entries:
+                    start = shift(start, change, True)
+                    end = max(start, shift(end, change, False))
+                    moved.add((start, end, severity, message))
+                entries = moved
+
+            store.flush()
+            assert store.entries == entries
+            assert store.tree.starts == sorted(entry[0] for entry in entries)
+
+    # Tests that empty diagnostics are found at their position
+    def test_empty(self):
+        store = DiagnosticStore()
+        store.update([diagnostic("2.4", "2.4", "empty"), diagnostic("2.0", "2.4", "a")])
+        assert [entry[3] for entry in store.at("2.4")] == ["empty"]
+        assert [entry[3] for entry in store.at("2.3")] == ["a"]
+        assert store.at("2.5") == []
+        assert [e[3] for e in store.overlapping((1, 0), (2, 4))] == ["a", "empty"]
+
+        store.edited(Change([2, 4], [2, 4], [2, 6], "", "zz"))
+        assert [entry[3] for entry in store.at("2.6")] == ["empty"]
+
+
+class TestIntervalTree:
+    # Tests that queries return the entries overlapping a range, in order
+    def test_query(self):
+        entries = [((i, 0), (i + 2, 0), 1, str(i)) for i in range(1, 20, 3)]
+        tree = IntervalTree(entries)
+
+        for start, end in [((1, 0), (1, 0)), ((3, 0), (7, 5)), ((20, 0), (30, 0))]:
+            expected = [e for e in entries if e[0] <= end and e[1] > start]
+            assert tree.query(start, end) == expected
+
+        # empty entries are found at their position, and only there
+        empty = IntervalTree([((i, 0), (i, 0), 1, str(i)) for i in range(1, 5)])
+        assert empty.query((2, 0), (2, 0)) == [((2, 0), (2, 0), 1, "2")]
+        assert len(empty.query((2, 0), (4, 0))) == 3
+        assert empty.query((2, 1), (2, 9)) == []
+
+        assert IntervalTree(()).query((1, 0), (9, 0)) == []
@@ -0,0 +1,34 @@
+import tkinter as tk
+
+
+class TestFindReplace:
+    # Tests that matches are found, navigated to and followed through an edit
+    def test_find_next_and_edit(self, app_instance, tmp_path):
+        path = tmp_path / "find.txt"
+        path.write_text("foo bar foo\nbaz foo\n")
+        text = app_instance.open_editor(str(path)).content.text
+        while text.loading:
+            app_instance.update()
+
+        findreplace = app_instance.findreplace
+        findreplace.show(text)
+        findreplace.findbox.insert(0, "foo")
+        assert findreplace.starts == [0, 8, 16]
+        assert findreplace.ends == [3, 11, 19]
+
+        text.mark_set(tk.INSERT, "1.0")
+        findreplace.next_match()
+        assert text.index(tk.INSERT) == "1.8"
+        findreplace.prev_match()
+        assert text.index(tk.INSERT) == "1.0"
+
+        text.insert("1.0", "foo ")
+        assert findreplace.starts == [0, 4, 12, 20]
+        text.delete("2.0", "2.4")
+        assert findreplace.starts == [0, 4, 12, 16]
+
+        findreplace.highlight_matches(text)
+        assert text.tag_ranges("found")
+
+        findreplace.hide()
+        app_instance.close_active_editor()
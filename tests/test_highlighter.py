@@ -0,0 +1,369 @@
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from pygments.token import Token
+
+from biscuit.editor.text.changes import Change
+from biscuit.editor.text.highlighter import ROOT, Highlighter, get_tokens_with_states
+
+TAGGED = [
+    Token.Keyword,
+    Token.Name.Function,
+    Token.Name.Builtin,
+    Token.Literal.String.Double,
+    Token.Literal.String.Single,
+    Token.Literal.String.Doc,
+    Token.Literal.Number.Integer,
+    Token.Comment.Single,
+    Token.Comment.Multiline,
+    Token.Operator,
+]
+
+
+class Document:
+    """Stands in for the text widget, tags are kept as sets of character offsets
+    and move with the edits the way Tk moves them"""
+
+    def __init__(self, text, visible, threaded=False):
+        self.text = text
+        self.visible = visible
+        self.tags = {}
+        self.version = 0
+        self.callbacks = []
+        self.path = "document"
+        self.encoding = "utf-8"
+        config = SimpleNamespace(
+            viewport_highlighting=True,
+            highlight_margin=5,
+            background_highlighting=threaded,
+        )
+        self.base = SimpleNamespace(
+            theme=SimpleNamespace(syntax={token: "#000" for token in TAGGED}),
+            settings=SimpleNamespace(config=config),
+        )
+
+    def offset(self, index):
+        lines = self.text.split("\n")
+        if index == "end":
+            return len(self.text) + 1
+        if index == "end-1c":
+            return len(self.text)
+        line, column = index.split(".")
+        line = int(line)
+        before = sum(len(text) + 1 for text in lines[: line - 1])
+        return before + (len(lines[line - 1]) if column == "end" else int(column))
+
+    def position(self, offset):
+        lines = self.text[:offset].split("\n")
+        return [len(lines), len(lines[-1])]
+
+    def index(self, index):
+        return "{}.{}".format(*self.position(self.offset(index)))
+
+    def get(self, start, end):
+        return (self.text + "\n")[self.offset(start) : self.offset(end)]
+
+    def tag_add(self, tag, *indices):
+        offsets = self.tags.setdefault(tag, set())
+        for start, end in zip(indices[::2], indices[1::2]):
+            offsets.update(range(self.offset(start), self.offset(end)))
+
+    def tag_remove(self, tag, start, end):
+        start, end = self.offset(start), self.offset(end)
+        self.tags[tag] = {i for i in self.tags.get(tag, ()) if not start <= i < end}
+
+    def tag_configure(self, *_, **__):
+        pass
+
+    def event_generate(self, *_):
+        pass
+
+    def after(self, _, callback):
+        self.callbacks.append(callback)
+
+    def get_visible_range(self):
+        return self.visible
+
+    def pump(self):
+        while self.callbacks:
+            time.sleep(0.001)
+            self.callbacks.pop(0)()
+
+    def edit(self, start, end, text):
+        """Replace the characters from offset `start` to `end`, returns the Change"""
+
+        old_start, old_end = self.position(start), self.position(end)
+        old_text = self.text[start:end]
+        moved = len(text) - (end - start)
+        for tag, offsets in self.tags.items():
+            self.tags[tag] = {
+                i if i < start else i + moved for i in offsets if not start <= i < end
+            }
+        self.text = self.text[:start] + text + self.text[end:]
+        self.version += 1
+        new_end = self.position(start + len(text))
+        return Change(old_start, old_end, new_end, old_text, text)
+
+
+def highlighter(text, language, visible=(1, 30), threaded=False):
+    document = Document(text, visible, threaded)
+    highlighter = Highlighter(document, language)
+    highlighter.reset()
+    return document, highlighter
+
+
+def highlight(document, highlighter):
+    highlighter.highlight()
+    document.pump()
+
+
+def count_lexed(highlighter):
+    """Returns the list the numbers of the lines lexed from now on are added to"""
+
+    lexed = []
+    lex_lines = highlighter.lex_lines
+
+    def counting(text, line, stack):
+        for item in lex_lines(text, line, stack):
+            lexed.append(item[0])
+            yield item
+
+    highlighter.lex_lines = counting
+    return lexed
+
+
+def expected_tags(document, highlighter, first, last):
+    """Returns the tags a lex of the whole document gives the lines, by offset"""
+
+    tags = {}
+    offset = 0
+    for _, token, value in highlighter.lexer.get_tokens_unprocessed(
+        document.text + "\n"
+    ):
+        if token in TAGGED:
+            tags.setdefault(str(token), set()).update(
+                offset + i for i, char in enumerate(value) if char != "\n"
+            )
+        offset += len(value)
+    return window_tags(document, tags, first, last)
+
+
+def window_tags(document, tags, first, last):
+    start = document.offset(f"{first}.0")
+    end = document.offset(f"{last}.end")
+    found = {}
+    for tag, offsets in tags.items():
+        # a docstring is matched whole by the lexer, an edit below can make one of
+        # the string a line opens. Only the type of the string token changes
+        tag = tag.replace("String.Doc", "String.Double")
+        found.setdefault(tag, set()).update(i for i in offsets if start <= i < end)
+    return {tag: offsets for tag, offsets in found.items() if offsets}
+
+
+class TestTokensWithStates:
+    source = 'x = """a\nb"""\n\ndef f(y):\n    return "c"  # d\n'
+
+    # Tests that the tokens are the ones the lexer gives, with states at lines
+    def test_tokens(self):
+        _, h = highlighter(self.source, "python")
+        tokens = list(get_tokens_with_states(h.lexer, self.source))
+        assert [t for t in tokens if t[1] is not None] == list(
+            h.lexer.get_tokens_unprocessed(self.source)
+        )
+        states = {pos: state for pos, token, state in tokens if token is None}
+        # inside the string, then back at the root
+        assert len(states[self.source.index("b")]) == 2
+        assert states[self.source.index("def")] == ROOT
+
+    # Tests that lexing resumed from a state gives the same tokens as before
+    def test_resume(self):
+        _, h = highlighter(self.source, "python")
+        tokens = list(get_tokens_with_states(h.lexer, self.source))
+        for pos, token, state in tokens:
+            if token is None:
+                rest = [
+                    (p - pos, t, v) for p, t, v in tokens if p >= pos and t is not None
+                ]
+                resumed = get_tokens_with_states(h.lexer, self.source[pos:], state)
+                assert [t for t in resumed if t[1] is not None] == rest
+
+
+class TestHighlighterPasses:
+    # Tests that lines are yielded with their state and the spans of their tokens
+    def test_lex_lines(self):
+        _, h = highlighter('x = """a\nb"""\nif y:', "python")
+        lines = list(h.lex_lines('x = """a\nb"""\nif y:\n', 1, ROOT))
+        assert [line for line, _, _ in lines] == [1, 2, 3, 4]
+        assert [state == ROOT for _, state, _ in lines] == [True, False, True, True]
+        assert {tag for tag, _, _ in lines[1][2]} == {"Token.Literal.String.Double"}
+        assert ("Token.Keyword", 0, 2) in lines[2][2]
+
+    # Tests that only the lines in the window are lexed and tagged
+    def test_window(self):
+        document, h = highlighter("x = 1\n" * 1000, "python", visible=(100, 120))
+        highlight(document, h)
+        assert h.untagged(95, 125) is None
+        assert h.spans[93] is None and h.spans[125] is None
+        assert document.tags == expected_tags(document, h, 95, 125)
+
+    # Tests that lexing stops once the states match the ones before the edit
+    def test_convergence(self):
+        document, h = highlighter("x = 1\n" * 1000, "python", visible=(1, 1000))
+        highlight(document, h)
+
+        lexed = count_lexed(h)
+        h.edited(document.edit(document.offset("500.4"), document.offset("500.5"), "2"))
+        assert (h.pending, h.damaged) == (500, 500)
+        highlight(document, h)
+        assert h.pending is None
+        assert max(lexed) <= 502
+
+    # Tests that an edit changing the states below is carried through them
+    def test_damaged(self):
+        document, h = highlighter("x = 1\n" * 100, "python", visible=(1, 20))
+        highlight(document, h)
+
+        h.edited(document.edit(document.offset("10.4"), document.offset("10.4"), '"""'))
+        assert (h.pending, h.damaged) == (10, 10)
+        highlight(document, h)
+        # the rest of the document is in the string now, verified once in view
+        assert h.pending == 26
+        assert h.states[20] == h.states[11] != ROOT
+        assert window_tags(document, document.tags, 1, 25) == expected_tags(
+            document, h, 1, 25
+        )
+
+        document.visible = (80, 100)
+        highlight(document, h)
+        assert window_tags(document, document.tags, 75, 100).keys() == {
+            "Token.Literal.String.Double"
+        }
+
+        h.edited(document.edit(document.offset("10.4"), document.offset("10.7"), ""))
+        highlight(document, h)
+        assert h.states[90] == ROOT
+        assert window_tags(document, document.tags, 75, 100) == expected_tags(
+            document, h, 75, 100
+        )
+
+    # Tests that lexers without states lex from the first line to the window only
+    def test_stateless_window(self):
+        document, h = highlighter("int x = 1;\n" * 1000, "c", visible=(1, 20))
+        assert not h.stateful
+        highlight(document, h)
+        assert h.untagged(1, 25) is None and h.spans[25] is None
+
+        lexed = count_lexed(h)
+
+        h.edited(document.edit(document.offset("10.0"), document.offset("10.0"), "/*"))
+        highlight(document, h)
+        assert max(lexed) <= 27
+        assert h.pending == 26
+
+        document.visible = (500, 520)
+        highlight(document, h)
+        assert window_tags(document, document.tags, 495, 525).keys() == {
+            "Token.Comment.Multiline"
+        }
+
+        # lines above the window changed by an edit are tagged again once in view
+        document.visible = (100, 120)
+        highlight(document, h)
+        h.edited(document.edit(document.offset("10.0"), document.offset("10.2"), ""))
+        document.visible = (500, 520)
+        highlight(document, h)
+        document.visible = (100, 120)
+        highlight(document, h)
+        assert window_tags(document, document.tags, 95, 125) == expected_tags(
+            document, h, 95, 125
+        )
+
+    # Tests that spans match a lex of the whole document after random edits
+    def test_random_edits(self):
+        pieces = {
+            "python": ["x", " = ", "1", "def ", "f(", ")", ":", '"""', "'", "#", "\n"],
+            "php": ["<?php ", "$x", " = ", "1", ";", "/*", "*/", '"', "//", "\n"],
+            "c": ["int ", "x", " = ", "1", ";", "/*", "*/", '"', "//", "{", "\n"],
+        }
+        rng = random.Random(0)
+        for language, fragments in pieces.items():
+            for threaded in (False, True):
+                lines = ["".join(rng.choices(fragments, k=6)) for _ in range(150)]
+                text = "\n".join(line.replace("\n", "") for line in lines)
+                document, h = highlighter(text, language, threaded=threaded)
+                for _ in range(60):
+                    start = rng.randrange(len(document.text) + 1)
+                    end = min(len(document.text), start + rng.choice([0, 0, 1, 5]))
+                    text = "".join(rng.choices(fragments, k=rng.randint(0, 2)))
+                    h.edited(document.edit(start, end, text))
+                    if rng.random() < 0.3:
+                        first = rng.randint(1, document.text.count("\n") + 1)
+                        document.visible = (first, first + 30)
+                    highlight(document, h)
+
+                    first, last = h.get_highlight_window()
+                    assert window_tags(
+                        document, document.tags, first, last
+                    ) == expected_tags(document, h, first, last), (language, threaded)
+
+
+class TestStaleResults:
+    # Tests that a result lexed before an edit is dropped and a new pass is started
+    def test_older_version(self):
+        document, h = highlighter("def f():\n    pass\n", "python", threaded=True)
+        stale = (document.version, h.generation, 1, 1, 3, 1)
+        lines = list(h.lex_lines(h.snapshot(1), 1, ROOT))
+
+        # the new pass is held until the stale result is handled
+        release = threading.Event()
+        lex_snapshot = h.lex_snapshot
+        h.lex_snapshot = lambda *args: release.wait(5) and lex_snapshot(*args)
+
+        h.edited(document.edit(0, 3, "class"))
+        h.results.put((stale, lines))
+        h.job = stale
+        h.process_results()
+
+        assert document.tags == {}
+        assert h.job is not None and h.job[0] == document.version
+        release.set()
+        document.pump()
+        assert "Token.Keyword" in document.tags
+        assert document.tags == expected_tags(document, h, 1, 3)
+
+
+class TestHighlighter:
+    # Tests that a token running far past the window is not cut short
+    def test_long_token(self, app_instance, tmp_path):
+        path = tmp_path / "long.py"
+        lines = ["x = 1"] * 10 + ['    """start'] + ["inside"] * 300 + ['end"""']
+        path.write_text("\n".join(lines + ["y = 2"]))
+        text = app_instance.open_editor(str(path)).content.text
+        while text.loading:
+            app_instance.update()
+
+        text.see("1.0")
+        text.highlighter.highlight()
+        app_instance.update()
+        assert "Token.Literal.String.Doc" in text.tag_names("12.2")
+
+        app_instance.close_active_editor()
+
+    # Tests that lexers without states are highlighted from the first line
+    def test_stateless_lexer(self, app_instance, tmp_path):
+        path = tmp_path / "comment.c"
+        lines = ["/*"] + ["comment ( {"] * 300 + ["*/", "int x = 1;"]
+        path.write_text("\n".join(lines))
+        text = app_instance.open_editor(str(path)).content.text
+        while text.loading:
+            app_instance.update()
+
+        assert not text.highlighter.stateful
+        text.see("250.0")
+        text.highlighter.highlight()
+        app_instance.update()
+        assert "Token.Comment.Multiline" in text.tag_names("250.2")
+
+        app_instance.close_active_editor()
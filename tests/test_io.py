@@ -0,0 +1,132 @@
+import io
+import random
+import sys
+from types import SimpleNamespace
+
+from biscuit.common.io import FRAME_BUFFER_SIZE, IO
+
+
+def frame(body: bytes) -> bytes:
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+class Trickle(io.RawIOBase):
+    """Stream handing out its data in pieces of the sizes given"""
+
+    def __init__(self, data, sizes):
+        self.data = memoryview(data)
+        self.sizes = iter(sizes)
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), next(self.sizes, len(buffer)))
+        piece = self.data[self.pos : self.pos + size]
+        buffer[: len(piece)] = piece
+        self.pos += len(piece)
+        return len(piece)
+
+
+def read_frames(data, sizes=(), buffer_size=io.DEFAULT_BUFFER_SIZE):
+    reader = IO(SimpleNamespace(base=None), "", "", framed=True)
+    stream = io.BufferedReader(Trickle(data, sizes), buffer_size=buffer_size)
+    reader.p = SimpleNamespace(stdout=stream)
+    reader._process_frames()
+
+    frames = []
+    while not reader.out_queue.empty():
+        frames.append(reader.out_queue.get())
+    return frames
+
+
+class TestFramedReader:
+    bodies = [b'{"id": 1}', b"", "{\"text\": \"é中\"}".encode(), b"x" * 300]
+
+    # Tests that several frames arriving in one read are queued one by one
+    def test_frames_in_one_read(self):
+        data = b"".join(frame(body) for body in self.bodies)
+        assert read_frames(data) == [frame(body) for body in self.bodies]
+
+    # Tests that frames are read whole however the stream is cut
+    def test_arbitrary_boundaries(self):
+        data = b"".join(frame(body) for body in self.bodies)
+        expected = [frame(body) for body in self.bodies]
+
+        assert read_frames(data, [1] * len(data), buffer_size=1) == expected
+        rng = random.Random(0)
+        for _ in range(50):
+            sizes = [rng.randint(1, 40) for _ in range(len(data))]
+            assert read_frames(data, sizes, buffer_size=rng.randint(1, 64)) == expected
+
+    # Tests that headers split across reads and extra headers are parsed
+    def test_split_header(self):
+        data = b'Content-Type: application/json\r\ncontent-length: 2\r\n\r\n{}'
+        for cut in range(1, len(data)):
+            assert read_frames(data, [cut, len(data)], buffer_size=1) == [data]
+
+    # Tests that frames larger than the buffer grow it and are read whole
+    def test_large_frames(self):
+        size = FRAME_BUFFER_SIZE
+        bodies = [b"a" * (3 * size + 1), b"b" * 10, b"c" * size]
+        data = b"".join(frame(body) for body in bodies)
+        assert read_frames(data, [4096] * len(data)) == [frame(b) for b in bodies]
+
+    # Tests that headers without a length are passed on and a cut off frame is dropped
+    def test_unframed_and_truncated(self):
+        data = b"warning\r\n\r\n" + frame(b"{}") + frame(b"1234")[:-1]
+        assert read_frames(data) == [b"warning\r\n\r\n", frame(b"{}")]
+
+    # Tests that a process writing large responses has them all read in order
+    def test_process(self, tmp_path):
+        script = tmp_path / "server.py"
+        script.write_text(
+            "import sys\n"
+            "for i in range(10):\n"
+            "    body = str(i).encode() * (2 << 20)\n"
+            "    header = b'Content-Length: %d\\r\\n\\r\\n' % len(body)\n"
+            "    sys.stdout.buffer.write(header + body)\n"
+            "sys.stdout.flush()\n"
+        )
+        process = IO(
+            SimpleNamespace(base=None),
+            f'"{sys.executable}" "{script}"',
+            str(tmp_path),
+            framed=True,
+        )
+        process.spawn()
+
+        output = bytearray()
+        while (data := process.read()) != b"":
+            output += data or b""
+        process.stop()
+
+        expected = b"".join(frame(str(i).encode() * (2 << 20)) for i in range(10))
+        assert output == expected
+
+
+class TestStop:
+    # Tests that a process exiting in time is left to exit, and reaped
+    def test_exits_in_time(self, tmp_path):
+        process = IO(
+            SimpleNamespace(base=None), f'"{sys.executable}" -c ""', str(tmp_path)
+        )
+        process.spawn()
+        process.stop(timeout=10)
+        assert process.p.returncode == 0
+
+    # Tests that a process still running is terminated along with the ones it started
+    def test_terminated(self, tmp_path):
+        process = IO(
+            SimpleNamespace(base=None),
+            f'"{sys.executable}" -c "import time; time.sleep(60)"',
+            str(tmp_path),
+        )
+        process.spawn()
+        process.stop(timeout=0.1)
+        assert process.p.returncode not in (None, 0)
+
+        process.t_out.join(5)
+        assert not process.t_out.is_alive()
+        assert process.read() == b""
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from biscuit.language.client import LangServerClient
+from biscuit.language.data import COMPLETION, HOVER
+
+
+class Tab:
+    """Stands in for an editor tab, only its version is read"""
+
+    version = 1
+
+
+def client(root):
+    client = LangServerClient(SimpleNamespace(base=None), "python", "", str(root))
+    sent = []
+    client.client = SimpleNamespace(
+        _send_notification=lambda method, params: sent.append((method, params))
+    )
+    return client, sent
+
+
+class TestRequestSlots:
+    # Tests that a request cancels the unanswered one of the same tab and method
+    def test_supersede(self, tmp_path):
+        lsp, sent = client(tmp_path)
+        tab, other = Tab(), Tab()
+
+        lsp.supersede(tab, HOVER, 1)
+        lsp.hover_requests[1] = (tab, "1.0")
+        lsp.supersede(tab, COMPLETION, 2)
+        lsp.supersede(other, HOVER, 3)
+        assert sent == []
+
+        lsp.supersede(tab, HOVER, 4)
+        assert sent == [("$/cancelRequest", {"id": 1})]
+        assert 1 not in lsp.hover_requests
+        assert lsp.slots == {
+            (tab, HOVER): (4, 1),
+            (tab, COMPLETION): (2, 1),
+            (other, HOVER): (3, 1),
+        }
+
+    # Tests that only responses to the latest request of an unchanged tab are wanted
+    def test_settle(self, tmp_path):
+        lsp, _ = client(tmp_path)
+        tab = Tab()
+        lsp.tabs_opened.add(tab)
+
+        lsp.supersede(tab, HOVER, 1)
+        assert lsp.settle(tab, HOVER, 1)
+        assert (tab, HOVER) not in lsp.slots
+
+        # superseded, the slot is kept for the latest request
+        lsp.supersede(tab, HOVER, 2)
+        lsp.supersede(tab, HOVER, 3)
+        assert not lsp.settle(tab, HOVER, 2)
+        assert lsp.slots[(tab, HOVER)] == (3, 1)
+
+        # the document changed after the request was sent
+        tab.version = 2
+        assert not lsp.settle(tab, HOVER, 3)
+        assert (tab, HOVER) not in lsp.slots
+
+        # the tab was closed meanwhile
+        lsp.supersede(tab, HOVER, 4)
+        lsp.tabs_opened.discard(tab)
+        assert not lsp.settle(tab, HOVER, 4)
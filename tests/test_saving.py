@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from biscuit.saving import SaveManager
+
+
+class Base:
+    """Stands in for the app, runs the scheduled callbacks when pumped"""
+
+    def __init__(self):
+        self.scheduled = []
+        self.errors = []
+        self.logger = SimpleNamespace(error=self.errors.append)
+        self.notifications = SimpleNamespace(error=lambda _: None)
+
+    def after(self, _, callback):
+        self.scheduled.append(callback)
+
+    def pump(self, manager):
+        while manager.polling:
+            time.sleep(0.01)
+            scheduled, self.scheduled = self.scheduled, []
+            for callback in scheduled:
+                callback()
+
+
+class TestSaveManager:
+    # Tests that a file is written and the callback runs when polled
+    def test_save(self, tmp_path):
+        base = Base()
+        manager = SaveManager(base)
+        path = tmp_path / "file.txt"
+        saved = []
+
+        manager.save(str(path), "a\nb", eol="CRLF", on_saved=lambda: saved.append(1))
+        base.pump(manager)
+        assert path.read_bytes() == b"a\r\nb"
+        assert saved == [1]
+        assert manager.metrics["saves"] == 1
+        assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
+
+    # Tests that saves made while a path is written are coalesced into the latest
+    def test_coalescing(self, tmp_path):
+        base = Base()
+        manager = SaveManager(base)
+        path = tmp_path / "file.txt"
+        written = []
+        release = threading.Event()
+
+        write_file = manager.write_file
+
+        def blocking(path, data):
+            release.wait(5)
+            written.append(data)
+            write_file(path, data)
+
+        manager.write_file = blocking
+        calls = []
+        for text in ("one", "two", "three"):
+            manager.save(str(path), text, on_saved=lambda text=text: calls.append(text))
+        release.set()
+        base.pump(manager)
+
+        assert written == [b"one", b"three"]
+        assert path.read_text() == "three"
+        assert calls == ["one", "two", "three"]
+        assert manager.metrics["coalesced"] == 1
+
+    # Tests that a failed write is reported and leaves nothing behind
+    def test_failure(self, tmp_path):
+        base = Base()
+        manager = SaveManager(base)
+        failed = []
+
+        path = tmp_path / "missing" / "file.txt"
+        manager.save(str(path), "text", on_failed=lambda: failed.append(1))
+        base.pump(manager)
+        assert failed == [1]
+        assert manager.metrics["failed"] == 1
+        assert str(path) in base.errors[0]
+
+    # Tests that symlinks and hard links keep pointing at the saved content
+    def test_links(self, tmp_path):
+        base = Base()
+        manager = SaveManager(base)
+        target = tmp_path / "target.txt"
+        target.write_text("old")
+        symlink = tmp_path / "symlink.txt"
+        symlink.symlink_to(target)
+        hardlink = tmp_path / "hardlink.txt"
+        os.link(target, hardlink)
+        inode = target.stat().st_ino
+
+        manager.save(str(symlink), "via symlink")
+        base.pump(manager)
+        assert symlink.is_symlink()
+        assert target.read_text() == hardlink.read_text() == "via symlink"
+
+        manager.save(str(hardlink), "via hardlink")
+        base.pump(manager)
+        assert target.read_text() == "via hardlink"
+        assert target.stat().st_ino == hardlink.stat().st_ino == inode
@@ -0,0 +1,74 @@
+from biscuit.editor.text.words import PROXIMITY_WINDOW, WordIndex
+
+
+def index(text, shared=None):
+    words = WordIndex(shared)
+    words.rebuild(text)
+    return words
+
+
+class TestWordIndex:
+    # Tests that completions are ranked by distance, then count, then name
+    def test_ranking(self):
+        words = index("value valid valid\nx\nvariable\nva")
+        assert words.complete("va", 4) == ["variable", "valid", "value"]
+        assert words.complete("va", 1) == ["valid", "value", "variable"]
+
+    # Tests that words only containing the term follow the ones starting with it
+    def test_includes(self):
+        words = index("start\nrestart\nstarter")
+        assert words.complete("star", 2) == ["start", "starter", "restart"]
+        assert words.complete("star", 2, limit=2) == ["start", "starter"]
+
+    # Tests that the word being typed is only offered when used elsewhere
+    def test_typed_word(self):
+        assert index("foo\nfoobar").complete("foo", 1) == ["foobar"]
+        assert index("foo\nfoo foobar").complete("foo", 1) == ["foo", "foobar"]
+
+    # Tests that far away words still complete, ranked after the nearby ones
+    def test_far_words(self):
+        lines = ["alpha"] + ["x"] * (2 * PROXIMITY_WINDOW) + ["alpine", "alps alps"]
+        words = index("\n".join(lines))
+        assert words.complete("al", 1) == ["alpha", "alps", "alpine"]
+
+    # Tests that counts are patched by edits, in the shared index too
+    def test_edited(self):
+        shared = WordIndex()
+        first = index("one two\nthree", shared)
+        second = index("two", shared)
+        assert shared.counts == {"one": 1, "two": 2, "three": 1}
+
+        first.edited(1, 2, ["one one"])
+        assert first.counts == {"one": 2}
+        assert shared.counts == {"one": 2, "two": 1}
+        assert list(shared.prefixed("t")) == ["two"]
+
+        second.clear()
+        assert shared.counts == {"one": 2}
+
+
+class TestSharedWords:
+    # Tests that opened tabs share their words before completing in either of them
+    def test_two_tabs(self, app_instance, tmp_path):
+        config = app_instance.settings.config
+        shared = config.shared_word_completions
+        config.shared_word_completions = True
+
+        texts = []
+        for name, content in (("first.txt", "alpha beta"), ("second.txt", "alps")):
+            path = tmp_path / name
+            path.write_text(content)
+            text = app_instance.open_editor(str(path)).content.text
+            while text.loading:
+                app_instance.update()
+            texts.append(text)
+
+        words = app_instance.autocomplete.words
+        assert words.counts == {"alpha": 1, "beta": 1, "alps": 1}
+        assert texts[0].get_word_completions("al") == ["alpha", "alps"]
+
+        app_instance.close_active_editor()
+        app_instance.update()
+        assert words.counts == {"alpha": 1, "beta": 1}
+        app_instance.close_active_editor()
+        config.shared_word_completions = shared